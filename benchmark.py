@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+import crawl_db
+from generate_synthetic_crawl import DEFAULT_SEED
+
+# --- Configuration ---
+DEFAULT_SIZES = [177, 2000, 20000]
+DEFAULT_WORK_DIR = 'benchmark_dbs'
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Every stage is (name, script, tables it reads); rows/s is computed over those tables.
+# The index bootstrap runs first, as in run_all_analyses.py.
+STAGES = [
+    ('indexes', 'crawl_db.py', ('crawl_history', 'http_requests', 'http_responses', 'javascript')),
+    ('a', 'question_a.py', ('site_visits', 'crawl_history', 'incomplete_visits')),
+    ('b', 'question_b.py', ('http_requests',)),
+    ('c', 'question_c.py', ('javascript',)),
+    ('d', 'question_d.py', ('http_responses',)),
+    ('e', 'question_e.py', ('http_responses', 'http_requests')),
+    ('f', 'question_f.py', ('javascript',)),
+]
+
+
+# --- Helper Functions ---
+
+def table_rows(db_path):
+    """Returns the row count of every table of the crawl DB."""
+    conn = crawl_db.connect_readonly(db_path)
+    try:
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables}
+    finally:
+        conn.close()
+
+
+def prepare_db(work_dir, visits, seed):
+    """
+    Returns the directory holding a synthetic crawl of `visits` visits, generating it
+    if needed. The DB is named like the real crawl, since the scripts open it from
+    their working directory.
+    """
+    run_dir = os.path.join(work_dir, f"visits-{visits}-seed-{seed}")
+    db_path = os.path.join(run_dir, crawl_db.DB_FILE)
+    if not os.path.exists(db_path):
+        os.makedirs(run_dir, exist_ok=True)
+        print(f"Generating {visits} visits into {db_path}...")
+        start = time.time()
+        tmp_path = db_path + '.tmp'
+        # Generated in a child process: on Linux a child's peak RSS starts at its
+        # parent's, so growing this process would inflate every later measurement
+        subprocess.run([sys.executable, os.path.join(REPO_DIR, 'generate_synthetic_crawl.py'),
+                        '--output', tmp_path, '--visits', str(visits), '--seed', str(seed)],
+                       check=True, stdout=subprocess.DEVNULL)
+        os.replace(tmp_path, db_path)
+        print(f"  done in {time.time() - start:.1f}s")
+    return run_dir
+
+
+def reset_run_dir(run_dir):
+    """Removes indexes and per-run state left by an earlier benchmark of the same DB."""
+    db_path = os.path.join(run_dir, crawl_db.DB_FILE)
+    conn = sqlite3.connect(db_path)
+    try:
+        for name, _, _ in crawl_db.ANALYSIS_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.commit()
+    finally:
+        conn.close()
+    for suffix in ('.indexes.json', '.checkpoints'):
+        path = db_path + suffix
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def run_stage(script, run_dir):
+    """
+    Runs one script against the DB in run_dir. Returns its exit status, wall and CPU
+    seconds and peak RSS in MiB, taken from the rusage of that process alone.
+    """
+    env = os.environ.copy()
+    env["PYTHONWARNINGS"] = "ignore::DeprecationWarning,ignore::FutureWarning"
+    env["MPLBACKEND"] = "Agg"
+    start = time.time()
+    process = subprocess.Popen([sys.executable, '-W', 'ignore', os.path.join(REPO_DIR, script)],
+                               cwd=run_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # Drain stderr so a chatty script cannot block on a full pipe
+    stderr = process.stderr.read()
+    process.stderr.close()
+    # wait4 reports the resource usage of this child only (unlike RUSAGE_CHILDREN)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.time() - start
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss_mib = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return {
+        'returncode': process.returncode,
+        'seconds': seconds,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'peak_rss_mib': rss_mib,
+        'stderr': stderr.decode('utf-8', 'replace'),
+    }
+
+
+def benchmark(sizes, stages, work_dir, seed):
+    """Runs every stage at every size; returns one result dict per (size, stage)."""
+    results = []
+    for visits in sizes:
+        run_dir = prepare_db(work_dir, visits, seed)
+        reset_run_dir(run_dir)
+        rows = table_rows(os.path.join(run_dir, crawl_db.DB_FILE))
+        print(f"\n{visits} visits: " + ", ".join(f"{table} {count}" for table, count in rows.items()))
+        for name, script, tables in STAGES:
+            if name not in stages:
+                continue
+            result = run_stage(script, run_dir)
+            stage_rows = sum(rows.get(table, 0) for table in tables)
+            result.update({'visits': visits, 'stage': name, 'script': script, 'rows': stage_rows,
+                           'rows_per_second': stage_rows / result['seconds'] if result['seconds'] else 0.0})
+            status = 'ok' if result['returncode'] == 0 else f"exit {result['returncode']}"
+            print(f"  {script:<16} {status:<8} {result['seconds']:>8.2f}s {result['cpu_seconds']:>8.2f}s cpu "
+                  f"{result['rows_per_second']:>12,.0f} rows/s {result['peak_rss_mib']:>8.1f} MiB")
+            if result['returncode'] != 0:
+                print("    " + "\n    ".join(result['stderr'].strip().splitlines()[-5:]))
+            results.append(result)
+    return results
+
+
+def print_scaling(results):
+    """Prints the time of every stage relative to the smallest size, to spot superlinear growth."""
+    sizes = sorted({result['visits'] for result in results})
+    if len(sizes) < 2:
+        return
+    print("\nTime per visit relative to the smallest size (1.00 = linear scaling):")
+    by_key = {(result['stage'], result['visits']): result for result in results}
+    for name, script, _ in STAGES:
+        base = by_key.get((name, sizes[0]))
+        if not base or not base['seconds']:
+            continue
+        ratios = []
+        for visits in sizes:
+            result = by_key.get((name, visits))
+            if result:
+                ratios.append(f"{(result['seconds'] / visits) / (base['seconds'] / sizes[0]):>6.2f}")
+        print(f"  {script:<16} " + " ".join(ratios))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analyses on synthetic crawls of several sizes.")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma-separated visit counts (default: %(default)s).")
+    parser.add_argument('--only', help="Comma-separated stages to run, e.g. 'indexes,b,f' (default: all).")
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR,
+                        help="Directory where the generated DBs are kept between runs.")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="Generator seed.")
+    parser.add_argument('--json', help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    stages = ({stage.strip() for stage in args.only.split(',')} if args.only
+              else {name for name, _, _ in STAGES})
+    results = benchmark(sizes, stages, os.path.abspath(args.work_dir), args.seed)
+    print_scaling(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([{key: value for key, value in result.items() if key != 'stderr'} for result in results],
+                      f, indent=2)
+    sys.exit(0 if all(result['returncode'] == 0 for result in results) else 1)
@@ -0,0 +1,73 @@
+import logging
+import os
+import pickle
+import time
+
+# --- Configuration ---
+CHECKPOINT_VERSION = 1
+
+
+# --- Helper Functions ---
+
+def checkpoint_path(db_path, analysis):
+    """Returns the checkpoint file of one analysis, kept next to the crawl DB."""
+    return os.path.join(db_path + '.checkpoints', f"{analysis}.pickle")
+
+
+def load_checkpoint(db_path, analysis, params):
+    """
+    Returns the saved state of an analysis, or None when there is no checkpoint
+    or it was computed with different parameters (e.g. MIN_COOKIE_VALUE_LEN).
+    The state holds 'processed_visits' (the set of visit_ids already folded in)
+    and 'aggregates' (the analysis' mergeable results).
+    """
+    path = checkpoint_path(db_path, analysis)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        logging.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+        return None
+    if state.get('version') != CHECKPOINT_VERSION or state.get('params') != params:
+        logging.info(f"Checkpoint {path} was built with different parameters; recomputing.")
+        return None
+    return state
+
+
+def save_checkpoint(db_path, analysis, params, processed_visits, aggregates):
+    """Atomically writes the state of an analysis."""
+    path = checkpoint_path(db_path, analysis)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    state = {
+        'version': CHECKPOINT_VERSION,
+        'params': params,
+        'saved_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'processed_visits': set(processed_visits),
+        'aggregates': aggregates,
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def plan_incremental(db_path, analysis, params, successful_visit_ids):
+    """
+    Splits the successful visits into those already covered by the checkpoint and
+    new ones. Returns (aggregates or None, processed_visits, new_visits); when the
+    checkpoint is missing or stale, every visit is new.
+    """
+    successful_visit_ids = set(successful_visit_ids)
+    state = load_checkpoint(db_path, analysis, params)
+    if state is None:
+        return None, set(), successful_visit_ids
+    processed = state['processed_visits']
+    if not processed <= successful_visit_ids:
+        # Visits disappeared, so this is a different or rewritten crawl
+        logging.info(f"Checkpoint for {analysis} does not match this crawl; recomputing.")
+        return None, set(), successful_visit_ids
+    new_visits = successful_visit_ids - processed
+    logging.info(f"Checkpoint for {analysis}: {len(processed)} visits already processed, {len(new_visits)} new.")
+    return state['aggregates'], processed, new_visits
@@ -0,0 +1,109 @@
+import json
+import re
+
+# --- Configuration ---
+# Minimum length for a cookie value to be considered for syncing
+MIN_COOKIE_VALUE_LEN = 6
+
+
+# --- Helper Functions ---
+
+def extract_cookie_name(set_cookie_value):
+    """Extracts the cookie name from a Set-Cookie header value."""
+    if not isinstance(set_cookie_value, str):
+        return None
+    # Cookie name is the part before the first '='
+    match = re.match(r'^([^=]+)=', set_cookie_value.strip())
+    if match:
+        return match.group(1).strip()
+    return None
+
+
+def parse_cookie_string(cookie_str):
+    """
+    Parses the value from a Set-Cookie header string.
+    Returns the cookie value or None if parsing fails.
+    """
+    if not cookie_str or '=' not in cookie_str:
+        return None
+    # Get the part before the first semicolon (if any)
+    name_value_part = cookie_str.split(';', 1)[0]
+    # Split by the first '='
+    parts = name_value_part.split('=', 1)
+    if len(parts) == 2:
+        # Return the value part, stripping whitespace
+        return parts[1].strip()
+    return None
+
+
+def may_contain_set_cookie(raw_headers):
+    """
+    Cheap byte-level check of a headers JSON value given as bytes. Returns False only
+    when no header can be named Set-Cookie (in any case), so the value need not be
+    decoded at all; most responses set no cookies.
+    """
+    if b'set-cookie' in raw_headers.lower():
+        return True
+    # Non-ASCII text or \u escapes could decode to a matching name
+    return not raw_headers.isascii() or b'\\u' in raw_headers
+
+
+def iter_set_cookie_pairs(headers):
+    """
+    Yields the value of every Set-Cookie header in an already decoded
+    `[[name, value], ...]` header list. Malformed pairs are skipped.
+    """
+    if not isinstance(headers, list):
+        return
+    for header_pair in headers:
+        # Check if it's a list/tuple with 2 elements: [name, value]
+        if isinstance(header_pair, (list, tuple)) and len(header_pair) == 2:
+            header_name, header_value = header_pair
+            # Case-insensitive check for 'Set-Cookie'
+            if isinstance(header_name, str) and header_name.lower() == 'set-cookie':
+                yield header_value
+
+
+def set_cookie_values_from_headers(headers, min_len=MIN_COOKIE_VALUE_LEN):
+    """
+    Extracts all cookie values from Set-Cookie headers in already decoded headers.
+    Accepts both the `[[name, value], ...]` list format and the older dict format.
+    """
+    values = set()
+    try:
+        if isinstance(headers, list):
+            for header_pair in headers:
+                if len(header_pair) == 2 and header_pair[0].lower() == 'set-cookie':
+                    # Value might itself contain multiple cookies separated by newline in older formats
+                    # Or just be a single cookie string
+                    for single_cookie_str in header_pair[1].split('\n'):
+                        value = parse_cookie_string(single_cookie_str)
+                        if value and len(value) >= min_len:
+                            values.add(value)
+
+        elif isinstance(headers, dict):
+            # dict format loses multiple headers with the same name unless value concatenates them.
+            for key, header_content in headers.items():
+                if key.lower() == 'set-cookie':
+                    # The value associated with 'set-cookie' might be a single string
+                    # or multiple strings joined by newline
+                    for single_cookie_str in header_content.split('\n'):
+                        value = parse_cookie_string(single_cookie_str)
+                        if value and len(value) >= min_len:
+                            values.add(value)
+
+    except (TypeError, AttributeError):
+        pass
+    return values
+
+
+def extract_set_cookie_values(headers_json, min_len=MIN_COOKIE_VALUE_LEN):
+    """
+    Extracts all cookie values from Set-Cookie headers in the headers JSON.
+    Handles multiple Set-Cookie headers.
+    """
+    try:
+        headers = json.loads(headers_json)
+    except (json.JSONDecodeError, TypeError):
+        return set()
+    return set_cookie_values_from_headers(headers, min_len)
@@ -0,0 +1,340 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+from hashlib import blake2b
+from urllib.parse import quote
+
+from run_metrics import RunMetrics
+
+# --- Configuration ---
+DB_FILE = 'crawl-data-177.sqlite'
+# Placeholder of the run options parsed from their environment variable when first
+# looked up (see ENVIRONMENT_OPTIONS), so that a malformed value fails the analyses
+# using it with a clear error instead of every import of this module
+FROM_ENVIRONMENT = object()
+# Columnar snapshot written by crawl_snapshot.py; when set, questions B and C load
+# from the snapshot instead of SQLite (the other analyses always read SQLite)
+SNAPSHOT_DIR = os.environ.get('CRAWL_SNAPSHOT_DIR')
+# When set, D, E and F only process visits not covered by their checkpoints
+INCREMENTAL = os.environ.get('CRAWL_INCREMENTAL') == '1'
+# When set, B streams http_requests in chunks instead of loading them into a DataFrame
+STREAMING = os.environ.get('CRAWL_STREAMING') == '1'
+# When set, B and E only write their pre-binned histograms and leave rendering the
+# PNGs to a separate plot stage (histograms.py)
+DEFER_PLOTS = os.environ.get('CRAWL_DEFER_PLOTS') == '1'
+# When set, read connections open the crawl as immutable: SQLite then takes no locks
+# and never checks for changes, so only use it for crawls that are no longer written
+IMMUTABLE = os.environ.get('CRAWL_IMMUTABLE') == '1'
+# When set, B, D and F keep fixed-memory sketches (see sketches.py) instead of exact
+# counters, and report the error bounds of their approximate results
+SKETCH = os.environ.get('CRAWL_SKETCH') == '1'
+# When set, the analyses only use a reproducible sample of the successful visits:
+# a fraction ('0.05') or a number of visits ('500'), drawn with SAMPLE_SEED and,
+# with SAMPLE_STRATA, allocated proportionally to the strata (see SAMPLE_STRATA_KEYS)
+SAMPLE = FROM_ENVIRONMENT
+SAMPLE_SEED = FROM_ENVIRONMENT
+SAMPLE_STRATA = FROM_ENVIRONMENT
+# When set, query and stage results are memoized in this directory, keyed on the
+# crawl DB's fingerprint and the parameters (see result_cache.py)
+CACHE_DIR = os.environ.get('CRAWL_CACHE_DIR')
+# When set (in MiB), E and F spill their per-visit state to hash-partitioned runs on
+# disk once it outgrows this budget, and finish one partition at a time (see spill.py)
+MEMORY_BUDGET = FROM_ENVIRONMENT
+
+# PRAGMAs applied to every read connection; the analyses mostly run long sequential
+# scans, which benefit from memory-mapped I/O and a larger page cache
+READ_PRAGMAS = {
+    'mmap_size': 1 << 30,    # Memory-map up to 1 GiB of the database file
+    'cache_size': -65536,    # 64 MiB page cache (negative values are KiB)
+    'temp_store': 'MEMORY',  # Temporary B-trees for GROUP BY / DISTINCT / ORDER BY stay in RAM
+    'query_only': 1,
+}
+
+# Visits whose page load succeeded; every analysis except A is restricted to these
+ALL_SUCCESSFUL_VISITS_QUERY = """
+    SELECT DISTINCT visit_id
+    FROM crawl_history
+    WHERE command = 'GetCommand' AND command_status = 'ok'
+"""
+
+# Strata for stratified sampling, as SQL expressions over site_visits (sv)
+SAMPLE_STRATA_KEYS = {
+    # Order of magnitude of the site's rank: 1-9, 10-99, 100-999, ...
+    'rank': "length(CAST(COALESCE(sv.site_rank, 0) AS TEXT))",
+    'browser': "sv.browser_id",
+}
+
+# Indexes the analyses rely on: (name, table, columns)
+ANALYSIS_INDEXES = [
+    ('idx_analysis_crawl_history_command', 'crawl_history', ('command', 'command_status', 'visit_id')),
+    ('idx_analysis_http_requests_visit', 'http_requests', ('visit_id',)),
+    ('idx_analysis_http_responses_visit', 'http_responses', ('visit_id',)),
+    ('idx_analysis_javascript_visit', 'javascript', ('visit_id',)),
+    ('idx_analysis_javascript_symbol', 'javascript', ('symbol', 'operation')),
+]
+
+
+# --- Helper Functions ---
+
+def sample_key(visit_id, seed):
+    """Pseudo-random but reproducible sort key of a visit; registered in SQL as sample_key()."""
+    return int.from_bytes(blake2b(f"{seed}:{visit_id}".encode(), digest_size=8).digest(), 'little') >> 1
+
+
+def parse_sample(sample):
+    """
+    Returns the sample size `sample` stands for: a positive number of visits (int) or
+    a fraction of them in (0, 1] (float). Raises ValueError for anything else.
+    """
+    try:
+        count = int(sample)
+    except ValueError:
+        try:
+            fraction = float(sample)
+        except ValueError:
+            raise ValueError(f"Sample must be a fraction in (0, 1] or a positive number of visits: {sample!r}")
+        if not 0 < fraction <= 1:
+            raise ValueError(f"Sample fraction must be in (0, 1]: {sample}")
+        return fraction
+    if count <= 0:
+        raise ValueError(f"Sample count must be positive: {sample}")
+    return count
+
+
+def parse_memory_budget(budget):
+    """
+    Returns the memory budget `budget` stands for, in MiB (an int, or a float below
+    1 MiB or with a fraction). Raises ValueError unless it is a number >= 0.
+    """
+    try:
+        mib = float(budget)
+    except (TypeError, ValueError):
+        raise ValueError(f"Memory budget must be a number of MiB: {budget!r}")
+    if not 0 <= mib < float('inf'):
+        raise ValueError(f"Memory budget must be a number of MiB >= 0: {budget}")
+    return int(mib) if mib.is_integer() else mib
+
+
+def check_sample_strata(strata):
+    """Returns `strata` if it names strata of SAMPLE_STRATA_KEYS; raises ValueError otherwise."""
+    if strata not in SAMPLE_STRATA_KEYS:
+        raise ValueError(f"Sample strata must be one of {', '.join(sorted(SAMPLE_STRATA_KEYS))}: {strata}")
+    return strata
+
+
+def environment_option(variable, parse, default=None):
+    """Returns the parsed value of an environment variable, or `default` when it is unset."""
+    value = os.environ.get(variable)
+    if not value:
+        return default
+    try:
+        return parse(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid {variable}: {e}") from None
+
+
+def sampled_visits_query(sample, seed=0, strata=None):
+    """
+    Returns a query selecting a sample of the successful visits: the first ones by
+    sample_key() within each stratum, in proportion to the stratum's size (rounded
+    up). `sample` is a fraction ('0.05') or a number of visits ('500'), see parse_sample().
+    """
+    stratum = SAMPLE_STRATA_KEYS[check_sample_strata(strata)] if strata else "0"
+    size = parse_sample(sample)
+    if isinstance(size, float):
+        keep = f"sample_position - 1 < stratum_size * {size!r}"
+    else:
+        keep = f"(sample_position - 1) * population < stratum_size * {size}"
+    return f"""
+    SELECT visit_id FROM (
+        SELECT ok.visit_id,
+               ROW_NUMBER() OVER (PARTITION BY {stratum} ORDER BY sample_key(ok.visit_id, {int(seed)})) AS sample_position,
+               COUNT(*) OVER (PARTITION BY {stratum}) AS stratum_size,
+               COUNT(*) OVER () AS population
+        FROM ({ALL_SUCCESSFUL_VISITS_QUERY}) ok
+        LEFT JOIN site_visits sv ON sv.visit_id = ok.visit_id
+    )
+    WHERE {keep}
+"""
+
+
+def successful_visits_query(sample=None, seed=0, strata=None):
+    """Returns the query of the visits analyses are restricted to: all successful ones, or a sample."""
+    return sampled_visits_query(sample, seed, strata) if sample else ALL_SUCCESSFUL_VISITS_QUERY
+
+
+# The successful visits the analyses use (a sample of them when SAMPLE is set)
+SUCCESSFUL_VISITS_QUERY = FROM_ENVIRONMENT
+
+# How the run options left FROM_ENVIRONMENT are parsed on first use
+ENVIRONMENT_OPTIONS = {
+    'SAMPLE': lambda: environment_option('CRAWL_SAMPLE', lambda sample: parse_sample(sample) and sample),
+    'SAMPLE_SEED': lambda: environment_option('CRAWL_SAMPLE_SEED', int, 0),
+    'SAMPLE_STRATA': lambda: environment_option('CRAWL_SAMPLE_STRATA', check_sample_strata),
+    'MEMORY_BUDGET': lambda: environment_option('CRAWL_MEMORY_BUDGET', parse_memory_budget),
+    'SUCCESSFUL_VISITS_QUERY': lambda: successful_visits_query(
+        run_option('SAMPLE'), run_option('SAMPLE_SEED'), run_option('SAMPLE_STRATA')),
+}
+
+
+def join_successful_visits(alias):
+    """Returns a JOIN clause restricting the table aliased `alias` to successful visits."""
+    return f"JOIN ({run_option('SUCCESSFUL_VISITS_QUERY')}) ok_visits ON ok_visits.visit_id = {alias}.visit_id"
+
+
+def visit_subset_clause(alias):
+    """
+    Returns a WHERE condition restricting `alias` to an explicit set of visit_ids.
+    The ids are bound as a single JSON array parameter (see visit_subset_param),
+    which avoids SQLite's bound-parameter limit on large sets.
+    """
+    return f"{alias}.visit_id IN (SELECT value FROM json_each(?))"
+
+
+def visit_subset_param(visit_ids):
+    """Returns the parameter to bind for visit_subset_clause()."""
+    return json.dumps(sorted(visit_ids))
+
+
+def run_option(name, value=None):
+    """
+    Returns `value`, or when it is None the current run option `name` of this module
+    (e.g. 'SKETCH', 'SUCCESSFUL_VISITS_QUERY'). Analyses look their options up when
+    they run, so set_run_options() applies to modules imported before the call too.
+    Options still FROM_ENVIRONMENT are parsed now; a malformed environment variable
+    raises ValueError.
+    """
+    if value is not None:
+        return value
+    value = globals()[name]
+    if value is FROM_ENVIRONMENT:
+        value = globals()[name] = ENVIRONMENT_OPTIONS[name]()
+    return value
+
+
+def set_run_options(snapshot_dir=None, incremental=False, streaming=False, immutable=False, defer_plots=False,
+                    sketch=False, sample=None, sample_seed=0, sample_strata=None, cache_dir=None,
+                    memory_budget=None):
+    """
+    Sets the run options the analyses read from this module (see run_option()), and
+    exports them to the environment for subprocesses. Raises ValueError for a
+    malformed sample or memory budget.
+    """
+    if memory_budget is not None:
+        memory_budget = parse_memory_budget(memory_budget)
+    global SNAPSHOT_DIR, INCREMENTAL, STREAMING, IMMUTABLE, DEFER_PLOTS, SKETCH
+    global SAMPLE, SAMPLE_SEED, SAMPLE_STRATA, SUCCESSFUL_VISITS_QUERY, CACHE_DIR, MEMORY_BUDGET
+    SNAPSHOT_DIR, INCREMENTAL, STREAMING, IMMUTABLE = snapshot_dir, incremental, streaming, immutable
+    DEFER_PLOTS, SKETCH = defer_plots, sketch
+    SAMPLE, SAMPLE_SEED, SAMPLE_STRATA = sample, sample_seed, sample_strata
+    SUCCESSFUL_VISITS_QUERY = successful_visits_query(sample, sample_seed, sample_strata)
+    CACHE_DIR, MEMORY_BUDGET = cache_dir, memory_budget
+    for name, value in [('CRAWL_SNAPSHOT_DIR', snapshot_dir), ('CRAWL_INCREMENTAL', incremental),
+                        ('CRAWL_STREAMING', streaming), ('CRAWL_IMMUTABLE', immutable),
+                        ('CRAWL_DEFER_PLOTS', defer_plots), ('CRAWL_SKETCH', sketch),
+                        ('CRAWL_SAMPLE', sample), ('CRAWL_SAMPLE_SEED', sample and str(sample_seed)),
+                        ('CRAWL_SAMPLE_STRATA', sample and sample_strata), ('CRAWL_CACHE_DIR', cache_dir),
+                        ('CRAWL_MEMORY_BUDGET', None if memory_budget is None else str(memory_budget))]:
+        if value:
+            os.environ[name] = '1' if value is True else value
+        else:
+            os.environ.pop(name, None)
+
+
+def read_only_uri(db_path, immutable=None):
+    """Returns the SQLite URI opening db_path read-only (and optionally immutable)."""
+    if immutable is None:
+        immutable = IMMUTABLE
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+    return uri + "&immutable=1" if immutable else uri
+
+
+def connect_readonly(db_path=DB_FILE, immutable=None, pragmas=None, check_same_thread=True):
+    """
+    Opens a tuned read-only connection to the crawl database. Every call returns a
+    new, independent connection, so worker processes and threads each open their
+    own. `immutable` defaults to IMMUTABLE; `pragmas` overrides or extends READ_PRAGMAS.
+    """
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Database file not found: {db_path}")
+    conn = sqlite3.connect(read_only_uri(db_path, immutable), uri=True, check_same_thread=check_same_thread)
+    for name, value in {**READ_PRAGMAS, **(pragmas or {})}.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    # Used by SUCCESSFUL_VISITS_QUERY when sampling
+    conn.create_function('sample_key', 2, sample_key, deterministic=True)
+    return conn
+
+
+def index_record_path(db_path):
+    """Returns the path of the sidecar file recording the bootstrapped indexes."""
+    return db_path + '.indexes.json'
+
+
+def existing_indexes(conn):
+    """Returns the names of all indexes already present in the database."""
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+    return {row[0] for row in rows}
+
+
+def bootstrap_indexes(db_path=DB_FILE):
+    """
+    Creates any missing analysis index and records them in a sidecar JSON file.
+    Returns the names of the indexes created; nothing is written when all exist.
+    """
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Database file not found: {db_path}")
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        present = existing_indexes(conn)
+        missing = [index for index in ANALYSIS_INDEXES if index[0] not in present and index[1] in tables]
+        if not missing:
+            logging.info("All analysis indexes already exist; skipping bootstrap.")
+            return []
+
+        record_path = index_record_path(db_path)
+        record = {}
+        if os.path.exists(record_path):
+            with open(record_path) as f:
+                record = json.load(f)
+
+        metrics = RunMetrics('indexes')
+        for name, table, columns in missing:
+            logging.info(f"Creating index {name} on {table}({', '.join(columns)})...")
+            start = time.time()
+            with metrics.stage(f"create {name}"):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+            record[name] = {
+                'table': table,
+                'columns': list(columns),
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'seconds': round(time.time() - start, 3),
+            }
+        # Refresh planner statistics so the new indexes are actually chosen
+        with metrics.stage("analyze"):
+            conn.execute("ANALYZE")
+        conn.commit()
+
+        with open(record_path, 'w') as f:
+            json.dump(record, f, indent=2)
+        return [index[0] for index in missing]
+    finally:
+        conn.close()
+
+
+def main(db_path=DB_FILE):
+    """Bootstraps the analysis indexes and prints what was created."""
+    created = bootstrap_indexes(db_path)
+    print(f"Created {len(created)} index(es): {', '.join(created) if created else 'none needed'}")
+    return created
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Create the indexes used by the analyses.")
+    parser.add_argument('db', nargs='?', default=DB_FILE, help="Path of the crawl database.")
+    args = parser.parse_args()
+    main(args.db)
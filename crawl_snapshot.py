@@ -0,0 +1,222 @@
+import argparse
+import json
+import logging
+import os
+import time
+from array import array
+
+import numpy as np
+
+from crawl_db import connect_readonly
+
+# --- Configuration ---
+# Columns exported for each table; 'int' columns are stored as int64 arrays,
+# 'str' columns are dictionary-encoded (int32 codes plus a table of distinct strings)
+SNAPSHOT_COLUMNS = {
+    'site_visits': [('visit_id', 'int'), ('site_url', 'str')],
+    'crawl_history': [('visit_id', 'int'), ('command', 'str'), ('command_status', 'str'), ('error', 'str')],
+    'incomplete_visits': [('visit_id', 'int')],
+    'http_requests': [('visit_id', 'int'), ('url', 'str')],
+    'http_responses': [('visit_id', 'int'), ('headers', 'str')],
+    'javascript': [('visit_id', 'int'), ('script_url', 'str'), ('symbol', 'str'),
+                   ('operation', 'str'), ('top_level_url', 'str')],
+}
+MANIFEST_FILE = 'manifest.json'
+EXPORT_BATCH_SIZE = 100000
+# Code used for NULL strings; integer NULLs are stored as this value too
+NULL_CODE = -1
+
+
+# --- Helper Functions ---
+
+def _column_path(snapshot_dir, table, column, suffix):
+    return os.path.join(snapshot_dir, table, f"{column}.{suffix}")
+
+
+class _StringDictionary:
+    """Incrementally assigns an integer code to every distinct string of a column."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        if value is None:
+            return NULL_CODE
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def save(self, path_prefix):
+        """Writes the strings as one UTF-8 heap plus an offsets array."""
+        encoded = [value.encode('utf-8', 'surrogatepass') for value in self.values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded], dtype=np.int64)
+        np.save(path_prefix + '.offsets.npy', offsets)
+        with open(path_prefix + '.strings.bin', 'wb') as f:
+            for value in encoded:
+                f.write(value)
+
+
+def export_table(conn, snapshot_dir, table, columns):
+    """Streams one table out of SQLite into column files; returns its row count."""
+    os.makedirs(os.path.join(snapshot_dir, table), exist_ok=True)
+    buffers = {}
+    dictionaries = {}
+    for name, kind in columns:
+        buffers[name] = array('q' if kind == 'int' else 'i')
+        if kind == 'str':
+            dictionaries[name] = _StringDictionary()
+
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(name for name, _ in columns)} FROM {table}")
+    rows_exported = 0
+    while True:
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+        if not rows:
+            break
+        rows_exported += len(rows)
+        for position, (name, kind) in enumerate(columns):
+            values = (row[position] for row in rows)
+            if kind == 'int':
+                buffers[name].extend(NULL_CODE if value is None else value for value in values)
+            else:
+                encode = dictionaries[name].encode
+                buffers[name].extend(encode(value) for value in values)
+    cursor.close()
+
+    for name, kind in columns:
+        dtype = np.int64 if kind == 'int' else np.int32
+        np.save(_column_path(snapshot_dir, table, name, 'npy'), np.frombuffer(buffers[name], dtype=dtype))
+        if kind == 'str':
+            dictionaries[name].save(_column_path(snapshot_dir, table, name, 'dict'))
+    return rows_exported
+
+
+def db_fingerprint(db_path):
+    """
+    Returns the size and modification time of the source DB and of its WAL file if
+    any, used to detect stale snapshots (see check_source()).
+    """
+    stat = os.stat(db_path)
+    fingerprint = {'path': os.path.abspath(db_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+    wal_path = db_path + '-wal'
+    if os.path.exists(wal_path):
+        wal = os.stat(wal_path)
+        fingerprint['wal'] = {'size': wal.st_size, 'mtime': wal.st_mtime}
+    return fingerprint
+
+
+def export_snapshot(db_path, snapshot_dir, tables=None):
+    """Exports the analysis columns of the crawl DB into a columnar snapshot directory."""
+    conn = connect_readonly(db_path)
+    try:
+        manifest = {'source': db_fingerprint(db_path), 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'tables': {}}
+        for table, columns in SNAPSHOT_COLUMNS.items():
+            if tables and table not in tables:
+                continue
+            logging.info(f"Exporting {table}...")
+            start = time.time()
+            rows = export_table(conn, snapshot_dir, table, columns)
+            manifest['tables'][table] = {'rows': rows, 'columns': dict(columns)}
+            logging.info(f"Exported {rows} rows from {table} in {time.time() - start:.1f}s.")
+    finally:
+        conn.close()
+
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(snapshot_dir):
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def stale_reason(snapshot_dir):
+    """
+    Returns why a snapshot no longer matches the crawl DB it was exported from, or
+    None if it still matches. A source DB that no longer exists at its recorded path
+    (e.g. a snapshot copied to another machine) cannot be checked and counts as a match.
+    """
+    source = load_manifest(snapshot_dir).get('source')
+    if not source or not os.path.exists(source['path']):
+        return None
+    current = db_fingerprint(source['path'])
+    changed = [key for key in ('size', 'mtime', 'wal') if current.get(key) != source.get(key)]
+    if not changed:
+        return None
+    return f"{source['path']} was modified after the snapshot was exported ({', '.join(changed)} changed)"
+
+
+def check_source(snapshot_dir):
+    """
+    Logs a warning if a snapshot is stale (see stale_reason()); analyses call it once
+    before loading from a snapshot. Returns False for a stale snapshot.
+    """
+    reason = stale_reason(snapshot_dir)
+    if reason:
+        logging.warning(f"Stale snapshot {snapshot_dir}: {reason}. Results reflect the crawl at export time; "
+                        f"re-run crawl_snapshot.py to refresh it.")
+    return reason is None
+
+
+def load_strings(snapshot_dir, table, column):
+    """Returns the distinct strings of a dictionary-encoded column as an object array."""
+    prefix = _column_path(snapshot_dir, table, column, 'dict')
+    offsets = np.load(prefix + '.offsets.npy')
+    with open(prefix + '.strings.bin', 'rb') as f:
+        heap = f.read()
+    return np.array([heap[start:end].decode('utf-8', 'surrogatepass')
+                     for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+
+
+def load_column(snapshot_dir, table, column, mmap=True):
+    """
+    Returns the stored array of a column: the values of an int column, or the codes
+    of a string column (NULL_CODE for NULL). With mmap=True the file is memory-mapped.
+    """
+    return np.load(_column_path(snapshot_dir, table, column, 'npy'), mmap_mode='r' if mmap else None)
+
+
+def load_frame(snapshot_dir, table, columns=None, mmap=True):
+    """
+    Loads snapshot columns into a DataFrame. String columns become pandas
+    Categoricals built directly from the stored codes, so no per-row Python
+    string objects are created.
+    """
+    import pandas as pd
+
+    kinds = load_manifest(snapshot_dir)['tables'][table]['columns']
+    data = {}
+    for column in columns or list(kinds):
+        values = load_column(snapshot_dir, table, column, mmap=mmap)
+        if kinds[column] == 'str':
+            data[column] = pd.Categorical.from_codes(values, categories=load_strings(snapshot_dir, table, column))
+        else:
+            data[column] = values
+    return pd.DataFrame(data)
+
+
+def successful_visit_ids(snapshot_dir):
+    """Returns the successful visit_ids of a snapshot, in order of first appearance."""
+    history = load_frame(snapshot_dir, 'crawl_history', ['visit_id', 'command', 'command_status'])
+    ok = history[(history['command'] == 'GetCommand') & (history['command_status'] == 'ok')]
+    return ok['visit_id'].drop_duplicates().tolist()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Export crawl tables into a columnar snapshot.")
+    parser.add_argument('db', help="Path of the crawl database.")
+    parser.add_argument('snapshot_dir', help="Directory to write the snapshot into.")
+    parser.add_argument('--tables', help="Comma-separated subset of tables to export.")
+    args = parser.parse_args()
+
+    manifest = export_snapshot(args.db, args.snapshot_dir, args.tables.split(',') if args.tables else None)
+    for table, info in manifest['tables'].items():
+        print(f"  {table}: {info['rows']} rows")
@@ -0,0 +1,87 @@
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import urlsplit
+
+# --- Configuration ---
+# Pinned Public Suffix List snapshot shipped with the repo, so resolution is
+# reproducible and never triggers a network fetch on startup.
+PSL_SNAPSHOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public_suffix_list.dat')
+# Maximum number of distinct hosts kept in the resolution cache
+HOST_CACHE_SIZE = 100000
+
+# A leading "scheme:" not followed by a port number, e.g. data:, about:, javascript:
+_HOSTLESS_SCHEME = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*:(?!\d)')
+
+_extractor = None
+
+
+# --- Helper Functions ---
+
+def get_host(url):
+    """Returns the lower-cased host of a URL (schemeless and `//` URLs included), or None."""
+    if not isinstance(url, str) or not url.strip():
+        return None
+    url = url.strip()
+    if '://' not in url and not url.startswith('//'):
+        if _HOSTLESS_SCHEME.match(url):
+            return None
+        url = '//' + url
+    try:
+        return urlsplit(url).hostname
+    except ValueError:
+        return None
+
+
+def get_extractor():
+    """Returns the tldextract extractor, importing tldextract on first use."""
+    global _extractor
+    if _extractor is None:
+        import tldextract
+        _extractor = tldextract.TLDExtract(
+            suffix_list_urls=(Path(PSL_SNAPSHOT).as_uri(),),
+            cache_dir=None,
+            fallback_to_snapshot=False,
+        )
+    return _extractor
+
+
+@lru_cache(maxsize=HOST_CACHE_SIZE)
+def resolve_host(host):
+    """
+    Returns the eTLD+1 (registered domain) of a host. Hosts without a public
+    suffix, such as IP addresses or localhost, resolve to themselves.
+    """
+    if not host:
+        return None
+    extracted = get_extractor()(host)
+    if extracted.domain and extracted.suffix:
+        return f"{extracted.domain}.{extracted.suffix}"
+    return host
+
+
+def get_etld1(url):
+    """Extracts the eTLD+1 (effective top-level domain plus one) from a URL."""
+    return resolve_host(get_host(url))
+
+
+def get_etld1_column(urls):
+    """
+    Resolves a pandas Series of URLs to eTLD+1s, resolving each distinct URL once.
+    The URLs are factorized, their hosts resolved through the host cache and the
+    results broadcast back to every row.
+    """
+    # Imported here so that scripts which never build DataFrames don't pay for pandas
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(urls)
+    resolved = np.array([get_etld1(url) for url in uniques] + [None], dtype=object)
+    # Missing URLs are factorized to code -1, which picks the trailing None
+    return pd.Series(resolved[codes], index=urls.index, dtype=object)
+
+
+def cache_info():
+    """Returns the hit/miss statistics of the host resolution cache."""
+    return resolve_host.cache_info()
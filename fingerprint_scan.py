@@ -0,0 +1,436 @@
+import argparse
+import logging
+import multiprocessing
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from crawl_db import connect_readonly, visit_subset_clause, visit_subset_param
+from etld_resolver import get_etld1
+from sketches import GLOBAL_HLL_PRECISION, TOP_K_CAPACITY, HyperLogLog, SpaceSaving
+from spill import ENTRY_OVERHEAD_BYTES, PartitionedSpill, over_budget
+
+# Scanning of the javascript table for question F. The table is split into shards
+# by visit_id range; each shard is scanned by its own worker process with its own
+# read-only connection, and the partial results are merged in shard order.
+#
+# Every fingerprinting API gets an integer id, and the APIs called in each
+# (visit_id, script_url) context are kept as a bitmask of those ids. The masks are
+# turned into the full API x API co-occurrence matrix with one matrix product, so
+# co-occurrence with any API can be read off without rescanning the table.
+#
+# In sketch mode the distinct sites and the per-script counts are kept in
+# fixed-memory sketches (see sketches.py) instead of a set and Counters.
+#
+# With a memory budget, a shard whose context masks outgrow it spills them to
+# hash-partitioned runs on disk (see spill.py) and folds them into co-occurrence
+# counts one partition at a time; every shard then returns its counts instead of
+# its masks, so the parent never holds the masks of all shards either.
+
+# --- Configuration ---
+# List of potential fingerprinting API symbols identified from exploration
+# (shared by question_f.py and multi_crawl.py)
+POTENTIAL_FP_APIS = {
+    'window.navigator.userAgent', 'window.navigator.vendor', 'window.navigator.platform',
+    'window.navigator.plugins', 'CanvasRenderingContext2D.font', 'window.navigator.language',
+    'window.navigator.languages', 'window.navigator.cookieEnabled', 'HTMLCanvasElement.height',
+    'window.screen.colorDepth', 'HTMLCanvasElement.width', 'window.navigator.maxTouchPoints',
+    'window.navigator.product', 'HTMLCanvasElement.clientHeight', 'HTMLCanvasElement.clientWidth',
+    'CanvasRenderingContext2D.measureText', 'window.navigator.doNotTrack',
+    'window.navigator.sendBeacon', 'window.navigator.mimeTypes', 'window.navigator.appVersion',
+    'window.navigator.hardwareConcurrency', 'window.navigator.onLine', 'window.navigator.webdriver',
+    'window.navigator.permissions', 'window.navigator.globalPrivacyControl',
+    'HTMLCanvasElement.getContext', 'window.navigator.appName', 'CanvasRenderingContext2D.fillStyle',
+    'window.navigator.serviceWorker', 'window.screen.pixelDepth', 'window.navigator.appCodeName',
+    'CanvasRenderingContext2D.getImageData', 'window.navigator.mediaCapabilities',
+    'HTMLCanvasElement.toDataURL', 'window.navigator.mediaSession', 'CanvasRenderingContext2D.arc',
+    'CanvasRenderingContext2D.fillText', 'window.navigator.javaEnabled',
+    'window.navigator.productSub', 'HTMLCanvasElement.style', 'CanvasRenderingContext2D.fillRect',
+    'window.navigator.userActivation', 'window.navigator.requestMediaKeySystemAccess',
+    'CanvasRenderingContext2D.stroke', 'CanvasRenderingContext2D.fill', 'HTMLCanvasElement.tagName',
+    'window.navigator.__proto__', 'CanvasRenderingContext2D.lineWidth', 'window.navigator.oscpu',
+    'window.navigator.buildID', 'CanvasRenderingContext2D.strokeStyle',
+    'CanvasRenderingContext2D.textBaseline', 'window.navigator.vendorSub',
+    'window.navigator.credentials', 'window.navigator.mediaDevices', 'HTMLCanvasElement.nodeName',
+    'OfflineAudioContext.createOscillator', 'HTMLCanvasElement.nodeType',
+    'OfflineAudioContext.currentTime', 'CanvasRenderingContext2D.rect', 'window.navigator.storage',
+    'window.navigator.geolocation', 'HTMLCanvasElement.children',
+    'CanvasRenderingContext2D.createLinearGradient', 'window.navigator.pdfViewerEnabled',
+    'CanvasRenderingContext2D.shadowBlur', 'window.navigator.hasOwnProperty',
+    'CanvasRenderingContext2D.globalCompositeOperation', 'CanvasRenderingContext2D.shadowColor',
+    'HTMLCanvasElement.setAttribute', 'OfflineAudioContext.destination',
+    'OfflineAudioContext.startRendering', 'OfflineAudioContext.createDynamicsCompressor',
+    'OfflineAudioContext.hasOwnProperty', 'CanvasRenderingContext2D.createRadialGradient',
+    'CanvasRenderingContext2D.isPointInPath', 'OfflineAudioContext.oncomplete',
+    'HTMLCanvasElement.transferControlToOffscreen', 'HTMLCanvasElement.classList',
+    'CanvasRenderingContext2D.putImageData', 'HTMLCanvasElement.childNodes',
+    'CanvasRenderingContext2D.strokeText', 'HTMLCanvasElement.getBoundingClientRect',
+    'HTMLCanvasElement.addEventListener', 'HTMLCanvasElement.childElementCount',
+    'HTMLCanvasElement.textContent', 'CanvasRenderingContext2D.bezierCurveTo',
+    'HTMLCanvasElement.toBlob', 'OfflineAudioContext.state', 'window.navigator.locks',
+    'CanvasRenderingContext2D.restore', 'CanvasRenderingContext2D.save',
+    'CanvasRenderingContext2D.scale', 'HTMLCanvasElement.captureStream',
+    'HTMLCanvasElement.ownerDocument', 'HTMLCanvasElement.parentNode',
+    'window.navigator.getGamepads', 'AnalyserNode.frequencyBinCount',
+    'OfflineAudioContext.createAnalyser', 'AnalyserNode.context', 'AnalyserNode.fftSize',
+    'CanvasRenderingContext2D.arcTo', 'CanvasRenderingContext2D.rotate',
+    'HTMLCanvasElement.attributes', 'HTMLCanvasElement.matches', 'HTMLCanvasElement.namespaceURI',
+    'HTMLCanvasElement.querySelectorAll', 'window.navigator.toString',
+    'AnalyserNode.getFloatFrequencyData', 'window.navigator.clipboard',
+    'AnalyserNode.channelCount', 'AnalyserNode.channelCountMode',
+    'AnalyserNode.channelInterpretation', 'AnalyserNode.connect',
+    'AnalyserNode.getFloatTimeDomainData', 'AnalyserNode.maxDecibels',
+    'AnalyserNode.minDecibels', 'AnalyserNode.numberOfInputs', 'AnalyserNode.numberOfOutputs',
+    'AnalyserNode.smoothingTimeConstant', 'AudioContext.addEventListener',
+    'AudioContext.createOscillator', 'AudioContext.destination', 'AudioContext.resume',
+    'AudioContext.state', 'CanvasRenderingContext2D.shadowOffsetX',
+    'CanvasRenderingContext2D.shadowOffsetY', 'HTMLCanvasElement.className',
+    'HTMLCanvasElement.getElementsByTagName', 'HTMLCanvasElement.nextSibling',
+    'HTMLCanvasElement.offsetHeight', 'HTMLCanvasElement.offsetWidth',
+    'HTMLCanvasElement.previousSibling', 'OfflineAudioContext.addEventListener',
+    'OfflineAudioContext.createBiquadFilter', 'OfflineAudioContext.createBuffer',
+    'OfflineAudioContext.createBufferSource', 'OfflineAudioContext.listener',
+    'OfflineAudioContext.sampleRate', 'window.navigator.__lookupGetter__',
+    'window.navigator.getAutoplayPolicy', 'AnalyserNode.disconnect',
+    'AudioContext.createAnalyser', 'AudioContext.createGain',
+    'AudioContext.createScriptProcessor', 'AudioContext.sampleRate',
+    'CanvasRenderingContext2D.createImageData', 'HTMLCanvasElement.id',
+    'HTMLCanvasElement.parentElement', 'HTMLCanvasElement.removeEventListener',
+    'window.navigator.valueOf', 'window.navigator.wakeLock',
+
+}
+
+FETCH_SIZE = 100000
+# Shards per worker; more, smaller shards even out visits of very different sizes
+SHARDS_PER_WORKER = 4
+# Contexts per block of the co-occurrence product; float32 sums of 0/1 values are
+# exact far beyond this many rows
+CONTEXT_BLOCK_SIZE = 65536
+# Where question F saves the full co-occurrence matrix for later queries
+COOCCURRENCE_FILE = 'fp_cooccurrence.npz'
+
+
+# --- Helper Functions ---
+
+def is_third_party(script_url, page_url):
+    """Determines if a script URL is third-party relative to the page URL."""
+    # Treat None/empty script URLs or data URIs as first-party
+    if not script_url or script_url.startswith('data:'):
+        return False
+
+    if not page_url:
+         return True
+
+    script_domain = get_etld1(script_url)
+    page_domain = get_etld1(page_url)
+
+    # If either domain could not be parsed, conservatively assume different
+    # unless they are identical strings (e.g. both None)
+    if not script_domain or not page_domain:
+        return script_domain != page_domain
+
+    return script_domain != page_domain
+
+
+def api_ids(target_api, fp_apis):
+    """Maps each fingerprinting API (and the target) to its bit, in sorted order."""
+    return {api: bit for bit, api in enumerate(sorted(set(fp_apis) | {target_api}))}
+
+
+class CooccurrenceMatrix:
+    """
+    Number of (visit_id, script_url) contexts in which each pair of APIs was called;
+    the diagonal holds the number of contexts calling each API.
+    """
+
+    def __init__(self, apis, counts=None):
+        self.apis = list(apis)
+        self.index = {api: bit for bit, api in enumerate(self.apis)}
+        self.counts = counts if counts is not None else np.zeros((len(self.apis), len(self.apis)), dtype=np.int64)
+
+    @classmethod
+    def from_masks(cls, apis, masks):
+        """Builds the matrix from context bitmasks, one block of contexts at a time."""
+        matrix = cls(apis)
+        width = (len(matrix.apis) + 7) // 8
+        masks = list(masks)
+        for start in range(0, len(masks), CONTEXT_BLOCK_SIZE):
+            block = masks[start:start + CONTEXT_BLOCK_SIZE]
+            packed = np.frombuffer(b''.join(mask.to_bytes(width, 'little') for mask in block), dtype=np.uint8)
+            rows = np.unpackbits(packed.reshape(len(block), width), axis=1, bitorder='little')
+            rows = rows[:, :len(matrix.apis)].astype(np.float32)
+            matrix.counts += (rows.T @ rows).astype(np.int64)
+        return matrix
+
+    def merge(self, other):
+        """Adds the counts of a matrix over other (disjoint) visits."""
+        if other.apis != self.apis:
+            raise ValueError("Cannot merge co-occurrence matrices over different APIs")
+        self.counts += other.counts
+
+    def cooccurring(self, target_api):
+        """Returns a Counter of the contexts each other API shared with target_api."""
+        target = self.index[target_api]
+        return Counter({api: int(self.counts[target, bit]) for bit, api in enumerate(self.apis)
+                        if bit != target and self.counts[target, bit]})
+
+    def aggregates(self):
+        return {'apis': self.apis, 'counts': self.counts}
+
+    @classmethod
+    def from_aggregates(cls, aggregates):
+        return cls(aggregates['apis'], aggregates['counts'])
+
+    def save(self, path):
+        np.savez_compressed(path, apis=np.array(self.apis), counts=self.counts)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['apis'].tolist(), data['counts'])
+
+
+class ScriptPartySketch:
+    """
+    Stands in for script_party_status in sketch mode: the first- and third-party
+    contexts of the top scripts are kept in one SpaceSaving summary per party.
+    status[script][party] reads and updates the counts like the exact dict.
+    """
+
+    def __init__(self, capacity=TOP_K_CAPACITY):
+        self.contexts = {'first': SpaceSaving(capacity), 'third': SpaceSaving(capacity)}
+
+    def __getitem__(self, script):
+        return ScriptParty(self.contexts, script)
+
+    def totals(self):
+        """Returns the (exact) total numbers of first- and third-party contexts."""
+        return self.contexts['first'].total, self.contexts['third'].total
+
+    def merge(self, other):
+        for party, summary in other.contexts.items():
+            self.contexts[party].merge(summary)
+
+
+class ScriptParty:
+    """The first/third-party context counts of one script in a ScriptPartySketch."""
+
+    __slots__ = ('contexts', 'script')
+
+    def __init__(self, contexts, script):
+        self.contexts = contexts
+        self.script = script
+
+    def __getitem__(self, party):
+        return self.contexts[party][self.script]
+
+    def __setitem__(self, party, count):
+        self.contexts[party][self.script] = count
+
+
+def merge_party_status(status, other):
+    """Adds the first/third-party context counts of `other` to `status` (dicts or ScriptPartySketches)."""
+    if isinstance(status, ScriptPartySketch):
+        status.merge(other)
+        return
+    for script, counts in other.items():
+        status[script]['first'] += counts['first']
+        status[script]['third'] += counts['third']
+
+
+def empty_partial(sketch=False):
+    """Returns the aggregates of a scan that saw no rows."""
+    return {
+        'processed_rows': 0,
+        # Distinct top-level URLs on which the target API was called
+        'sites_using_target': HyperLogLog(GLOBAL_HLL_PRECISION) if sketch else set(),
+        'total_target_calls': 0,
+        # Per script: number of target API calls and first/third-party contexts
+        'script_counts': SpaceSaving() if sketch else Counter(),
+        'script_party_status': ScriptPartySketch() if sketch else defaultdict(lambda: {'first': 0, 'third': 0}),
+        # Maps (visit_id, script_url) -> bitmask (see api_ids) of the FP APIs called in that context
+        'context_masks': defaultdict(int),
+        # Co-occurrence counts (CooccurrenceMatrix aggregates) of contexts already
+        # folded in with a memory budget, None otherwise
+        'cooccurrence': None,
+    }
+
+
+def scan_rows(rows, target_api, bits, partial):
+    """Folds (visit_id, script_url, symbol, top_level_url) rows into a partial result."""
+    sites_using_target = partial['sites_using_target']
+    script_counts = partial['script_counts']
+    script_party_status = partial['script_party_status']
+    context_masks = partial['context_masks']
+
+    for visit_id, script_url, symbol, top_level_url in rows:
+        if symbol == target_api:
+            if top_level_url: # Only count sites if we have a top_level_url
+                sites_using_target.add(top_level_url)
+            partial['total_target_calls'] += 1
+            script_key = script_url if script_url is not None else "(Inline/Unknown)"
+            script_counts[script_key] += 1
+            # Determine party status only if top_level_url is available
+            if top_level_url:
+                if is_third_party(script_url, top_level_url):
+                    script_party_status[script_key]['third'] += 1
+                else:
+                    script_party_status[script_key]['first'] += 1
+        bit = bits.get(symbol)
+        if bit is None:
+            continue
+
+        if script_url is not None: # Use only contexts with a script_url
+            context_masks[(visit_id, script_url)] |= 1 << bit
+    partial['processed_rows'] += len(rows)
+
+
+def fold_context_masks(partial, apis, spill=None):
+    """
+    Replaces the context masks of a partial result, and those spilled to disk, with
+    their co-occurrence counts. The spilled masks are read back one partition at a
+    time; a context's masks all fall in the same partition and are OR-ed together.
+    """
+    context_masks = partial['context_masks']
+    if spill is not None and context_masks:
+        # Once spilling, the masks left in memory go to disk too: a context may have
+        # part of its mask spilled already and must only be counted once, whole
+        spill.write([(visit_id, script_url, mask) for (visit_id, script_url), mask in context_masks.items()])
+        context_masks.clear()
+    matrix = CooccurrenceMatrix.from_masks(apis, context_masks.values())
+    partial['context_masks'] = defaultdict(int)
+    if spill is not None:
+        for partition in range(spill.partitions):
+            masks = defaultdict(int)
+            for visit_id, script_url, mask in spill.read(partition):
+                masks[(visit_id, script_url)] |= mask
+            matrix.merge(CooccurrenceMatrix.from_masks(apis, masks.values()))
+        spill.close()
+    partial['cooccurrence'] = matrix.aggregates()
+
+
+def context_masks_bytes(context_masks):
+    """Estimates the memory held by context masks (see spill.ENTRY_OVERHEAD_BYTES)."""
+    return len(context_masks) * ENTRY_OVERHEAD_BYTES
+
+
+def scan_shard(db_path, visit_ids, target_api, fp_apis, sketch=False, memory_budget=None):
+    """
+    Scans the javascript rows of one shard of visits on a private read-only
+    connection. With a memory_budget (MiB), the context masks are spilled to disk
+    whenever they outgrow it, and returned as co-occurrence counts.
+    """
+    partial = empty_partial(sketch)
+    if not visit_ids:
+        return partial
+    bits = api_ids(target_api, fp_apis)
+    spill = None
+    conn = connect_readonly(db_path)
+    try:
+        cursor = conn.cursor()
+        # The range lets SQLite use the visit_id index; the subset keeps the shard exact
+        cursor.execute(f"""
+            SELECT j.visit_id, j.script_url, j.symbol, j.top_level_url
+            FROM javascript j
+            WHERE j.visit_id BETWEEN ? AND ? AND {visit_subset_clause('j')}
+        """, (visit_ids[0], visit_ids[-1], visit_subset_param(visit_ids)))
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            scan_rows(rows, target_api, bits, partial)
+            context_masks = partial['context_masks']
+            if over_budget(context_masks_bytes(context_masks), memory_budget):
+                if spill is None:
+                    spill = PartitionedSpill('question_f')
+                spill.write([(visit_id, script_url, mask) for (visit_id, script_url), mask in context_masks.items()])
+                context_masks.clear()
+    finally:
+        conn.close()
+    if memory_budget is not None:
+        fold_context_masks(partial, list(bits), spill)
+    # defaultdicts with lambdas cannot be pickled back to the parent
+    if not sketch:
+        partial['script_party_status'] = dict(partial['script_party_status'])
+    return partial
+
+
+def split_visits(visit_ids, num_shards):
+    """Splits visit_ids into at most num_shards contiguous, sorted visit_id ranges."""
+    visit_ids = sorted(visit_ids)
+    num_shards = max(1, min(num_shards, len(visit_ids)))
+    size, remainder = divmod(len(visit_ids), num_shards)
+    shards = []
+    start = 0
+    for shard in range(num_shards):
+        end = start + size + (1 if shard < remainder else 0)
+        shards.append(visit_ids[start:end])
+        start = end
+    return [shard for shard in shards if shard]
+
+
+def merge_partials(partials, sketch=False):
+    """Merges shard results; shards cover disjoint visits, so contexts never collide."""
+    merged = empty_partial(sketch)
+    for partial in partials:
+        merged['processed_rows'] += partial['processed_rows']
+        merged['sites_using_target'] |= partial['sites_using_target']
+        merged['total_target_calls'] += partial['total_target_calls']
+        merged['script_counts'].update(partial['script_counts'])
+        merge_party_status(merged['script_party_status'], partial['script_party_status'])
+        merged['context_masks'].update(partial['context_masks'])
+        if partial['cooccurrence'] is not None:
+            cooccurrence = CooccurrenceMatrix.from_aggregates(partial['cooccurrence'])
+            if merged['cooccurrence'] is not None:
+                cooccurrence.merge(CooccurrenceMatrix.from_aggregates(merged['cooccurrence']))
+            merged['cooccurrence'] = cooccurrence.aggregates()
+    return merged
+
+
+def worker_context():
+    """
+    Returns the multiprocessing context for scan workers. Question F starts its
+    scan pool from whatever process runs it: a script, or one of the runner's
+    spawned worker processes, where the pool is nested in the runner's. Those
+    processes also run query executor threads (see query_executor.py), so the fork
+    server starts the scan workers from a clean single-threaded process instead of
+    forking them.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def sharded_scan(db_path, visit_ids, target_api, fp_apis, workers, sketch=False, memory_budget=None):
+    """
+    Scans the javascript rows of visit_ids with `workers` processes and returns the
+    merged aggregates. With a single worker the shards are scanned in-process.
+    With `sketch`, the sites and script counts are kept in sketches (see empty_partial).
+    With a memory_budget (MiB, per process), the context masks are spilled to disk
+    past the budget and every shard returns co-occurrence counts (see scan_shard).
+    """
+    shards = split_visits(visit_ids, workers * SHARDS_PER_WORKER)
+    logging.info(f"Scanning javascript in {len(shards)} shard(s) with {workers} worker(s)...")
+    args = [(db_path, shard, target_api, fp_apis, sketch, memory_budget) for shard in shards]
+    if workers <= 1 or len(shards) <= 1:
+        return merge_partials((scan_shard(*arg) for arg in args), sketch)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context()) as executor:
+        return merge_partials(executor.map(scan_shard, *zip(*args)), sketch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the API co-occurrence matrix saved by question_f.py.")
+    parser.add_argument('target', help="API to report co-occurrences for, e.g. CanvasRenderingContext2D.getImageData.")
+    parser.add_argument('--matrix', default=COOCCURRENCE_FILE, help="Matrix file (default: %(default)s).")
+    parser.add_argument('--top', type=int, default=10, help="Number of co-occurring APIs to list.")
+    args = parser.parse_args()
+
+    matrix = CooccurrenceMatrix.load(args.matrix)
+    if args.target not in matrix.index:
+        parser.error(f"{args.target} is not one of the {len(matrix.apis)} APIs in {args.matrix}")
+    target = matrix.index[args.target]
+    print(f"Contexts calling '{args.target}': {matrix.counts[target, target]}")
+    print(f"Top {args.top} co-occurring APIs:")
+    for api, count in matrix.cooccurring(args.target).most_common(args.top):
+        print(f"  - {api}: {count}")
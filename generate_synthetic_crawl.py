@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import string
+from urllib.parse import quote
+
+# --- Configuration ---
+DEFAULT_OUTPUT = 'crawl-data-synthetic.sqlite'
+DEFAULT_VISITS = 177
+DEFAULT_SEED = 177
+
+# Share of GetCommand calls that fail and of visits that never complete,
+# roughly matching the 177-site crawl described in the README
+FAILURE_RATE = 15 / 177
+INCOMPLETE_RATE = 25 / 177
+
+FIRST_PARTY_NAMES = [
+    'news', 'shop', 'mail', 'video', 'weather', 'sports', 'travel', 'bank',
+    'games', 'music', 'social', 'search', 'books', 'health', 'food', 'tech',
+]
+SUFFIXES = ['com', 'org', 'net', 'co.uk', 'com.au', 'de', 'io', 'fr']
+
+# Third parties with a skewed popularity so that top-k results are stable
+THIRD_PARTIES = [
+    'google.com', 'googletagmanager.com', 'doubleclick.net', 'facebook.net',
+    'google-analytics.com', 'gstatic.com', 'cloudflare.com', 'adnxs.com',
+    'rubiconproject.com', 'pubmatic.com', 'criteo.com', 'taboola.com',
+    'outbrain.com', 'amazon-adsystem.com', 'scorecardresearch.com',
+    'quantserve.com', 'bing.com', 'twitter.com', 'hotjar.com', 'cdn.jsdelivr.net',
+    'demdex.net', 'casalemedia.com', 'openx.net', 'bidswitch.net', 'yahoo.com',
+]
+SYNC_PARTNERS = ['adnxs.com', 'rubiconproject.com', 'pubmatic.com', 'criteo.com',
+                 'demdex.net', 'casalemedia.com', 'openx.net', 'bidswitch.net']
+
+COOKIE_NAMES = ['__cf_bm', '_ga', '_gid', 'uid', 'IDE', 'NID', 'sessionid',
+                'AWSALB', 'AWSALBCORS', '__cfduid', 'tuuid', 'anj', 'uuid2', 'test_cookie']
+
+FP_SYMBOLS = [
+    'window.navigator.userAgent', 'window.navigator.platform', 'window.navigator.language',
+    'window.navigator.plugins', 'window.screen.colorDepth', 'HTMLCanvasElement.getContext',
+    'HTMLCanvasElement.toDataURL', 'HTMLCanvasElement.width', 'HTMLCanvasElement.height',
+    'CanvasRenderingContext2D.fillText', 'CanvasRenderingContext2D.font',
+    'CanvasRenderingContext2D.fillStyle', 'CanvasRenderingContext2D.getImageData',
+    'CanvasRenderingContext2D.measureText', 'OfflineAudioContext.createOscillator',
+    'OfflineAudioContext.startRendering', 'window.navigator.hardwareConcurrency',
+]
+OTHER_SYMBOLS = ['window.document.cookie', 'window.localStorage', 'window.name',
+                 'window.sessionStorage', 'window.document.referrer']
+
+SCHEMA = """
+CREATE TABLE site_visits (
+    visit_id INTEGER PRIMARY KEY,
+    browser_id INTEGER NOT NULL,
+    site_url VARCHAR(500) NOT NULL,
+    site_rank INTEGER
+);
+CREATE TABLE crawl_history (
+    browser_id INTEGER,
+    visit_id INTEGER,
+    command TEXT,
+    arguments TEXT,
+    retry_number INTEGER,
+    command_status TEXT,
+    error TEXT,
+    traceback TEXT,
+    duration INTEGER,
+    dtg DATETIME DEFAULT (CURRENT_TIMESTAMP)
+);
+CREATE TABLE incomplete_visits (
+    visit_id INTEGER NOT NULL
+);
+CREATE TABLE http_requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    incognito INTEGER,
+    browser_id INTEGER NOT NULL,
+    visit_id INTEGER NOT NULL,
+    extension_session_uuid TEXT,
+    event_ordinal INTEGER,
+    window_id INTEGER,
+    tab_id INTEGER,
+    frame_id INTEGER,
+    url TEXT NOT NULL,
+    top_level_url TEXT,
+    parent_frame_id INTEGER,
+    frame_ancestors TEXT,
+    method TEXT NOT NULL,
+    referrer TEXT NOT NULL,
+    headers TEXT NOT NULL,
+    request_id INTEGER NOT NULL,
+    is_XHR INTEGER,
+    is_third_party_channel INTEGER,
+    is_third_party_to_top_window INTEGER,
+    triggering_origin TEXT,
+    loading_origin TEXT,
+    loading_href TEXT,
+    req_call_stack TEXT,
+    resource_type TEXT NOT NULL,
+    post_body TEXT,
+    post_body_raw TEXT,
+    time_stamp DATETIME NOT NULL
+);
+CREATE TABLE http_responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    incognito INTEGER,
+    browser_id INTEGER NOT NULL,
+    visit_id INTEGER NOT NULL,
+    extension_session_uuid TEXT,
+    event_ordinal INTEGER,
+    window_id INTEGER,
+    tab_id INTEGER,
+    frame_id INTEGER,
+    url TEXT NOT NULL,
+    method TEXT NOT NULL,
+    response_status INTEGER,
+    response_status_text TEXT NOT NULL,
+    is_cached INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    request_id INTEGER NOT NULL,
+    location TEXT NOT NULL,
+    time_stamp DATETIME NOT NULL,
+    content_hash TEXT
+);
+CREATE TABLE javascript (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    incognito INTEGER,
+    browser_id INTEGER NOT NULL,
+    visit_id INTEGER NOT NULL,
+    extension_session_uuid TEXT,
+    event_ordinal INTEGER,
+    page_scoped_event_ordinal INTEGER,
+    window_id INTEGER,
+    tab_id INTEGER,
+    frame_id INTEGER,
+    script_url TEXT,
+    script_line TEXT,
+    script_col TEXT,
+    func_name TEXT,
+    script_loc_eval TEXT,
+    document_url TEXT,
+    top_level_url TEXT,
+    call_stack TEXT,
+    symbol TEXT,
+    operation TEXT,
+    value TEXT,
+    arguments TEXT,
+    time_stamp DATETIME NOT NULL
+);
+"""
+
+TIME_STAMP = '2025-04-01T12:00:00.000Z'
+
+
+# --- Helper Functions ---
+
+def random_token(rng, length):
+    """Returns a random identifier-looking string of the given length."""
+    alphabet = string.ascii_letters + string.digits + '-_|:'
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+def pick_third_parties(rng, count):
+    """Picks `count` distinct third parties with a Zipf-like popularity skew."""
+    weights = [1.0 / (rank + 1) for rank in range(len(THIRD_PARTIES))]
+    chosen = set()
+    while len(chosen) < min(count, len(THIRD_PARTIES)):
+        chosen.add(rng.choices(THIRD_PARTIES, weights=weights)[0])
+    return sorted(chosen)
+
+
+def make_headers(rng, set_cookies, as_dict=False):
+    """Builds an OpenWPM-style headers JSON string with optional Set-Cookie headers."""
+    headers = [
+        ['Content-Type', rng.choice(['text/html; charset=utf-8', 'image/gif', 'application/javascript'])],
+        ['Cache-Control', 'max-age=3600'],
+        ['Server', rng.choice(['nginx', 'cloudflare', 'Apache'])],
+    ]
+    for cookie in set_cookies:
+        headers.append([rng.choice(['Set-Cookie', 'set-cookie']), cookie])
+    if as_dict:
+        merged = {}
+        for name, value in headers:
+            merged[name] = merged[name] + '\n' + value if name in merged else value
+        return json.dumps(merged)
+    return json.dumps(headers)
+
+
+def generate(output_path, num_visits, seed=DEFAULT_SEED, requests_per_visit=60,
+             js_per_visit=120):
+    """Writes a schema-compatible OpenWPM crawl database with `num_visits` site visits."""
+    rng = random.Random(seed)
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    conn = sqlite3.connect(output_path)
+    conn.executescript(SCHEMA)
+
+    site_rows, history_rows, incomplete_rows = [], [], []
+    request_rows, response_rows, js_rows = [], [], []
+    request_id = 0
+
+    for visit_id in range(1, num_visits + 1):
+        site_domain = f"{rng.choice(FIRST_PARTY_NAMES)}{visit_id}.{rng.choice(SUFFIXES)}"
+        site_url = f"https://www.{site_domain}/"
+        site_rows.append((visit_id, 1, site_url, visit_id))
+
+        failed = rng.random() < FAILURE_RATE
+        if failed:
+            history_rows.append((1, visit_id, 'GetCommand', json.dumps({'url': site_url}), 0,
+                                 'error', rng.choice(['NS_ERROR_UNKNOWN_HOST', 'TimeoutException',
+                                                      'NS_ERROR_CONNECTION_REFUSED']), None, 0))
+            continue
+        history_rows.append((1, visit_id, 'GetCommand', json.dumps({'url': site_url}), 0,
+                             'ok', None, None, rng.randint(1000, 30000)))
+        history_rows.append((1, visit_id, 'FinalizeCommand', '{}', 0, 'ok', None, None, 5))
+        if rng.random() < INCOMPLETE_RATE:
+            incomplete_rows.append((visit_id,))
+
+        third_parties = pick_third_parties(rng, rng.randint(0, 18))
+        hosts = [f"www.{site_domain}", f"static.{site_domain}"]
+        hosts += [f"{rng.choice(['cdn', 'ads', 'sync', 'pixel', 'www'])}.{tp}" for tp in third_parties]
+
+        # Cookies set during the visit; some of them are synced to partners below
+        visit_cookies = []
+        num_responses = max(1, int(rng.gauss(requests_per_visit, requests_per_visit / 4)))
+        for _ in range(num_responses):
+            request_id += 1
+            host = rng.choice(hosts)
+            url = f"https://{host}/{random_token(rng, 8)}.js"
+            set_cookies = []
+            if rng.random() < 0.2:
+                for _ in range(rng.randint(1, 3)):
+                    name = rng.choices(COOKIE_NAMES, weights=[len(COOKIE_NAMES) - i for i in range(len(COOKIE_NAMES))])[0]
+                    value = random_token(rng, rng.choice([4, 16, 22, 32]))
+                    visit_cookies.append(value)
+                    set_cookies.append(f"{name}={value}; Path=/; Domain=.{host}; Secure; SameSite=None")
+            headers = make_headers(rng, set_cookies, as_dict=rng.random() < 0.02)
+            response_rows.append((0, 1, visit_id, url, 'GET', 200, 'OK', 0, headers, request_id,
+                                  '', TIME_STAMP))
+            request_rows.append((0, 1, visit_id, url, site_url, 'GET', '', '[]', request_id,
+                                 'script', TIME_STAMP))
+
+        # Sync-style requests that carry cookie values (raw or URL-encoded) to partners
+        synced = [v for v in visit_cookies if len(v) >= 6]
+        for value in rng.sample(synced, min(len(synced), rng.randint(0, 6))):
+            for _ in range(rng.randint(1, 4)):
+                request_id += 1
+                partner = rng.choice(SYNC_PARTNERS)
+                encoded = quote(value) if rng.random() < 0.5 else value
+                url = f"https://sync.{partner}/setuid?partner={rng.randint(1, 999)}&uid={encoded}"
+                request_rows.append((0, 1, visit_id, url, site_url, 'GET', '', '[]', request_id,
+                                     'image', TIME_STAMP))
+
+        # JavaScript calls, grouped by script so that co-occurrence is meaningful
+        scripts = [f"https://{rng.choice(hosts)}/{random_token(rng, 6)}.js"
+                   for _ in range(rng.randint(1, 8))] + [None]
+        for _ in range(max(1, int(rng.gauss(js_per_visit, js_per_visit / 4)))):
+            script_url = rng.choice(scripts)
+            if rng.random() < 0.6:
+                symbol = rng.choice(FP_SYMBOLS)
+                operation = rng.choice(['get', 'call'])
+            else:
+                symbol = rng.choice(OTHER_SYMBOLS)
+                operation = rng.choice(['get', 'set'])
+            js_rows.append((0, 1, visit_id, script_url, site_url, site_url, symbol, operation,
+                            random_token(rng, 12), TIME_STAMP))
+
+    conn.executemany("INSERT INTO site_visits VALUES (?, ?, ?, ?)", site_rows)
+    conn.executemany("""
+        INSERT INTO crawl_history (browser_id, visit_id, command, arguments, retry_number,
+                                   command_status, error, traceback, duration)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, history_rows)
+    conn.executemany("INSERT INTO incomplete_visits VALUES (?)", incomplete_rows)
+    conn.executemany("""
+        INSERT INTO http_responses (incognito, browser_id, visit_id, url, method, response_status,
+                                    response_status_text, is_cached, headers, request_id, location,
+                                    time_stamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, response_rows)
+    conn.executemany("""
+        INSERT INTO http_requests (incognito, browser_id, visit_id, url, top_level_url, method,
+                                   referrer, headers, request_id, resource_type, time_stamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, request_rows)
+    conn.executemany("""
+        INSERT INTO javascript (incognito, browser_id, visit_id, script_url, document_url,
+                                top_level_url, symbol, operation, value, time_stamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, js_rows)
+    conn.commit()
+    conn.close()
+    return {
+        'site_visits': len(site_rows),
+        'http_requests': len(request_rows),
+        'http_responses': len(response_rows),
+        'javascript': len(js_rows),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic OpenWPM crawl database.")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Path of the SQLite file to write.")
+    parser.add_argument('--visits', type=int, default=DEFAULT_VISITS, help="Number of site visits.")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="Random seed.")
+    args = parser.parse_args()
+
+    counts = generate(args.output, args.visits, seed=args.seed)
+    print(f"Wrote {args.output}:")
+    for table, count in counts.items():
+        print(f"  {table}: {count} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+# --- Configuration ---
+# Pre-binned histogram files written by the analyses, in plotting order
+HISTOGRAM_FILES = [
+    'third_party_distribution.hist.json',  # Question B
+    'cookie_sync_distribution.hist.json',  # Question E
+]
+
+
+# --- Helper Functions ---
+
+def histogram_path(plot_file):
+    """Returns the histogram data file kept next to a plot, e.g. x.png -> x.hist.json."""
+    return os.path.splitext(plot_file)[0] + '.hist.json'
+
+
+def integer_histogram(values, bins=None, step=None):
+    """
+    Bins non-negative integer values and returns (edges, counts). The values are
+    first counted per value with np.bincount, so only max(values) + 1 counts are
+    binned. `step` gives integer bins [0, step), [step, 2*step), ... past the
+    maximum; otherwise `bins` equal-width bins span the observed range, as
+    np.histogram does.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if not len(values):
+        return np.array([0.0, 1.0]), np.zeros(1, dtype=np.int64)
+    value_counts = np.bincount(values)
+    if step:
+        edges = np.arange(0, values.max() + step + 1, step)
+    else:
+        edges = np.histogram_bin_edges(np.array([values.min(), values.max()]), bins=bins or 10)
+    counts, _ = np.histogram(np.arange(len(value_counts)), bins=edges, weights=value_counts)
+    return edges, counts.astype(np.int64)
+
+
+def save_histogram(path, edges, counts, plot_file, title, xlabel, ylabel, figsize=(12, 6), bar_style=None,
+                   grid_style=None):
+    """Writes pre-binned histogram data and its plot settings to a small JSON file."""
+    histogram = {
+        'plot_file': plot_file,
+        'title': title,
+        'xlabel': xlabel,
+        'ylabel': ylabel,
+        'figsize': list(figsize),
+        'bar_style': bar_style or {},
+        'grid_style': grid_style or {'axis': 'y', 'alpha': 0.5},
+        'edges': [float(edge) for edge in edges],
+        'counts': [int(count) for count in counts],
+    }
+    with open(path, 'w') as f:
+        json.dump(histogram, f)
+    return path
+
+
+def load_histogram(path):
+    """Reads a histogram file written by save_histogram()."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def render_histogram(path, plot_file=None):
+    """
+    Renders a histogram file to a PNG with the Agg backend and returns the PNG path.
+    matplotlib is only imported here, so analyses that defer plotting never load it.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    histogram = load_histogram(path)
+    plot_file = plot_file or histogram['plot_file']
+    edges = np.array(histogram['edges'])
+    # A Figure rather than pyplot's global state, so histograms can render on several threads
+    fig = Figure(figsize=histogram['figsize'])
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    # Each bin is drawn from one weighted sample at its left edge
+    ax.hist(edges[:-1], bins=edges, weights=histogram['counts'], **histogram['bar_style'])
+    ax.set_title(histogram['title'])
+    ax.set_xlabel(histogram['xlabel'])
+    ax.set_ylabel(histogram['ylabel'])
+    ax.grid(**histogram['grid_style'])
+    fig.tight_layout()
+    fig.savefig(plot_file)
+    return plot_file
+
+
+def main(paths=None):
+    """Renders the given histogram files (default: every known one present) and returns the PNG paths."""
+    paths = paths or [path for path in HISTOGRAM_FILES if os.path.exists(path)]
+    if not paths:
+        print("No histogram files found; run question_b.py or question_e.py first.")
+    plots = []
+    for path in paths:
+        plot_file = render_histogram(path)
+        print(f"Rendered {path} -> {plot_file}")
+        plots.append(plot_file)
+    return plots
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the PNG plots from pre-binned histogram files.")
+    parser.add_argument('paths', nargs='*', help=f"Histogram files (default: {', '.join(HISTOGRAM_FILES)}).")
+    args = parser.parse_args()
+    main(args.paths)
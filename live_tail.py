@@ -0,0 +1,410 @@
+import argparse
+import logging
+import time
+from collections import Counter, defaultdict
+
+from cookie_utils import MIN_COOKIE_VALUE_LEN
+from crawl_db import connect_readonly, run_option, visit_subset_clause, visit_subset_param
+from etld_resolver import get_etld1
+from fingerprint_scan import POTENTIAL_FP_APIS
+from scan_consumers import (
+    CookieScriptCounter,
+    FingerprintCallCounter,
+    SetCookieNameCounter,
+    SyncRequestCounter,
+    SyncValueHarvester,
+    ThirdPartyCounter,
+)
+from table_scanner import DEFAULT_BATCH_SIZE, Batch, consumer_columns, select_expression
+
+# Follows a crawl database while OpenWPM is still writing it (in WAL mode) and
+# keeps the question A-F aggregates up to date. Every poll reads only the rows
+# added since the previous one: crawl_history, incomplete_visits and the per-visit
+# tables are tailed by rowid high-water marks, and the site_visits rows (keyed by
+# random visit_ids) are looked up for new visits only. A visit's rows are held back
+# until its GetCommand row tells whether the page load succeeded and its site_visits
+# row is visible; C then counts them, and B, D, E and F too if the load succeeded.
+#
+# Per-visit state is only kept for open and recently closed visits. One poll after a
+# visit's FinalizeCommand row, or once no row of it was read for VISIT_TIMEOUT
+# seconds (a visit that never finished), the visit is closed: its held rows are
+# counted with what is known and its cookie values are dropped. Its status, site and
+# per-visit counts are kept for another VISIT_TIMEOUT seconds, so that rows the
+# crawler writes late still count as the visit's; then the visit is retired: it is
+# folded into running totals (sites, successful visits, the top sites of B and E,
+# F's co-occurrence counts) and its per-visit entries are deleted. Memory, per-poll
+# work and summaries then grow with the visits of the last few VISIT_TIMEOUTs and
+# the aggregates (e.g. per third party or script) rather than with the crawl's
+# history.
+#
+# Polls cost time proportional to the new rows, and summaries are only printed
+# every summary interval. Differences from the batch analyses remain while the
+# crawl runs: sites count once their visit has written a row, a cookie value only
+# counts as synced in requests read after the response setting it, and rows of a
+# visit read after it was retired count as those of a new visit without a status
+# (an abandoned one).
+
+# --- Configuration ---
+DB_FILE = 'crawl-data-177.sqlite'
+TARGET_API = 'HTMLCanvasElement.toDataURL'
+CHECK_URL_ENCODED_VALUES = True
+# Seconds between polls, and between summaries
+POLL_INTERVAL = 5
+SUMMARY_INTERVAL = 60
+# Seconds without new rows after which a visit that did not finish (no
+# FinalizeCommand row, e.g. a crashed browser) is closed
+VISIT_TIMEOUT = 600
+
+# Per-visit tables, in the order their new rows are processed: cookie values are
+# harvested from http_responses before http_requests are searched for them
+VISIT_TABLES = ('http_responses', 'http_requests', 'javascript')
+CRAWL_HISTORY_COLUMNS = ('visit_id', 'command', 'command_status', 'error')
+
+
+
+# --- Helper Functions ---
+
+def max_visit(top, candidate):
+    """Returns the higher of two ((count, -visit_id), site URL) entries; `top` may be None."""
+    # Ties go to the lowest visit_id, like the batch analyses' visit order
+    return candidate if top is None or candidate[0] > top[0] else top
+
+
+class LiveTail:
+    """Incrementally updated question A-F aggregates of a crawl database being written."""
+
+    def __init__(self, conn, target_api=TARGET_API, min_len=MIN_COOKIE_VALUE_LEN,
+                 check_encoded=CHECK_URL_ENCODED_VALUES, batch_size=DEFAULT_BATCH_SIZE, visit_timeout=VISIT_TIMEOUT):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.visit_timeout = visit_timeout
+        # Largest rowid read from each tailed table
+        self.high_water = dict.fromkeys(('crawl_history', 'incomplete_visits') + VISIT_TABLES, 0)
+        self.rows_read = Counter()
+        self.polls = 0
+
+        # Question A, and the visits: site URL and eTLD+1 (from site_visits) and status
+        self.failed_crawls = 0
+        self.failure_reasons = Counter()
+        self.incomplete_visits = 0
+        self.site_urls = {}
+        self.site_domains = {}
+        # visit_id -> whether its page load succeeded, once its GetCommand row is read
+        # (False for visits closed without one)
+        self.visit_ok = {}
+        # Rows of visits whose status or site is not known yet: visit_id -> table -> rows
+        self.pending = defaultdict(lambda: defaultdict(list))
+        # Open visits (not closed yet): visit_id -> time their last row was read
+        self.last_seen = {}
+        # Visits whose FinalizeCommand was read in the current and in the previous poll
+        self._finalized = []
+        self._finalizing = []
+        # Closed visits not retired yet: visit_id -> time they were closed
+        self.closed_at = {}
+        # Open visits seen in rows but not (yet) in site_visits
+        self._unknown_sites = set()
+        self.abandoned_visits = 0
+        # Totals of the retired visits, and the retired visit with the most third
+        # parties and syncs as ((count, -visit_id), site URL), ties to the lowest visit_id
+        self.retired_sites = 0
+        self.retired_successful = 0
+        self._top_third_party_visit = None
+        self._top_sync_visit = None
+
+        # Consumers of the rows of successful visits (B, D, E, F) and of every visit (C)
+        self.cookie_names = SetCookieNameCounter()
+        self.harvester = SyncValueHarvester(min_len=min_len)
+        self.sync_counter = SyncRequestCounter(self.harvester, check_encoded=check_encoded)
+        self.third_parties = ThirdPartyCounter(self.site_domains, get_etld1)
+        self.fingerprinting = FingerprintCallCounter(target_api, POTENTIAL_FP_APIS)
+        self.cookie_scripts = CookieScriptCounter(self.site_domains, get_etld1)
+        self.successful_consumers = {
+            'http_responses': [self.cookie_names, self.harvester],
+            'http_requests': [self.sync_counter, self.third_parties],
+            'javascript': [self.fingerprinting],
+        }
+        self.every_visit_consumers = {'javascript': [self.cookie_scripts]}
+        self.columns = {table: consumer_columns(self.successful_consumers[table] +
+                                                self.every_visit_consumers.get(table, []))
+                        for table in VISIT_TABLES}
+
+    def _new_rows(self, table, columns):
+        """Yields batches of the rows added to a table since the last poll, and advances its high-water mark."""
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT t.rowid, {', '.join(select_expression('t', name) for name in columns)} "
+                       f"FROM {table} t WHERE t.rowid > ? ORDER BY t.rowid", (self.high_water[table],))
+        try:
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                self.high_water[table] = rows[-1][0]
+                self.rows_read[table] += len(rows)
+                yield [row[1:] for row in rows]
+        finally:
+            cursor.close()
+
+    def _add_visits(self, visit_ids, now):
+        """Marks visits as seen and looks up the site_visits rows of those not seen before."""
+        visit_ids = set(visit_ids)
+        self.last_seen.update(dict.fromkeys(visit_ids, now))
+        # Rows written after a visit was closed reopen it
+        for visit_id in visit_ids & self.closed_at.keys():
+            del self.closed_at[visit_id]
+        new_visits = {visit_id for visit_id in visit_ids if visit_id not in self.site_urls} | self._unknown_sites
+        if not new_visits:
+            return
+        rows = self.conn.execute(f"SELECT sv.visit_id, sv.site_url FROM site_visits sv "
+                                 f"WHERE {visit_subset_clause('sv')}", (visit_subset_param(new_visits),)).fetchall()
+        for visit_id, site_url in rows:
+            self.site_urls[visit_id] = site_url
+            self.site_domains[visit_id] = get_etld1(site_url)
+        self._unknown_sites = new_visits - self.site_urls.keys()
+
+    def _ready(self, visit_id):
+        """Whether the rows of a visit can be counted: its status and its site are known."""
+        return visit_id in self.visit_ok and visit_id in self.site_urls
+
+    def _feed(self, consumers, table, columns, rows):
+        if rows and consumers:
+            batch = Batch(table, columns, rows)
+            for consumer in consumers:
+                consumer.consume(batch)
+
+    def _count(self, table, columns, rows):
+        """Feeds rows of visits with a known status to C, and those of successful visits to B, D, E and F."""
+        self._feed(self.every_visit_consumers.get(table), table, columns, rows)
+        self._feed(self.successful_consumers[table], table, columns,
+                   [row for row in rows if self.visit_ok.get(row[0])])
+
+    def _route(self, table, columns, rows):
+        """Counts the rows of ready visits and holds back the others."""
+        ready = []
+        for row in rows:
+            # A visit held back at the start of a poll stays held until its end,
+            # so that its rows are counted in table order
+            if row[0] not in self.pending and self._ready(row[0]):
+                ready.append(row)
+            else:
+                self.pending[row[0]][table].append(row)
+        self._count(table, columns, ready)
+
+    def _flush(self, visit_ids):
+        """Counts the held back rows of visits, table by table."""
+        held = [self.pending.pop(visit_id) for visit_id in visit_ids if visit_id in self.pending]
+        if not held:
+            return
+        for table in VISIT_TABLES:
+            self._count(table, self.columns[table], [row for tables in held for row in tables.get(table, ())])
+        self.sync_counter.finish()
+
+    def _close(self, visit_ids, now):
+        """
+        Releases the state of finished or abandoned visits: their held back rows are
+        counted with what is known (the site may still be missing), a visit without a
+        GetCommand row counts as abandoned, and their cookie values are dropped.
+        """
+        for visit_id in visit_ids:
+            if visit_id not in self.visit_ok:
+                self.visit_ok[visit_id] = False
+                self.abandoned_visits += 1
+        self._flush(visit_ids)
+        self.harvester.release(visit_ids)
+        for visit_id in visit_ids:
+            self.last_seen.pop(visit_id, None)
+            self._unknown_sites.discard(visit_id)
+            self.closed_at[visit_id] = now
+
+    def _retire(self, visit_ids):
+        """Folds closed visits into the running totals and deletes their per-visit entries."""
+        if not visit_ids:
+            return
+        third_party_counts = self.third_parties.release(visit_ids)
+        sync_counts = self.sync_counter.release(visit_ids)
+        self.cookie_scripts.release(visit_ids)
+        self.fingerprinting.release(visit_ids)
+        for visit_id in visit_ids:
+            del self.closed_at[visit_id]
+            site_url = self.site_urls.pop(visit_id, None)
+            self.site_domains.pop(visit_id, None)
+            self.retired_sites += site_url is not None
+            if self.visit_ok.pop(visit_id):
+                self.retired_successful += 1
+                self._top_third_party_visit = max_visit(self._top_third_party_visit,
+                                                        ((third_party_counts[visit_id], -visit_id), site_url))
+                self._top_sync_visit = max_visit(self._top_sync_visit, ((sync_counts[visit_id], -visit_id), site_url))
+
+    def _top_visit(self, retired_top, counts, successful):
+        """Returns (site URL, count) of the successful visit with the highest count, retired or open."""
+        top = retired_top
+        for visit_id in successful:
+            top = max_visit(top, ((counts(visit_id), -visit_id), self.site_urls.get(visit_id)))
+        return top and (top[1], top[0][0])
+
+    def poll(self, now=None):
+        """Reads and folds in the rows added since the last poll; returns their number."""
+        now = time.monotonic() if now is None else now
+        before = sum(self.rows_read.values())
+        # One read transaction per poll: every table is read from the same snapshot,
+        # so a visit's responses cannot be missed by a poll that reads its requests
+        self.conn.execute("BEGIN")
+        try:
+            self._read_new_rows(now)
+        finally:
+            self.conn.commit()
+
+        # Visits are closed one poll after their FinalizeCommand, leaving the storage
+        # controller a poll to flush their last rows, or once idle for visit_timeout
+        idle = [visit_id for visit_id, seen in self.last_seen.items() if now - seen >= self.visit_timeout]
+        self._close(set(self._finalizing) | set(idle), now)
+        self._finalizing, self._finalized = self._finalized, []
+        self._retire([visit_id for visit_id, closed in self.closed_at.items() if now - closed >= self.visit_timeout])
+        self.polls += 1
+        return sum(self.rows_read.values()) - before
+
+    def _read_new_rows(self, now):
+        for rows in self._new_rows('crawl_history', CRAWL_HISTORY_COLUMNS):
+            self._add_visits((row[0] for row in rows), now)
+            for visit_id, command, command_status, error in rows:
+                if command == 'FinalizeCommand':
+                    self._finalized.append(visit_id)
+                if command != 'GetCommand':
+                    continue
+                if command_status != 'ok':
+                    self.failed_crawls += 1
+                    self.failure_reasons[error] += 1
+                if visit_id not in self.visit_ok:
+                    self.visit_ok[visit_id] = command_status == 'ok'
+        for rows in self._new_rows('incomplete_visits', ('visit_id',)):
+            self.incomplete_visits += len(rows)
+
+        # Held back rows of visits that became ready go first
+        self._flush([visit_id for visit_id in self.pending if self._ready(visit_id)])
+        for table in VISIT_TABLES:
+            columns = self.columns[table]
+            for rows in self._new_rows(table, columns):
+                self._add_visits((row[0] for row in rows), now)
+                self._route(table, columns, rows)
+            if table == 'http_requests':
+                # Drops the visits' value matchers, which later responses may extend
+                self.sync_counter.finish()
+
+    def summary(self):
+        """Returns the current headline results of questions A-F."""
+        # The successful visits not retired yet
+        successful = [visit_id for visit_id, ok in self.visit_ok.items() if ok]
+        third_parties_by_visit = self.third_parties.third_parties_by_visit
+        sync_counts = self.sync_counter.sync_counts
+        partial = self.fingerprinting.partial
+        summary = {
+            'polls': self.polls,
+            'rows_read': dict(self.rows_read),
+            'pending_visits': len(self.pending),
+            'open_visits': len(self.last_seen),
+            'closed_visits': len(self.closed_at),
+            'abandoned_visits': self.abandoned_visits,
+            'total_sites': self.retired_sites + len(self.site_urls),
+            'failed_crawls': self.failed_crawls,
+            'incomplete_visits': self.incomplete_visits,
+            'failure_reasons': self.failure_reasons.most_common(3),
+            'successful_visits': self.retired_successful + len(successful),
+            'top_third_party_site': self._top_visit(self._top_third_party_visit,
+                                                    lambda visit_id: len(third_parties_by_visit.get(visit_id, ())),
+                                                    successful),
+            'most_common_third_party': (self.third_parties.site_counts.most_common(1) or [None])[0],
+            'top_cookie_script': self.cookie_scripts.top_script(),
+            'most_common_cookie': (self.cookie_names.cookie_name_counts.most_common(1) or [None])[0],
+            'max_syncs_site': self._top_visit(self._top_sync_visit, lambda visit_id: sync_counts.get(visit_id, 0),
+                                              successful),
+            'target_api': self.fingerprinting.target_api,
+            'target_calls': partial['total_target_calls'],
+            'sites_using_target': len(partial['sites_using_target']),
+            'top_target_script': (partial['script_counts'].most_common(1) or [None])[0],
+        }
+        return summary
+
+
+def print_summary(summary):
+    """Prints a live summary."""
+    print(f"\n=== Live summary at {time.strftime('%Y-%m-%d %H:%M:%S')} "
+          f"({summary['polls']} polls, {sum(summary['rows_read'].values())} rows read, "
+          f"{summary['open_visits']} visits in progress, {summary['pending_visits']} held back, "
+          f"{summary['closed_visits']} recently closed, "
+          f"{summary['abandoned_visits']} abandoned) ===")
+    print(f"A: {summary['total_sites']} sites, {summary['failed_crawls']} failed crawls, "
+          f"{summary['incomplete_visits']} incomplete visits")
+    for reason, count in summary['failure_reasons']:
+        print(f"   - {reason}: {count}")
+    print(f"   {summary['successful_visits']} successful visits")
+    if summary['top_third_party_site']:
+        print(f"B: most third parties: {summary['top_third_party_site'][0]} ({summary['top_third_party_site'][1]})")
+    if summary['most_common_third_party']:
+        print(f"   most common third party: {summary['most_common_third_party'][0]} "
+              f"({summary['most_common_third_party'][1]} sites)")
+    if summary['top_cookie_script']:
+        script_url, count, first_party = summary['top_cookie_script']
+        print(f"C: top document.cookie script: {script_url} ({count} operations, {first_party} first-party)")
+    if summary['most_common_cookie']:
+        print(f"D: most common cookie: {summary['most_common_cookie'][0]} ({summary['most_common_cookie'][1]} times)")
+    if summary['max_syncs_site']:
+        print(f"E: most cookie syncs: {summary['max_syncs_site'][0]} ({summary['max_syncs_site'][1]})")
+    print(f"F: {summary['target_api']}: {summary['target_calls']} calls on {summary['sites_using_target']} sites")
+    if summary['top_target_script']:
+        print(f"   top script: {summary['top_target_script'][0]} ({summary['top_target_script'][1]} calls)")
+
+
+# --- Main Analysis ---
+
+def follow(db_path=DB_FILE, poll_interval=POLL_INTERVAL, summary_interval=SUMMARY_INTERVAL, idle_timeout=None,
+           once=False, visit_timeout=VISIT_TIMEOUT):
+    """
+    Polls the crawl database and prints a summary every summary_interval seconds,
+    until interrupted, after one poll with `once`, or once no rows were added for
+    idle_timeout seconds. Prints a final summary and returns it.
+    """
+    if run_option('IMMUTABLE'):
+        logging.warning("Ignoring the immutable option: the crawl database is still being written.")
+    # Immutable connections would never see the writer's changes
+    conn = connect_readonly(db_path, immutable=False)
+    tail = LiveTail(conn, visit_timeout=visit_timeout)
+    last_summary = last_change = time.monotonic()
+    try:
+        while True:
+            started = time.perf_counter()
+            new_rows = tail.poll()
+            now = time.monotonic()
+            logging.info(f"Poll {tail.polls}: {new_rows} new rows in {time.perf_counter() - started:.2f}s.")
+            if new_rows:
+                last_change = now
+            if once or (idle_timeout is not None and now - last_change >= idle_timeout):
+                break
+            if now - last_summary >= summary_interval:
+                print_summary(tail.summary())
+                last_summary = now
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        logging.info("Stopped following.")
+    finally:
+        summary = tail.summary()
+        conn.close()
+    print_summary(summary)
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Follow a crawl database while it is being written and keep "
+                                                 "the question A-F results up to date.")
+    parser.add_argument('db', nargs='?', default=DB_FILE, help=f"Crawl database (default: {DB_FILE}).")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                        help=f"Seconds between polls (default: {POLL_INTERVAL}).")
+    parser.add_argument('--summary-interval', type=float, default=SUMMARY_INTERVAL,
+                        help=f"Seconds between summaries (default: {SUMMARY_INTERVAL}).")
+    parser.add_argument('--idle-timeout', type=float,
+                        help="Stop once no rows were added for this many seconds, e.g. after the crawl finished.")
+    parser.add_argument('--once', action='store_true', help="Poll once, print the summary and exit.")
+    parser.add_argument('--visit-timeout', type=float, default=VISIT_TIMEOUT,
+                        help=f"Close a visit that has not finished once none of its rows was added for this many "
+                             f"seconds (default: {VISIT_TIMEOUT}).")
+    args = parser.parse_args()
+    follow(args.db, args.poll_interval, args.summary_interval, args.idle_timeout, args.once, args.visit_timeout)
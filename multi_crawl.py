@@ -0,0 +1,237 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from crawl_db import connect_readonly, run_option
+from fingerprint_scan import POTENTIAL_FP_APIS, CooccurrenceMatrix, api_ids, sharded_scan
+from shared_scan import run_shared_scan
+
+# --- Configuration ---
+TARGET_API = 'HTMLCanvasElement.toDataURL'
+TOP_N = 5
+
+# Analyzes several crawl databases (e.g. one per region, date or browser
+# configuration) with one worker process per database. Each worker computes the
+# mergeable aggregates of questions A, B, D, E and F for its crawl; the parent
+# prints a report per crawl and one for all crawls combined.
+
+
+# --- Helper Functions ---
+
+def expand_db_paths(patterns):
+    """Expands globs into a sorted, de-duplicated list of existing database files."""
+    paths = []
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if not os.path.isfile(path):
+                logging.warning(f"Skipping {path}: not a file.")
+                continue
+            path = os.path.abspath(path)
+            if path not in paths:
+                paths.append(path)
+    return sorted(paths)
+
+
+def max_site(counts_by_visit, site_urls):
+    """Returns (count, site_url) of the visit with the highest count; ties go to the first visit, as in B and E."""
+    if not counts_by_visit:
+        return (0, None)
+    visit_id, count = max(counts_by_visit.items(), key=lambda item: item[1])
+    return (count, site_urls.get(visit_id))
+
+
+def analyze_crawl(db_path, target_api=TARGET_API):
+    """Computes the mergeable aggregates of one crawl; runs in a worker process."""
+    start = time.time()
+    conn = connect_readonly(db_path)
+    try:
+        cursor = conn.cursor()
+        total_sites = cursor.execute("SELECT COUNT(*) FROM site_visits").fetchone()[0]
+        failed_visits = cursor.execute("""
+            SELECT COUNT(*) FROM crawl_history
+            WHERE command = 'GetCommand' AND command_status != 'ok'
+        """).fetchone()[0]
+        incomplete_visits = cursor.execute("SELECT COUNT(*) FROM incomplete_visits").fetchone()[0]
+        successful_visit_ids = [row[0] for row in cursor.execute(run_option('SUCCESSFUL_VISITS_QUERY'))]
+
+        # Questions B, D and E share one pass over http_responses and http_requests
+        shared = run_shared_scan(conn)
+    finally:
+        conn.close()
+
+    site_urls = shared['site_urls']
+    third_parties_by_visit = shared['third_parties'].third_parties_by_visit
+    third_parties_per_site = {visit_id: len(third_parties_by_visit.get(visit_id, ()))
+                              for visit_id in successful_visit_ids}
+    sync_counts = shared['sync_counter'].sync_counts
+    syncs_per_visit = {visit_id: sync_counts.get(visit_id, 0) for visit_id in successful_visit_ids}
+
+    # Question F, scanned in-process: the crawls themselves are the unit of parallelism
+    scan = sharded_scan(db_path, successful_visit_ids, target_api, POTENTIAL_FP_APIS, workers=1)
+    cooccurrence = CooccurrenceMatrix.from_masks(list(api_ids(target_api, POTENTIAL_FP_APIS)),
+                                                 scan['context_masks'].values())
+
+    return {
+        'db': db_path,
+        'seconds': time.time() - start,
+        'total_sites': total_sites,
+        'failed_visits': failed_visits,
+        'incomplete_visits': incomplete_visits,
+        'successful_visits': len(successful_visit_ids),
+        # Question B: number of sites each third party was present on, and the
+        # distribution (number of third parties -> number of sites)
+        'third_party_site_counts': Counter(shared['third_parties'].third_party_site_counts()),
+        'third_parties_distribution': Counter(third_parties_per_site.values()),
+        'max_third_parties': max_site(third_parties_per_site, site_urls),
+        # Question D
+        'cookie_name_counts': Counter(shared['cookie_names'].cookie_name_counts),
+        # Question E: distribution of syncs per visit (number of syncs -> number of visits)
+        'sync_distribution': Counter(syncs_per_visit.values()),
+        'max_syncs': max_site(syncs_per_visit, site_urls),
+        # Question F
+        'target_api': target_api,
+        'sites_using_target': scan['sites_using_target'],
+        'total_target_calls': scan['total_target_calls'],
+        'target_script_counts': scan['script_counts'],
+        'cooccurrence': cooccurrence.aggregates(),
+    }
+
+
+def merge_crawls(results):
+    """Merges per-crawl aggregates; counts over sites add up across crawls."""
+    merged = {
+        'db': f"{len(results)} crawls combined",
+        'seconds': sum(result['seconds'] for result in results),
+        'third_party_site_counts': Counter(),
+        'third_parties_distribution': Counter(),
+        'cookie_name_counts': Counter(),
+        'sync_distribution': Counter(),
+        'sites_using_target': set(),
+        'target_script_counts': Counter(),
+        'max_third_parties': (0, None),
+        'max_syncs': (0, None),
+    }
+    for key in ('total_sites', 'failed_visits', 'incomplete_visits', 'successful_visits', 'total_target_calls'):
+        merged[key] = sum(result[key] for result in results)
+    cooccurrence = None
+    for result in results:
+        for key in ('third_party_site_counts', 'third_parties_distribution', 'cookie_name_counts',
+                    'sync_distribution', 'target_script_counts'):
+            merged[key].update(result[key])
+        merged['sites_using_target'] |= result['sites_using_target']
+        merged['max_third_parties'] = max(merged['max_third_parties'], result['max_third_parties'],
+                                          key=lambda item: item[0])
+        merged['max_syncs'] = max(merged['max_syncs'], result['max_syncs'], key=lambda item: item[0])
+        matrix = CooccurrenceMatrix.from_aggregates(result['cooccurrence'])
+        if cooccurrence is None:
+            cooccurrence = matrix
+        else:
+            cooccurrence.merge(matrix)
+        merged['target_api'] = result['target_api']
+    merged['cooccurrence'] = cooccurrence.aggregates()
+    return merged
+
+
+def distribution_mean(distribution):
+    """Returns the mean of a value -> frequency Counter."""
+    total = sum(distribution.values())
+    return sum(value * count for value, count in distribution.items()) / total if total else 0.0
+
+
+def print_crawl_report(result):
+    """Prints the headline results of one crawl (or of the combined crawls)."""
+    print("=" * 80)
+    print(f"{result['db']}")
+    print("=" * 80)
+    print(f"Sites: {result['total_sites']}, failed: {result['failed_visits']}, "
+          f"incomplete: {result['incomplete_visits']}, successful visits: {result['successful_visits']}")
+
+    print("\nThird parties (B):")
+    print(f"  Mean third parties per site: {distribution_mean(result['third_parties_distribution']):.2f}")
+    count, site_url = result['max_third_parties']
+    print(f"  Site with the most third parties: {site_url} ({count})")
+    for domain, sites in result['third_party_site_counts'].most_common(TOP_N):
+        print(f"  - {domain}: present on {sites} sites")
+
+    print("\nHTTP cookies (D):")
+    for name, count in result['cookie_name_counts'].most_common(TOP_N):
+        print(f"  - {name}: set {count} times")
+
+    print("\nCookie syncing (E):")
+    print(f"  Mean syncs per visit: {distribution_mean(result['sync_distribution']):.2f}")
+    count, site_url = result['max_syncs']
+    print(f"  Most syncs in one visit: {count} ({site_url})")
+
+    target_api = result['target_api']
+    print(f"\nFingerprinting (F, target '{target_api}'):")
+    print(f"  Distinct sites using the target: {len(result['sites_using_target'])}")
+    print(f"  Calls to the target: {result['total_target_calls']}")
+    cooccurrence = CooccurrenceMatrix.from_aggregates(result['cooccurrence'])
+    for api, count in cooccurrence.cooccurring(target_api).most_common(TOP_N):
+        print(f"  - co-occurs with {api}: {count}")
+    print(f"\n[{result['seconds']:.1f}s]\n")
+
+
+def to_json(result):
+    """Returns a JSON-serializable copy of one crawl's aggregates."""
+    cooccurrence = CooccurrenceMatrix.from_aggregates(result['cooccurrence'])
+    converted = {key: value for key, value in result.items() if key != 'cooccurrence'}
+    converted['sites_using_target'] = len(result['sites_using_target'])
+    converted['target_cooccurrence'] = dict(cooccurrence.cooccurring(result['target_api']))
+    for key in ('third_parties_distribution', 'sync_distribution'):
+        converted[key] = {str(value): count for value, count in sorted(result[key].items())}
+    return converted
+
+
+def analyze_crawls(db_paths, workers=None, target_api=TARGET_API):
+    """Analyzes every crawl in its own worker process; returns the results in db_paths order."""
+    workers = min(workers or os.cpu_count() or 1, len(db_paths))
+    logging.info(f"Analyzing {len(db_paths)} crawl(s) with {workers} worker process(es)...")
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(analyze_crawl, db_path, target_api): db_path for db_path in db_paths}
+        for future in as_completed(futures):
+            db_path = futures[future]
+            try:
+                results[db_path] = future.result()
+                logging.info(f"Finished {db_path} in {results[db_path]['seconds']:.1f}s.")
+            except Exception as e:
+                logging.error(f"Failed to analyze {db_path}: {e}")
+    return [results[db_path] for db_path in db_paths if db_path in results]
+
+
+if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Analyze several crawl databases in parallel and merge the results.")
+    parser.add_argument('dbs', nargs='+', help="Crawl database files or globs, e.g. 'crawls/*.sqlite'.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Maximum number of crawls analyzed at once (default: CPU count).")
+    parser.add_argument('--target-api', default=TARGET_API, help="Fingerprinting API to report on (question F).")
+    parser.add_argument('--json', help="Also write the per-crawl and combined aggregates to this JSON file.")
+    args = parser.parse_args()
+
+    db_paths = expand_db_paths(args.dbs)
+    if not db_paths:
+        parser.error("No crawl databases found.")
+    results = analyze_crawls(db_paths, args.workers, args.target_api)
+    if not results:
+        sys.exit(1)
+
+    for result in results:
+        print_crawl_report(result)
+    combined = merge_crawls(results)
+    if len(results) > 1:
+        print_crawl_report(combined)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'crawls': [to_json(result) for result in results], 'combined': to_json(combined)}, f, indent=2)
+    sys.exit(0 if len(results) == len(db_paths) else 1)
@@ -0,0 +1,115 @@
+import atexit
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from crawl_db import connect_readonly
+from result_cache import cached_query, db_path_of
+
+# Runs independent read queries concurrently. Each worker thread opens its own
+# read-only connection (connect_readonly()), and sqlite3 releases the GIL while
+# SQLite steps a query, so queries submitted together overlap instead of running
+# one after the other. Analyses submit their queries up front and wait on the
+# returned futures when they need the results.
+#
+# There is one executor per crawl database, shared by the analyses running in
+# this process (see executor_for()), and identical row queries in flight at the
+# same time share one future, so a query submitted by several analyses of one
+# process is only executed once.
+
+# --- Configuration ---
+QUERY_WORKERS = int(os.environ.get('CRAWL_QUERY_WORKERS') or 4)
+
+
+# --- Helper Functions ---
+
+class QueryExecutor:
+    """A thread pool running read queries, each thread on its own read-only connection."""
+
+    def __init__(self, db_path, workers=QUERY_WORKERS):
+        self.db_path = db_path
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='query')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        # (query, params) -> future of the row queries still running
+        self._in_flight = {}
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Only used by this thread; closed by close() once the pool has stopped
+            conn = connect_readonly(self.db_path, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def submit(self, fn, *args):
+        """Runs fn(conn, *args) on a worker thread's connection; returns its future."""
+        return self._pool.submit(lambda: fn(self._connection(), *args))
+
+    def query(self, query, params=()):
+        """
+        Returns a future of the rows (tuples) of a query, memoized in the result
+        cache like cached_query(). Identical queries in flight share the future,
+        so the rows must not be modified.
+        """
+        key = (query, tuple(params))
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+            future = self._in_flight[key] = self.submit(cached_query, query, params)
+        # Outside the lock: the callback runs right away if the query already finished
+        future.add_done_callback(lambda _: self._forget(key))
+        return future
+
+    def _forget(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def frame(self, query, params=()):
+        """Returns a future of a query's results as a DataFrame."""
+        # Imported here so that analyses which never build DataFrames don't pay for pandas
+        import pandas as pd
+
+        return self.submit(lambda conn: pd.read_sql_query(query, conn, params=params))
+
+    def close(self):
+        """Waits for the submitted queries, then closes the connections."""
+        self._pool.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def executor_for(conn):
+    """Returns the shared QueryExecutor of the database a connection reads."""
+    db_path = os.path.realpath(db_path_of(conn))
+    with _executors_lock:
+        executor = _executors.get(db_path)
+        if executor is None:
+            executor = _executors[db_path] = QueryExecutor(db_path)
+    return executor
+
+
+@atexit.register
+def close_executors():
+    """Closes the shared executors."""
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.close()
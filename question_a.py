@@ -1,35 +1,79 @@
-import sqlite3
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from collections import Counter
 
-# Connect to the database
-conn = sqlite3.connect('crawl-data-177.sqlite')
+from crawl_db import connect_readonly
+from query_executor import executor_for
+from result_cache import cached_stage
+from run_metrics import RunMetrics
 
-# First, let's check how many sites were supposed to be crawled
-sites_query = "SELECT COUNT(*) FROM site_visits"
-total_sites = pd.read_sql_query(sites_query, conn).iloc[0, 0]
-print(f"Total sites in site_visits table: {total_sites}")
+# --- Configuration ---
+DB_FILE = 'crawl-data-177.sqlite'
 
-# Let's look at failed crawls in crawl_history
-failed_crawls_query = """
+FAILED_CRAWLS_QUERY = """
 SELECT ch.visit_id, ch.command, ch.command_status, ch.error, sv.site_url
 FROM crawl_history ch
 LEFT JOIN site_visits sv ON ch.visit_id = sv.visit_id
 WHERE ch.command = 'GetCommand' AND ch.command_status != 'ok'
 """
-failed_crawls = pd.read_sql_query(failed_crawls_query, conn)
-print(f"Failed crawls: {len(failed_crawls)}")
-
-# Let's look at incomplete visits
-incomplete_query = "SELECT COUNT(*) FROM incomplete_visits"
-incomplete_visits = pd.read_sql_query(incomplete_query, conn).iloc[0, 0]
-print(f"Incomplete visits: {incomplete_visits}")
-
-# Analyze reasons for failure
-if len(failed_crawls) > 0:
-    reasons = Counter(failed_crawls['error'])
-    print("\nReasons for crawl failures:")
-    for reason, count in reasons.most_common():
-        print(f"- {reason}: {count}")
\ No newline at end of file
+
+
+# --- Analysis ---
+
+def analyze(conn, metrics=None):
+    """
+    Counts the sites, failed crawls and incomplete visits, and the reasons for
+    failures. The three queries are independent and run concurrently on the
+    database's query executor.
+    """
+    metrics = metrics or RunMetrics('question_a')
+    executor = executor_for(conn)
+    # How many sites were supposed to be crawled, the failed crawls in crawl_history
+    # and the incomplete visits
+    total_sites_future = executor.query("SELECT COUNT(*) FROM site_visits")
+    failed_crawls_future = executor.query(FAILED_CRAWLS_QUERY)
+    incomplete_visits_future = executor.query("SELECT COUNT(*) FROM incomplete_visits")
+
+    with metrics.stage("count sites"):
+        total_sites = total_sites_future.result()[0][0]
+
+    with metrics.stage("fetch failed crawls") as stage:
+        failed_crawls = failed_crawls_future.result()
+        stage.add_rows(len(failed_crawls))
+
+    with metrics.stage("count incomplete visits"):
+        incomplete_visits = incomplete_visits_future.result()[0][0]
+
+    return {
+        'total_sites': total_sites,
+        'failed_crawls': len(failed_crawls),
+        'incomplete_visits': incomplete_visits,
+        # Reasons for failure, in order of first appearance
+        'failure_reasons': Counter(row[3] for row in failed_crawls),
+    }
+
+
+def print_report(results):
+    """Prints the crawl status results."""
+    print(f"Total sites in site_visits table: {results['total_sites']}")
+    print(f"Failed crawls: {results['failed_crawls']}")
+    print(f"Incomplete visits: {results['incomplete_visits']}")
+
+    # Analyze reasons for failure
+    if results['failed_crawls'] > 0:
+        print("\nReasons for crawl failures:")
+        for reason, count in results['failure_reasons'].most_common():
+            print(f"- {reason}: {count}")
+
+
+def main(db_path=DB_FILE, metrics=None):
+    """Runs question A on the crawl database and prints the results."""
+    conn = connect_readonly(db_path)
+    try:
+        results = cached_stage(conn, 'question_a', {}, lambda: analyze(conn, metrics))
+    finally:
+        conn.close()
+    print_report(results)
+    return results
+
+
+if __name__ == "__main__":
+    main()
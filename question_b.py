@@ -1,129 +1,210 @@
 import sqlite3
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 from collections import Counter
-from urllib.parse import urlparse
-import tldextract 
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+import crawl_snapshot
+from crawl_db import connect_readonly, join_successful_visits, run_option
+from etld_resolver import get_etld1, get_etld1_column
+from histograms import histogram_path, integer_histogram, render_histogram, save_histogram
+from query_executor import executor_for
+from result_cache import cached_stage, with_run_options
+from run_metrics import RunMetrics
+from sampling import bootstrap_estimate, describe_sample, mean_estimate, population_size, print_estimates
+from scan_consumers import ThirdPartyCounter, ThirdPartySketch
+from sketches import SKETCH_PARAMS, print_error_bounds
+from table_scanner import TableScanner
 
 # --- Configuration ---
 DB_FILE = 'crawl-data-177.sqlite'
+PLOT_FILE = 'third_party_distribution.png'
+HISTOGRAM_FILE = histogram_path(PLOT_FILE)
+HISTOGRAM_BINS = 30
 
-# --- Helper Function ---
-def get_etld1(url):
-    """Extracts the eTLD+1 (effective top-level domain plus one) from a URL."""
-    if not isinstance(url, str) or not url.strip():
-        return None
-    try:
-        # urlparse helps handle protocols and ensures tldextract gets the domain part
-        parsed_url = urlparse(url)
-        extracted = tldextract.extract(parsed_url.netloc)
-        # Combine domain and suffix for eTLD+1
-        if extracted.domain and extracted.suffix:
-            return f"{extracted.domain}.{extracted.suffix}".lower()
-        else:
-            # Handle cases like bare IP addresses or localhosts if necessary
 
-            return parsed_url.netloc.lower() if parsed_url.netloc else None
-    except Exception as e:
-        return None
+# --- Analysis ---
 
-# --- Main Analysis ---
-conn = None 
-try:
-    logging.info(f"Connecting to database: {DB_FILE}")
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+def analyze(conn, snapshot_dir=None, streaming=None, sketch=None, sample=None, metrics=None):
+    """
+    Counts the unique third parties of every successful visit and the number of
+    sites each third party was present on. `conn` is unused with a snapshot. With
+    `sketch`, requests are streamed into fixed-memory sketches (see ThirdPartySketch)
+    and the results are approximate. With `sample`, the successful visits are a
+    sample (see crawl_db.SAMPLE) and the results include estimates with confidence
+    intervals. Options left as None take the run options of crawl_db. Returns None
+    when there are no successful visits.
+    """
+    metrics = metrics or RunMetrics('question_b')
+    snapshot_dir = run_option('SNAPSHOT_DIR', snapshot_dir)
+    streaming = run_option('STREAMING', streaming)
+    sketch = run_option('SKETCH', sketch)
+    sample = run_option('SAMPLE', sample)
+    exact_sqlite = not (streaming or sketch or snapshot_dir)
+
+    if not snapshot_dir:
+        # The successful visits, the sites and (when not streaming) the requests are
+        # independent reads: they run concurrently on the query executor
+        executor = executor_for(conn)
+        successful_visits_future = executor.query(run_option('SUCCESSFUL_VISITS_QUERY'))
+        site_visits_future = executor.frame("SELECT visit_id, site_url FROM site_visits")
+        if exact_sqlite:
+            # Restrict to successful visits in SQL so only the rows we use are returned
+            requests_query = f"""
+            SELECT
+                r.visit_id,
+                r.url,
+                r.top_level_url,
+                sv.site_url  -- Get the canonical site URL from site_visits
+            FROM http_requests r
+            JOIN site_visits sv ON r.visit_id = sv.visit_id
+            {join_successful_visits('r')};
+            """
+            requests_future = executor.frame(requests_query)
 
     # 1. Identify successfully crawled visit_ids
     logging.info("Identifying successful crawls...")
-    successful_visits_query = """
-    SELECT DISTINCT visit_id
-    FROM crawl_history
-    WHERE command = 'GetCommand' AND command_status = 'ok';
-    """
-    successful_visit_ids = pd.read_sql_query(successful_visits_query, conn)['visit_id'].tolist()
+    with metrics.stage("fetch successful visits") as stage:
+        if snapshot_dir:
+            crawl_snapshot.check_source(snapshot_dir)
+            successful_visit_ids = crawl_snapshot.successful_visit_ids(snapshot_dir)
+        else:
+            successful_visit_ids = [row[0] for row in successful_visits_future.result()]
+        stage.add_rows(len(successful_visit_ids))
     logging.info(f"Found {len(successful_visit_ids)} successful visits.")
 
     if not successful_visit_ids:
         logging.error("No successful visits found. Cannot proceed.")
-        exit()
-
-    # 2. Fetch relevant HTTP requests for successful crawls
-    logging.info("Fetching HTTP requests for successful visits...")
-    # Using placeholders for the list of IDs for security and efficiency
-    placeholders = ','.join('?' for _ in successful_visit_ids)
-    requests_query = f"""
-    SELECT
-        r.visit_id,
-        r.url,
-        r.top_level_url,
-        sv.site_url  -- Get the canonical site URL from site_visits
-    FROM http_requests r
-    JOIN site_visits sv ON r.visit_id = sv.visit_id
-    WHERE r.visit_id IN ({placeholders});
-    """
-    # Execute query with the list of IDs as parameters
-    requests_df = pd.read_sql_query(requests_query, conn, params=successful_visit_ids)
-    logging.info(f"Fetched {len(requests_df)} HTTP requests.")
-
-    # 3. Determine first-party vs. third-party requests
-    logging.info("Analyzing requests for third parties...")
-    # Apply domain extraction function
-    # Use site_url from site_visits as the definitive first-party context
-    requests_df['request_etld1'] = requests_df['url'].apply(get_etld1)
-    requests_df['top_level_etld1'] = requests_df['site_url'].apply(get_etld1) # Compare against the visited site's domain
-
-    # Filter out rows where domain extraction failed or is identical
-    requests_df.dropna(subset=['request_etld1', 'top_level_etld1'], inplace=True)
-
-    # Identify third-party requests
-    third_party_requests = requests_df[
-        (requests_df['request_etld1'] != requests_df['top_level_etld1']) &
-        (requests_df['request_etld1'] != '') & # Ensure request domain is not empty
-        (requests_df['top_level_etld1'] != '') # Ensure top-level domain is not empty
-    ].copy() 
-
-    logging.info(f"Identified {len(third_party_requests)} third-party requests.")
-
-    # 4. Calculate the number of unique third-party domains per site
-    logging.info("Calculating unique third parties per site...")
-    # Group by visit_id and count unique third-party domains
-    third_parties_per_site = third_party_requests.groupby('visit_id')['request_etld1'].nunique().reset_index()
-    third_parties_per_site.rename(columns={'request_etld1': 'third_party_count'}, inplace=True)
-
-    # Add site_url back for context
-    site_visits_df = pd.read_sql_query("SELECT visit_id, site_url FROM site_visits", conn)
-    third_parties_per_site = pd.merge(third_parties_per_site, site_visits_df, on='visit_id', how='left')
-
-    # Handle sites with ZERO third parties (they wouldn't be in third_party_requests)
-    # Create a dataframe with all successful visits and merge
-    all_successful_sites = pd.DataFrame({'visit_id': successful_visit_ids})
-    all_successful_sites = pd.merge(all_successful_sites, site_visits_df, on='visit_id', how='left')
-    third_parties_per_site_full = pd.merge(all_successful_sites, third_parties_per_site[['visit_id', 'third_party_count']], on='visit_id', how='left')
-    third_parties_per_site_full['third_party_count'].fillna(0, inplace=True) 
-    third_parties_per_site_full['third_party_count'] = third_parties_per_site_full['third_party_count'].astype(int)
+        if exact_sqlite:
+            requests_future.cancel()
+        return None
+
+    error_bounds = None
+    if (streaming or sketch) and not snapshot_dir:
+        # 2-4. Stream requests in chunks, keeping only each visit's set of
+        # third-party eTLD+1s (or its HyperLogLog) and a domain -> site count map
+        logging.info("Streaming HTTP requests for successful visits...")
+        site_visits_df = site_visits_future.result()
+        successful_sites = set(successful_visit_ids)
+        site_domains = {visit_id: get_etld1(site_url)
+                        for visit_id, site_url in zip(site_visits_df['visit_id'], site_visits_df['site_url'])
+                        if visit_id in successful_sites}
+        scanner = TableScanner(conn, successful_only=True, metrics=metrics)
+        consumer = ThirdPartySketch if sketch else ThirdPartyCounter
+        counter = scanner.register(consumer(site_domains, get_etld1))
+        scanner.run()
+        logging.info(f"Identified {counter.third_party_requests} third-party requests.")
+
+        third_parties_per_site_full = pd.merge(pd.DataFrame({'visit_id': successful_visit_ids}),
+                                               site_visits_df, on='visit_id', how='left')
+        third_parties_per_site_full['third_party_count'] = [
+            len(counter.third_parties_by_visit.get(visit_id, ())) for visit_id in successful_visit_ids
+        ]
+        third_party_site_counts = counter.third_party_site_counts()
+        if sketch:
+            error_bounds = counter.error_bounds()
+    else:
+        # 2. Fetch relevant HTTP requests for successful crawls
+        logging.info("Fetching HTTP requests for successful visits...")
+        with metrics.stage("fetch requests") as stage:
+            if snapshot_dir:
+                site_visits_df = crawl_snapshot.load_frame(snapshot_dir, 'site_visits', ['visit_id', 'site_url'])
+                requests_df = crawl_snapshot.load_frame(snapshot_dir, 'http_requests', ['visit_id', 'url'])
+                requests_df = requests_df[requests_df['visit_id'].isin(successful_visit_ids)]
+                requests_df = pd.merge(requests_df, site_visits_df, on='visit_id')
+            else:
+                site_visits_df = site_visits_future.result()
+                requests_df = requests_future.result()
+            stage.add_rows(len(requests_df))
+        logging.info(f"Fetched {len(requests_df)} HTTP requests.")
+
+        # 3. Determine first-party vs. third-party requests
+        logging.info("Analyzing requests for third parties...")
+        # Resolve domains once per distinct URL rather than once per row
+        # Use site_url from site_visits as the definitive first-party context
+        with metrics.stage("resolve domains", rows=len(requests_df)):
+            requests_df['request_etld1'] = get_etld1_column(requests_df['url'])
+            requests_df['top_level_etld1'] = get_etld1_column(requests_df['site_url']) # Compare against the visited site's domain
+
+        # Filter out rows where domain extraction failed or is identical
+        with metrics.stage("find third parties", rows=len(requests_df)):
+            requests_df.dropna(subset=['request_etld1', 'top_level_etld1'], inplace=True)
+
+            # Identify third-party requests
+            third_party_requests = requests_df[
+                (requests_df['request_etld1'] != requests_df['top_level_etld1']) &
+                (requests_df['request_etld1'] != '') & # Ensure request domain is not empty
+                (requests_df['top_level_etld1'] != '') # Ensure top-level domain is not empty
+            ].copy()
+
+        logging.info(f"Identified {len(third_party_requests)} third-party requests.")
+
+        # 4. Calculate the number of unique third-party domains per site
+        logging.info("Calculating unique third parties per site...")
+        with metrics.stage("count third parties per site", rows=len(third_party_requests)):
+            # Group by visit_id and count unique third-party domains
+            third_parties_per_site = third_party_requests.groupby('visit_id')['request_etld1'].nunique().reset_index()
+            third_parties_per_site.rename(columns={'request_etld1': 'third_party_count'}, inplace=True)
+
+            # Add site_url back for context
+            third_parties_per_site = pd.merge(third_parties_per_site, site_visits_df, on='visit_id', how='left')
 
+            # Handle sites with ZERO third parties (they wouldn't be in third_party_requests)
+            # Create a dataframe with all successful visits and merge
+            all_successful_sites = pd.DataFrame({'visit_id': successful_visit_ids})
+            all_successful_sites = pd.merge(all_successful_sites, site_visits_df, on='visit_id', how='left')
+            third_parties_per_site_full = pd.merge(all_successful_sites, third_parties_per_site[['visit_id', 'third_party_count']], on='visit_id', how='left')
+            third_parties_per_site_full['third_party_count'] = third_parties_per_site_full['third_party_count'].fillna(0)
+            third_parties_per_site_full['third_party_count'] = third_parties_per_site_full['third_party_count'].astype(int)
+
+            # We need to count how many *unique sites* each third party appeared on.
+            # Get unique pairs of (visit_id, third_party_domain)
+            unique_site_third_party = third_party_requests[['visit_id', 'request_etld1']].drop_duplicates()
+
+            # Count occurrences of each third party domain across different sites
+            third_party_site_counts = Counter(unique_site_third_party['request_etld1'])
+
+    sample_estimates = None
+    if sample and conn is not None:
+        population = population_size(conn)
+        counts = third_parties_per_site_full['third_party_count']
+        sample_estimates = {
+            'description': describe_sample(len(counts), population),
+            'estimates': {
+                'Mean third parties per site': mean_estimate(counts, population),
+                'Median third parties per site': bootstrap_estimate(counts, lambda a: np.median(a, axis=1),
+                                                                    population),
+            },
+        }
 
     logging.info("Analysis complete. Preparing results.")
+    return {
+        # One row per successful visit: visit_id, site_url, third_party_count
+        'third_parties_per_site': third_parties_per_site_full,
+        'third_party_site_counts': third_party_site_counts,
+        # Descriptions of the error bounds in sketch mode, None for exact results
+        'error_bounds': error_bounds,
+        # Estimates with confidence intervals when run on a sample, otherwise None
+        'sample_estimates': sample_estimates,
+    }
 
-    # --- Results ---
 
-    # 5. Plot distribution of third parties per site
-    plt.figure(figsize=(12, 6))
-    sns.histplot(third_parties_per_site_full['third_party_count'], bins=30, kde=False)
-    plt.title('Distribution of Third Parties per Site')
-    plt.xlabel('Number of Unique Third Parties')
-    plt.ylabel('Number of Sites')
-    plt.grid(axis='y', alpha=0.5)
-    # Save the plot
-    plot_filename = 'third_party_distribution.png'
-    plt.savefig(plot_filename)
-    logging.info(f"Distribution plot saved as {plot_filename}")
+def save_distribution(results, path=HISTOGRAM_FILE):
+    """Writes the distribution of third parties per site as a pre-binned histogram file."""
+    edges, counts = integer_histogram(results['third_parties_per_site']['third_party_count'], bins=HISTOGRAM_BINS)
+    return save_histogram(path, edges, counts, PLOT_FILE,
+                          title='Distribution of Third Parties per Site',
+                          xlabel='Number of Unique Third Parties',
+                          ylabel='Number of Sites',
+                          figsize=(12, 6),
+                          bar_style={'edgecolor': 'white', 'alpha': 0.75},
+                          grid_style={'axis': 'y', 'alpha': 0.5})
+
+
+def print_report(results, plot_filename=None):
+    """Prints the question B results."""
+    third_parties_per_site_full = results['third_parties_per_site']
+    third_party_site_counts = results['third_party_site_counts']
 
     # 6. Which site had the highest number of third parties?
     max_third_parties_site = third_parties_per_site_full.loc[third_parties_per_site_full['third_party_count'].idxmax()]
@@ -133,14 +214,6 @@ try:
     print(f"  Number of Third Parties: {max_third_parties_site['third_party_count']}")
 
     # 7. Which third party was present on the largest number of sites?
-    # We need to count how many *unique sites* each third party appeared on.
-    # Get unique pairs of (visit_id, third_party_domain)
-    unique_site_third_party = third_party_requests[['visit_id', 'request_etld1']].drop_duplicates()
-
-    # Count occurrences of each third party domain across different sites
-    third_party_site_counts = Counter(unique_site_third_party['request_etld1'])
-
-    # Find the most common third party
     if third_party_site_counts:
         most_common_third_party, count = third_party_site_counts.most_common(1)[0]
         print(f"\nMost common third party (present on the largest number of sites):")
@@ -149,17 +222,69 @@ try:
     else:
         print("\nNo third parties found across any sites.")
 
+    if results.get('error_bounds'):
+        print_error_bounds(results['error_bounds'])
+    if results.get('sample_estimates'):
+        print_estimates(results['sample_estimates']['estimates'], results['sample_estimates']['description'])
 
     print("\nNote: Analysis based on successfully crawled sites only.")
-    print(f"Distribution plot saved as {plot_filename}")
-
-except sqlite3.Error as e:
-    logging.error(f"Database error: {e}")
-except FileNotFoundError:
-    logging.error(f"Database file not found: {DB_FILE}")
-except Exception as e:
-    logging.error(f"An unexpected error occurred: {e}")
-finally:
-    if conn:
-        conn.close()
-        logging.info("Database connection closed.")
\ No newline at end of file
+    if plot_filename:
+        print(f"Distribution plot saved as {plot_filename}")
+
+
+# --- Main Analysis ---
+
+def main(db_path=DB_FILE, plot=None, metrics=None):
+    """
+    Runs question B, prints the results and saves the histogram data; the plot is
+    rendered too unless `plot` is False (default: unless DEFER_PLOTS). Returns None on failure.
+    """
+    metrics = metrics or RunMetrics('question_b')
+    if plot is None:
+        plot = not run_option('DEFER_PLOTS')
+    conn = None
+    try:
+        snapshot_dir = run_option('SNAPSHOT_DIR')
+        if snapshot_dir:
+            logging.info(f"Loading columnar snapshot: {snapshot_dir}")
+        else:
+            logging.info(f"Connecting to database: {db_path}")
+            conn = connect_readonly(db_path)
+
+        # Memoized in the result cache, keyed on the crawl DB and the analysis options
+        params = with_run_options({'visits': run_option('SUCCESSFUL_VISITS_QUERY'),
+                                   'SKETCH': run_option('SKETCH') and SKETCH_PARAMS},
+                                  'STREAMING', 'SNAPSHOT_DIR')
+        results = cached_stage(conn, 'question_b', params, lambda: analyze(conn, metrics=metrics))
+        if results is None:
+            return None
+
+        # 5. Distribution of third parties per site, pre-binned so that the plot
+        # can also be rendered later by the plot stage (histograms.py)
+        with metrics.stage("save histogram"):
+            save_distribution(results)
+        logging.info(f"Histogram data saved as {HISTOGRAM_FILE}")
+        plot_filename = None
+        if plot:
+            with metrics.stage("plot"):
+                plot_filename = render_histogram(HISTOGRAM_FILE)
+            logging.info(f"Distribution plot saved as {plot_filename}")
+        print_report(results, plot_filename)
+        return results
+
+    except sqlite3.Error as e:
+        logging.error(f"Database error: {e}")
+    except FileNotFoundError:
+        logging.error(f"Database file not found: {db_path}")
+    except Exception as e:
+        logging.error(f"An unexpected error occurred: {e}")
+    finally:
+        if conn:
+            conn.close()
+            logging.info("Database connection closed.")
+
+
+if __name__ == "__main__":
+    # Configure logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -1,62 +1,159 @@
-import sqlite3
 import pandas as pd
-import tldextract
 import logging
 
+import crawl_snapshot
+from crawl_db import connect_readonly, join_successful_visits, run_option
+from etld_resolver import get_etld1_column
+from result_cache import cached_stage, with_run_options
+from run_metrics import RunMetrics
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Configuration ---
-conn = sqlite3.connect('crawl-data-177.sqlite')
+DB_FILE = 'crawl-data-177.sqlite'
+# Full ranking of the scripts setting cookies; .json writes a list of records instead of CSV
+LEADERBOARD_FILE = 'script_cookie_leaderboard.csv'
+TOP_N = 10
 
-# Helper function to extract eTLD+1 domain
-def get_etld1(url):
-    """Extracts the effective top-level domain plus one from a URL."""
-    if not isinstance(url, str) or not url.strip():
-        return None
-    try:
-        extracted = tldextract.extract(url)
-        if extracted.domain and extracted.suffix:
-            return f"{extracted.domain}.{extracted.suffix}".lower()
+LEADERBOARD_COLUMNS = ['script_url', 'script_domain', 'operations', 'first_party_operations',
+                       'third_party_operations', 'sites']
+
+
+# --- Helper Functions ---
+
+def resolve_distinct(urls):
+    """Maps each distinct URL of a column to its eTLD+1, resolving every URL once."""
+    distinct = pd.Series(urls.dropna().unique(), dtype=object)
+    return urls.map(dict(zip(distinct, get_etld1_column(distinct))))
+
+
+def build_leaderboard(script_visits):
+    """
+    Ranks the scripts from their per-visit operation counts (script_url, visit_id,
+    site_url, operations rows): operations, first- and third-party operations and
+    the number of sites (visits) the script set cookies on, most operations first.
+    """
+    script_visits = script_visits.dropna(subset=['script_url'])
+    script_visits = script_visits.assign(script_domain=resolve_distinct(script_visits['script_url']),
+                                         site_domain=resolve_distinct(script_visits['site_url']))
+    # An operation is first-party if the script is served from the site's eTLD+1
+    is_first_party = script_visits['script_domain'] == script_visits['site_domain']
+    script_visits = script_visits.assign(first_party_operations=script_visits['operations'].where(is_first_party, 0))
+    leaderboard = script_visits.groupby('script_url', sort=True).agg(
+        script_domain=('script_domain', 'first'),
+        operations=('operations', 'sum'),
+        first_party_operations=('first_party_operations', 'sum'),
+        sites=('visit_id', 'nunique'),
+    ).reset_index()
+    leaderboard['third_party_operations'] = leaderboard['operations'] - leaderboard['first_party_operations']
+    # Ties keep the script_url order
+    leaderboard = leaderboard.sort_values('operations', ascending=False, kind='stable', ignore_index=True)
+    return leaderboard[LEADERBOARD_COLUMNS]
+
+
+def save_leaderboard(leaderboard, path=LEADERBOARD_FILE):
+    """Writes the leaderboard as CSV, or as JSON records if the path ends in .json; returns the path."""
+    if path.endswith('.json'):
+        leaderboard.to_json(path, orient='records', indent=2)
+    else:
+        leaderboard.to_csv(path, index=False)
+    return path
+
+
+# --- Analysis ---
+
+def analyze(conn, snapshot_dir=None, sample=None, metrics=None):
+    """
+    Ranks the scripts setting cookies via document.cookie by operations, with how
+    many of them ran in a first-party context. Operations are counted per script
+    and visit by SQLite, so the work in Python scales with the number of distinct
+    scripts rather than operations. `conn` is unused with a snapshot. With
+    `sample`, only the sampled visits (see crawl_db.SAMPLE) are read. Options left
+    as None take the run options of crawl_db.
+    """
+    metrics = metrics or RunMetrics('question_c')
+    snapshot_dir = run_option('SNAPSHOT_DIR', snapshot_dir)
+    sample = run_option('SAMPLE', sample)
+
+    # Count the JavaScript operations that set document.cookie per script and visit
+    with metrics.stage("count operations by script and visit") as stage:
+        if snapshot_dir:
+            logging.info(f"Loading columnar snapshot: {snapshot_dir}")
+            crawl_snapshot.check_source(snapshot_dir)
+            js_df = crawl_snapshot.load_frame(snapshot_dir, 'javascript',
+                                              ['visit_id', 'script_url', 'symbol', 'operation'])
+            js_df = js_df[(js_df['symbol'] == 'window.document.cookie') & (js_df['operation'] == 'set')]
+            # Group on plain values (references to the dictionary strings) like the SQLite path does
+            js_df = js_df[['visit_id', 'script_url']].astype({'script_url': object})
+            script_visits = js_df.groupby(['script_url', 'visit_id'], dropna=False).size().rename('operations')
+            site_visits_df = crawl_snapshot.load_frame(snapshot_dir, 'site_visits', ['visit_id', 'site_url'])
+            script_visits = pd.merge(script_visits.reset_index(), site_visits_df.astype({'site_url': object}),
+                                     on='visit_id')
         else:
-            return None
-    except:
-        return None
-
-# Get JavaScript operations that set document.cookie
-cookie_set_query = """
-SELECT j.script_url, j.document_url, j.top_level_url, sv.site_url
-FROM javascript j
-JOIN site_visits sv ON j.visit_id = sv.visit_id
-WHERE j.symbol = 'window.document.cookie' AND j.operation = 'set'
-"""
-cookie_set_df = pd.read_sql_query(cookie_set_query, conn)
-logging.info(f"Found {len(cookie_set_df)} cookie-setting operations")
-
-# Count cookie-setting operations by script
-script_counts = cookie_set_df.groupby('script_url').size().sort_values(ascending=False)
-
-# Get the top script
-if not script_counts.empty:
-    top_script = script_counts.index[0]
-    top_script_count = script_counts.iloc[0]
-    
-    # Extract domains for first-party analysis
-    cookie_set_df['script_domain'] = cookie_set_df['script_url'].apply(get_etld1)
-    cookie_set_df['site_domain'] = cookie_set_df['site_url'].apply(get_etld1)
-    
-    # Determine if cookie-setting is in first-party context
-    cookie_set_df['is_first_party'] = cookie_set_df['script_domain'] == cookie_set_df['site_domain']
-    
-    # Count first-party cookies for the top script
-    top_script_ops = cookie_set_df[cookie_set_df['script_url'] == top_script]
-    first_party_count = top_script_ops['is_first_party'].sum()
-    
-    print(f"\nScript setting most cookies: {top_script}")
-    print(f"Total cookie operations: {top_script_count}")
-    print(f"First-party cookie operations: {first_party_count}")
-else:
-    print("No scripts found setting cookies")
-
-# Close the connection
-conn.close()
\ No newline at end of file
+            script_visits_query = f"""
+            SELECT g.script_url, g.visit_id, sv.site_url, g.operations
+            FROM (
+                SELECT j.script_url, j.visit_id, COUNT(*) AS operations
+                FROM javascript j
+                {join_successful_visits('j') if sample else ''}
+                WHERE j.symbol = 'window.document.cookie' AND j.operation = 'set'
+                GROUP BY j.script_url, j.visit_id
+            ) g
+            JOIN site_visits sv ON g.visit_id = sv.visit_id
+            """
+            script_visits = pd.read_sql_query(script_visits_query, conn)
+        stage.add_rows(len(script_visits))
+    operations = int(script_visits['operations'].sum())
+    logging.info(f"Found {operations} cookie-setting operations")
+
+    with metrics.stage("rank scripts", rows=len(script_visits)):
+        leaderboard = build_leaderboard(script_visits)
+
+    results = {'operations': operations, 'leaderboard': leaderboard, 'top_script': None}
+    if not leaderboard.empty:
+        top = leaderboard.iloc[0]
+        results.update({
+            'top_script': top['script_url'],
+            'top_script_count': int(top['operations']),
+            'first_party_count': int(top['first_party_operations']),
+        })
+    return results
+
+
+def print_report(results, top_n=TOP_N):
+    """Prints the question C results."""
+    if results['top_script'] is not None:
+        print(f"\nScript setting most cookies: {results['top_script']}")
+        print(f"Total cookie operations: {results['top_script_count']}")
+        print(f"First-party cookie operations: {results['first_party_count']}")
+        print(f"\nTop {top_n} of {len(results['leaderboard'])} scripts (operations, first/third-party, sites):")
+        for row in results['leaderboard'].head(top_n).itertuples(index=False):
+            print(f"  - {row.script_url}: {row.operations} ({row.first_party_operations}/"
+                  f"{row.third_party_operations}), {row.sites} sites")
+    else:
+        print("No scripts found setting cookies")
+
+
+def main(db_path=DB_FILE, leaderboard_path=LEADERBOARD_FILE, metrics=None):
+    """
+    Runs question C on the crawl database (or the columnar snapshot), prints the
+    results and writes the full script leaderboard.
+    """
+    conn = None if run_option('SNAPSHOT_DIR') else connect_readonly(db_path)
+    try:
+        params = with_run_options({'visits': run_option('SAMPLE') and run_option('SUCCESSFUL_VISITS_QUERY'),
+                                   'LEADERBOARD_COLUMNS': LEADERBOARD_COLUMNS}, 'SNAPSHOT_DIR')
+        results = cached_stage(conn, 'question_c', params, lambda: analyze(conn, metrics=metrics))
+    finally:
+        # Close the connection
+        if conn:
+            conn.close()
+    print_report(results)
+    if results['top_script'] is not None:
+        save_leaderboard(results['leaderboard'], leaderboard_path)
+        print(f"Leaderboard saved as {leaderboard_path}")
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
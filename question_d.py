@@ -1,112 +1,96 @@
 import sqlite3
-import pandas as pd
-import json
-from collections import Counter
 import logging
-import re 
 
+from checkpoints import plan_incremental, save_checkpoint
+from crawl_db import connect_readonly, run_option
+from query_executor import executor_for
+from result_cache import cached_stage, with_run_options
+from run_metrics import RunMetrics
+from sampling import describe_sample, population_size
+from scan_consumers import SetCookieNameCounter
+from sketches import SKETCH_PARAMS, SpaceSaving, print_error_bounds
+from table_scanner import TableScanner
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Configuration ---
 DB_FILE = 'crawl-data-177.sqlite'
 
-# --- Helper Function ---
-def extract_cookie_name(set_cookie_value):
-    """Extracts the cookie name from a Set-Cookie header value."""
-    if not isinstance(set_cookie_value, str):
-        return None
-    # Cookie name is the part before the first '='
-    match = re.match(r'^([^=]+)=', set_cookie_value.strip())
-    if match:
-        return match.group(1).strip() 
-    return None 
 
-# --- Main Analysis ---
-conn = None
-try:
-    logging.info(f"Connecting to database: {DB_FILE}")
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+# --- Analysis ---
+
+def analyze(conn, db_path=DB_FILE, incremental=None, sketch=None, metrics=None):
+    """
+    Counts the cookie names set via Set-Cookie headers in successful visits; the
+    returned SetCookieNameCounter holds the counts, of the top names only (a
+    SpaceSaving summary) with `sketch`. `db_path` locates the checkpoints in
+    incremental mode. Options left as None take the run options of crawl_db.
+    Returns None when there are no successful visits.
+    """
+    metrics = metrics or RunMetrics('question_d')
+    incremental = run_option('INCREMENTAL', incremental)
+    sketch = run_option('SKETCH', sketch)
 
     # 1. Identify successfully crawled visit_ids
     logging.info("Identifying successful crawls...")
-    successful_visits_query = """
-    SELECT DISTINCT visit_id
-    FROM crawl_history
-    WHERE command = 'GetCommand' AND command_status = 'ok';
-    """
-    successful_visit_ids = pd.read_sql_query(successful_visits_query, conn)['visit_id'].tolist()
+    with metrics.stage("fetch successful visits") as stage:
+        successful_visit_ids = [row[0] for row in executor_for(conn).query(run_option('SUCCESSFUL_VISITS_QUERY')).result()]
+        stage.add_rows(len(successful_visit_ids))
     logging.info(f"Found {len(successful_visit_ids)} successful visits.")
+    if run_option('SAMPLE'):
+        logging.info(f"Counting cookie names in a sample: {describe_sample(len(successful_visit_ids), population_size(conn))}")
 
     if not successful_visit_ids:
         logging.error("No successful visits found. Cannot proceed.")
-        exit()
-
-    # 2. Query http_responses for successful visits
-    logging.info("Querying HTTP responses for successful visits...")
-    placeholders = ','.join('?' for _ in successful_visit_ids)
-    # Fetch only necessary columns: visit_id and headers
-    responses_query = f"""
-    SELECT headers
-    FROM http_responses
-    WHERE visit_id IN ({placeholders});
-    """
-    responses_df = pd.read_sql_query(responses_query, conn, params=successful_visit_ids)
-    logging.info(f"Fetched {len(responses_df)} HTTP responses.")
+        return None
 
-    # 3. Parse headers and count cookie names
+    # 2. Scan http_responses for successful visits and count cookie names.
+    # In incremental mode, start from the checkpoint and scan only new visits.
     logging.info("Parsing Set-Cookie headers and counting cookie names...")
-    cookie_name_counts = Counter()
-    processed_responses = 0
-    json_errors = 0
-    no_header_count = 0
-    set_cookie_headers_found = 0
-
-    for headers_json in responses_df['headers']:
-        processed_responses += 1
-        if headers_json is None:
-            no_header_count += 1
-            continue
-        try:
-            # Headers are typically stored as a JSON list of [name, value] lists
-            headers_list = json.loads(headers_json)
-            if not isinstance(headers_list, list):
-                 continue
-
-            # Iterate through [name, value] pairs in the header list
-            for header_pair in headers_list:
-                # Check if it's a list/tuple with 2 elements: [name, value]
-                if isinstance(header_pair, (list, tuple)) and len(header_pair) == 2:
-                    header_name, header_value = header_pair
-                    # Case-insensitive check for 'Set-Cookie'
-                    if isinstance(header_name, str) and header_name.lower() == 'set-cookie':
-                        set_cookie_headers_found += 1
-                        cookie_name = extract_cookie_name(header_value)
-                        if cookie_name:
-                            cookie_name_counts[cookie_name] += 1
-        except json.JSONDecodeError:
-            json_errors += 1
-     
-        except Exception as e:
-             json_errors +=1 
-
-
-
-    logging.info(f"Processed {processed_responses} responses.")
-    logging.info(f"Found {set_cookie_headers_found} Set-Cookie headers.")
-    if no_header_count > 0:
-        logging.warning(f"{no_header_count} responses had NULL headers.")
-    if json_errors > 0:
-        logging.warning(f"Encountered {json_errors} errors decoding/processing JSON headers.")
-
-    # 4. Identify the most common cookie name
+    counter = SetCookieNameCounter(SpaceSaving() if sketch else None)
+    # Exact and sketch checkpoints cannot be merged into each other
+    checkpoint_params = {'SKETCH': SKETCH_PARAMS} if sketch else {}
+    if incremental:
+        saved, processed_visits, new_visits = plan_incremental(db_path, 'question_d', checkpoint_params,
+                                                               successful_visit_ids)
+        if saved:
+            counter.merge(saved)
+        scanner = TableScanner(conn, only_visits=new_visits, metrics=metrics)
+    else:
+        new_visits = successful_visit_ids
+        scanner = TableScanner(conn, successful_only=True, metrics=metrics)
+    scanner.register(counter)
+    if new_visits:
+        scanner.run()
+    if incremental:
+        save_checkpoint(db_path, 'question_d', checkpoint_params, processed_visits | new_visits,
+                        counter.aggregates())
+
+    logging.info(f"Processed {counter.processed_responses} responses.")
+    logging.info(f"Found {counter.set_cookie_headers_found} Set-Cookie headers.")
+    if counter.no_header_count > 0:
+        logging.warning(f"{counter.no_header_count} responses had NULL headers.")
+    if counter.json_errors > 0:
+        logging.warning(f"Encountered {counter.json_errors} errors decoding/processing JSON headers.")
+    return counter
+
+
+def print_report(counter):
+    """Prints the question D results."""
+    cookie_name_counts = counter.cookie_name_counts
+
+    # 3. Identify the most common cookie name
     print("\n--- Analysis Results ---")
     if cookie_name_counts:
         most_common_cookie, count = cookie_name_counts.most_common(1)[0]
         print(f"\nMost common cookie name set via HTTP Set-Cookie header:")
         print(f"  Cookie Name: {most_common_cookie}")
         print(f"  Times Set: {count}")
+        if isinstance(cookie_name_counts, SpaceSaving):
+            print_error_bounds({
+                'Times set': (f"at least {count - cookie_name_counts.error(most_common_cookie)}; counts are "
+                              f"overestimated by at most {cookie_name_counts.error_bound():.1f} "
+                              f"(Space-Saving, {cookie_name_counts.capacity} counters)"),
+            })
 
     else:
         print("\nNo Set-Cookie headers were successfully parsed or found in the responses for successful visits.")
@@ -114,13 +98,37 @@ try:
 
     print(f"\nNote: Analysis based on parsing Set-Cookie headers from HTTP responses during successful crawls.")
 
-except sqlite3.Error as e:
-    logging.error(f"Database error: {e}")
-except FileNotFoundError:
-    logging.error(f"Database file not found: {DB_FILE}")
-except Exception as e:
-    logging.error(f"An unexpected error occurred: {e}", exc_info=True)
-finally:
-    if conn:
-        conn.close()
-        logging.info("Database connection closed.")
\ No newline at end of file
+
+# --- Main Analysis ---
+
+def main(db_path=DB_FILE, metrics=None):
+    """Runs question D and prints the results; returns None on failure."""
+    if run_option('SNAPSHOT_DIR'):
+        logging.warning("Question D reads the crawl DB; the columnar snapshot (CRAWL_SNAPSHOT_DIR) is not used")
+    conn = None
+    try:
+        logging.info(f"Connecting to database: {db_path}")
+        conn = connect_readonly(db_path)
+        # Memoized in the result cache, keyed on the crawl DB and the analysis options
+        params = with_run_options({'visits': run_option('SUCCESSFUL_VISITS_QUERY'),
+                                   'SKETCH': run_option('SKETCH') and SKETCH_PARAMS}, 'INCREMENTAL')
+        counter = cached_stage(conn, 'question_d', params, lambda: analyze(conn, db_path, metrics=metrics))
+        if counter is not None:
+            print_report(counter)
+        return counter
+
+    except sqlite3.Error as e:
+        logging.error(f"Database error: {e}")
+    except FileNotFoundError:
+        logging.error(f"Database file not found: {db_path}")
+    except Exception as e:
+        logging.error(f"An unexpected error occurred: {e}", exc_info=True)
+    finally:
+        if conn:
+            conn.close()
+            logging.info("Database connection closed.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
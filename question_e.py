@@ -1,181 +1,107 @@
 import sqlite3
-import json
-from collections import Counter, defaultdict
-import re
-import matplotlib.pyplot as plt
+
 import numpy as np
-import pandas as pd 
-from urllib.parse import quote 
+
+from checkpoints import plan_incremental, save_checkpoint
+from cookie_utils import MIN_COOKIE_VALUE_LEN
+from crawl_db import connect_readonly, run_option
+from histograms import histogram_path, integer_histogram, render_histogram, save_histogram
+from query_executor import executor_for
+from result_cache import cached_stage, with_run_options
+from run_metrics import RunMetrics
+from sampling import (
+    bootstrap_estimate,
+    describe_sample,
+    mean_estimate,
+    population_size,
+    print_estimates,
+    proportion_estimate,
+)
+from scan_consumers import SyncRequestCounter, SyncValueHarvester
+from table_scanner import TableScanner
 
 # --- Configuration ---
 DB_PATH = 'crawl-data-177.sqlite'
+PLOT_FILE = 'cookie_sync_distribution.png'
+HISTOGRAM_FILE = histogram_path(PLOT_FILE)
 
-# Minimum length for a cookie value to be considered for syncing
-MIN_COOKIE_VALUE_LEN = 6
 # Set to True to also check for URL-encoded cookie values in URLs
 CHECK_URL_ENCODED_VALUES = True
 
-# --- Helper Functions ---
 
-def parse_cookie_string(cookie_str):
+# --- Analysis ---
+
+def analyze(conn, db_path=DB_PATH, incremental=None, sample=None, memory_budget=None, metrics=None):
     """
-    Parses the value from a Set-Cookie header string.
-    Returns the cookie value or None if parsing fails.
+    Counts the cookie syncs of every successful visit and finds the visit with the
+    most. `db_path` locates the checkpoints in incremental mode. With `sample`, the
+    successful visits are a sample (see crawl_db.SAMPLE) and the results include
+    estimates of the sync distribution with confidence intervals. Once the cookie
+    values outgrow `memory_budget` (MiB), they are spilled to disk and requests are
+    matched one partition of visits at a time. Options left as None take the run
+    options of crawl_db. Returns None when there are no successful visits.
     """
-    if not cookie_str or '=' not in cookie_str:
+    metrics = metrics or RunMetrics('question_e')
+    incremental = run_option('INCREMENTAL', incremental)
+    sample = run_option('SAMPLE', sample)
+    memory_budget = run_option('MEMORY_BUDGET', memory_budget)
+    # Use dictionary cursor for easier row access by column name
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    # 1. Get successful visit IDs
+    print("Finding successful visit IDs...")
+    with metrics.stage("fetch successful visits") as stage:
+        # Store in a set for efficient lookup
+        successful_visit_ids = {row[0] for row in executor_for(conn).query(run_option('SUCCESSFUL_VISITS_QUERY')).result()}
+        stage.add_rows(len(successful_visit_ids))
+    print(f"Found {len(successful_visit_ids)} successful visits.")
+
+    if not successful_visit_ids:
+        print("No successful visits found. Exiting.")
         return None
-    # Get the part before the first semicolon (if any)
-    name_value_part = cookie_str.split(';', 1)[0]
-    # Split by the first '='
-    parts = name_value_part.split('=', 1)
-    if len(parts) == 2:
-        # Return the value part, stripping whitespace
-        return parts[1].strip()
-    return None
-
-def extract_set_cookie_values(headers_json):
-    """
-    Extracts all cookie values from Set-Cookie headers in the headers JSON.
-    Handles multiple Set-Cookie headers.
-    """
-    values = set()
-    try:
-        headers = json.loads(headers_json)
-        
-        if isinstance(headers, list): 
-            for header_pair in headers:
-                 if len(header_pair) == 2 and header_pair[0].lower() == 'set-cookie':
-                     # Value might itself contain multiple cookies separated by newline in older formats
-                     # Or just be a single cookie string
-                     for single_cookie_str in header_pair[1].split('\n'):
-                         value = parse_cookie_string(single_cookie_str)
-                         if value and len(value) >= MIN_COOKIE_VALUE_LEN:
-                             values.add(value)
-                             
-        elif isinstance(headers, dict): 
-             # dict format loses multiple headers with the same name unless value concatenates them.
-      
-             for key, header_content in headers.items():
-                 if key.lower() == 'set-cookie':
-                    # The value associated with 'set-cookie' might be a single string
-                    # or multiple strings joined by newline
-                    for single_cookie_str in header_content.split('\n'):
-                        value = parse_cookie_string(single_cookie_str)
-                        if value and len(value) >= MIN_COOKIE_VALUE_LEN:
-                            values.add(value)
-
-    except (json.JSONDecodeError, TypeError, AttributeError) as e:
-
-        pass
-    return values
-
-# --- Main Analysis Logic ---
 
-print(f"Connecting to database: {DB_PATH}")
-conn = sqlite3.connect(DB_PATH)
-# Use dictionary cursor for easier row access by column name
-conn.row_factory = sqlite3.Row
-cursor = conn.cursor()
-
-# 1. Get successful visit IDs
-print("Finding successful visit IDs...")
-cursor.execute("""
-    SELECT DISTINCT visit_id
-    FROM crawl_history
-    WHERE command = 'GetCommand' AND command_status = 'ok'
-""")
-# Store in a set for efficient lookup
-successful_visit_ids = {row['visit_id'] for row in cursor.fetchall()}
-print(f"Found {len(successful_visit_ids)} successful visits.")
-
-if not successful_visit_ids:
-    print("No successful visits found. Exiting.")
-    conn.close()
-    exit()
-
-# 2. Extract Set-Cookie values for successful visits
-print(f"Extracting cookie values (min length {MIN_COOKIE_VALUE_LEN}) for successful visits...")
-cookies_by_visit = defaultdict(set)
-processed_responses = 0
-# Fetch responses in batches to manage memory
-cursor.execute("SELECT visit_id, headers FROM http_responses")
-while True:
-
-    rows = cursor.fetchmany(10000) 
-    if not rows:
-        break
-    for row in rows:
-        visit_id = row['visit_id']
-        if visit_id in successful_visit_ids:
-            headers_json = row['headers']
-            if headers_json:
-                cookie_values = extract_set_cookie_values(headers_json)
-                if cookie_values:
-                    cookies_by_visit[visit_id].update(cookie_values)
-            processed_responses += 1
-            if processed_responses % 50000 == 0:
-                print(f"  Processed {processed_responses} responses...")
-
-print(f"Finished extracting cookies. Found cookies for {len(cookies_by_visit)} visits.")
-
-# 3. Scan HTTP requests for cookie values in URLs
-print("Scanning HTTP requests for cookie values in URLs...")
-sync_counts = Counter()
-processed_requests = 0
-
-
-cursor.execute("SELECT visit_id, url FROM http_requests")
-while True:
-    rows = cursor.fetchmany(10000)
-    if not rows:
-        break
-    for row in rows:
-        visit_id = row['visit_id']
-        # Only process requests from successful visits that had cookies set
-        if visit_id in cookies_by_visit:
-            request_url = row['url']
-            if not request_url: # Skip if URL is null/empty
-                continue
-
-            # Get the set of potential cookie values for this visit
-            possible_values = cookies_by_visit[visit_id]
-
-            for value in possible_values:
-                # Check if the raw value is in the URL
-                match_found = False
-                if value in request_url:
-                    sync_counts[visit_id] += 1
-                    match_found = True 
-
-                # check for the URL-encoded version ONLY if raw didn't match
-                # This avoids double counting if raw and encoded are the same or both present
-                if not match_found and CHECK_URL_ENCODED_VALUES:
-                     try:
-                        encoded_value = quote(value)
-                        # Avoid checking if encoding didn't change it OR if encoded is same as raw
-                        if encoded_value != value and encoded_value in request_url:
-                             sync_counts[visit_id] += 1
-                     except Exception:
-                         # Ignore potential errors during encoding non-standard values
-                         pass
-
-            processed_requests += 1
-            if processed_requests % 100000 == 0:
-                print(f"  Processed {processed_requests} requests...")
-
-
-print(f"Finished scanning requests. Found syncs for {len(sync_counts)} visits.")
-
-# Add visits with 0 syncs to the counter for the distribution
-
-all_visit_sync_counts = {visit_id: sync_counts.get(visit_id, 0) for visit_id in successful_visit_ids}
-
-
-# 4. Analyze results: Find max syncs and corresponding site
-max_syncs = 0
-visit_id_with_max_syncs = -1
-
-if all_visit_sync_counts: # Check if dictionary is not empty
+    # 2. Extract Set-Cookie values for successful visits, then
+    # 3. Scan HTTP requests for cookie values in URLs.
+    # Both tables are read once; the request scan runs after all cookie values are known.
+    # In incremental mode, sync counts start from the checkpoint and only new visits are scanned.
+    print(f"Extracting cookie values (min length {MIN_COOKIE_VALUE_LEN}) for successful visits...")
+    checkpoint_params = {'MIN_COOKIE_VALUE_LEN': MIN_COOKIE_VALUE_LEN, 'CHECK_URL_ENCODED_VALUES': CHECK_URL_ENCODED_VALUES}
+    harvester = SyncValueHarvester(min_len=MIN_COOKIE_VALUE_LEN, memory_budget=memory_budget)
+    sync_counter = SyncRequestCounter(harvester, check_encoded=CHECK_URL_ENCODED_VALUES)
+    if incremental:
+        saved, processed_visits, new_visits = plan_incremental(db_path, 'question_e', checkpoint_params,
+                                                               successful_visit_ids)
+        if saved:
+            sync_counter.merge(saved)
+        scanner = TableScanner(conn, only_visits=new_visits, metrics=metrics)
+    else:
+        new_visits = successful_visit_ids
+        scanner = TableScanner(conn, successful_only=True, metrics=metrics)
+    scanner.register(harvester)
+    scanner.register(sync_counter)
+
+    if new_visits:
+        scanner.scan_table('http_responses')
+    print(f"Finished extracting cookies. Found cookies for {sync_counter.visits_with_cookies()} visits.")
+    if harvester.spill is not None:
+        print(f"Cookie values exceeded the {memory_budget} MiB memory budget; spilled "
+              f"{harvester.spill.records_written} visit entries into {harvester.spill.partitions} partitions.")
+
+    print("Scanning HTTP requests for cookie values in URLs...")
+    if new_visits:
+        scanner.scan_table('http_requests')
+    sync_counts = sync_counter.sync_counts
+    if incremental:
+        save_checkpoint(db_path, 'question_e', checkpoint_params, processed_visits | new_visits,
+                        sync_counter.aggregates())
+
+    print(f"Finished scanning requests. Found syncs for {len(sync_counts)} visits.")
+
+    # Add visits with 0 syncs to the counter for the distribution
+    all_visit_sync_counts = {visit_id: sync_counts.get(visit_id, 0) for visit_id in successful_visit_ids}
+
+    # 4. Find max syncs and corresponding site
     # Use max on the items, comparing by value (the count)
     visit_id_with_max_syncs, max_syncs = max(all_visit_sync_counts.items(), key=lambda item: item[1])
 
@@ -184,44 +110,108 @@ if all_visit_sync_counts: # Check if dictionary is not empty
     result = cursor.fetchone()
     site_url_with_max_syncs = result['site_url'] if result else "Unknown (visit_id not found in site_visits)"
 
+    sample_estimates = None
+    if sample:
+        population = population_size(conn)
+        values = list(all_visit_sync_counts.values())
+        sample_estimates = {
+            'description': describe_sample(len(values), population),
+            'estimates': {
+                'Mean syncs per visit': mean_estimate(values, population),
+                'Share of visits with a sync': proportion_estimate(sum(1 for count in values if count),
+                                                                   len(values), population),
+                'Median syncs per visit': bootstrap_estimate(values, lambda a: np.median(a, axis=1), population),
+                '90th percentile of syncs per visit': bootstrap_estimate(
+                    values, lambda a: np.quantile(a, 0.9, axis=1), population),
+            },
+        }
+
+    return {
+        'sync_counts': all_visit_sync_counts,
+        'max_syncs': max_syncs,
+        'visit_id_with_max_syncs': visit_id_with_max_syncs,
+        'site_url_with_max_syncs': site_url_with_max_syncs,
+        # Estimates with confidence intervals when run on a sample, otherwise None
+        'sample_estimates': sample_estimates,
+    }
+
+
+def print_report(results):
+    """Prints the question E results."""
     print("\n--- Analysis Results ---")
-    print(f"Maximum number of cookie syncs observed for a single visit: {max_syncs}")
-    print(f"Visit ID with max syncs: {visit_id_with_max_syncs}")
-    print(f"Site URL for max syncs: {site_url_with_max_syncs}")
-else:
-     print("\n--- Analysis Results ---")
-     print("No syncs found or no successful visits to analyze.")
-     site_url_with_max_syncs = "N/A" 
-
-# 5. Prepare data for plotting the distribution
-sync_counts_list = list(all_visit_sync_counts.values())
-
-# --- Close DB Connection ---
-conn.close()
-print("\nDatabase connection closed.")
-
-# 6. Plot the distribution
-if sync_counts_list:
-    print("Generating distribution plot...")
-    plt.figure(figsize=(12, 7))
+    print(f"Maximum number of cookie syncs observed for a single visit: {results['max_syncs']}")
+    print(f"Visit ID with max syncs: {results['visit_id_with_max_syncs']}")
+    print(f"Site URL for max syncs: {results['site_url_with_max_syncs']}")
+    if results.get('sample_estimates'):
+        print_estimates(results['sample_estimates']['estimates'], results['sample_estimates']['description'])
 
+
+def save_distribution(results, path=HISTOGRAM_FILE):
+    """Writes the distribution of syncs per visit as a pre-binned histogram file."""
+    sync_counts_list = list(results['sync_counts'].values())
     max_observed = max(sync_counts_list) if sync_counts_list else 0
     # Create bins up to max_observed+1, maybe step if max is very large
-    bin_edge_step = max(1, int(max_observed / 50)) 
-    bins = np.arange(0, max_observed + bin_edge_step + 1, bin_edge_step)
-
-    plt.hist(sync_counts_list, bins=bins, edgecolor='black', alpha=0.7)
+    bin_edge_step = max(1, int(max_observed / 50))
+    edges, counts = integer_histogram(sync_counts_list, step=bin_edge_step)
+    return save_histogram(path, edges, counts, PLOT_FILE,
+                          title="Distribution of Cookie Syncs per Successful Site Visit",
+                          xlabel="Number of Cookie Syncs Observed per Visit",
+                          ylabel="Number of Visits",
+                          figsize=(12, 7),
+                          bar_style={'edgecolor': 'black', 'alpha': 0.7},
+                          grid_style={'axis': 'y', 'linestyle': '--', 'alpha': 0.6})
 
-    plt.xlabel("Number of Cookie Syncs Observed per Visit")
-    plt.ylabel("Number of Visits")
-    plt.title("Distribution of Cookie Syncs per Successful Site Visit")
-    plt.grid(axis='y', linestyle='--', alpha=0.6)
 
-    plt.tight_layout()
-    plt.savefig("cookie_sync_distribution.png")
-    print("Plot saved as cookie_sync_distribution.png")
-
-else:
-    print("No sync data to plot.")
+# --- Main Analysis Logic ---
 
-print("\nScript finished.")
\ No newline at end of file
+def main(db_path=DB_PATH, plot=None, metrics=None):
+    """
+    Runs question E, prints the results and saves the histogram data; the plot is
+    rendered too unless `plot` is False (default: unless DEFER_PLOTS). Returns None
+    on failure or without successful visits.
+    """
+    metrics = metrics or RunMetrics('question_e')
+    if plot is None:
+        plot = not run_option('DEFER_PLOTS')
+    if run_option('SNAPSHOT_DIR'):
+        print("Warning: question E reads the crawl DB; the columnar snapshot (CRAWL_SNAPSHOT_DIR) is not used")
+    print(f"Connecting to database: {db_path}")
+    conn = None
+    try:
+        conn = connect_readonly(db_path)
+        # Memoized in the result cache, keyed on the crawl DB and the analysis parameters
+        params = with_run_options({'visits': run_option('SUCCESSFUL_VISITS_QUERY'),
+                                   'MIN_COOKIE_VALUE_LEN': MIN_COOKIE_VALUE_LEN,
+                                   'CHECK_URL_ENCODED_VALUES': CHECK_URL_ENCODED_VALUES},
+                                  'INCREMENTAL', 'MEMORY_BUDGET')
+        results = cached_stage(conn, 'question_e', params, lambda: analyze(conn, db_path, metrics=metrics))
+        if results is None:
+            return None
+        print_report(results)
+
+        # 5. Distribution of syncs per visit, pre-binned so that the plot can also be
+        # rendered later by the plot stage (histograms.py)
+        with metrics.stage("save histogram", rows=len(results['sync_counts'])):
+            save_distribution(results)
+        if plot:
+            print("Generating distribution plot...")
+            with metrics.stage("plot"):
+                plot_filename = render_histogram(HISTOGRAM_FILE)
+            print(f"Plot saved as {plot_filename}")
+        else:
+            print(f"Histogram data saved as {HISTOGRAM_FILE}")
+        return results
+
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    finally:
+        if conn:
+            conn.close()
+            print("\nDatabase connection closed.")
+
+
+if __name__ == "__main__":
+    main()
+    print("\nScript finished.")
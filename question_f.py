@@ -1,254 +1,194 @@
+import os
 import sqlite3
-from collections import Counter, defaultdict
-import tldextract 
-from urllib.parse import urlparse
+
+from checkpoints import plan_incremental, save_checkpoint
+from crawl_db import connect_readonly, join_successful_visits, run_option
+from fingerprint_scan import (
+    COOCCURRENCE_FILE,
+    POTENTIAL_FP_APIS,
+    CooccurrenceMatrix,
+    ScriptPartySketch,
+    api_ids,
+    merge_party_status,
+    sharded_scan,
+)
+from query_executor import executor_for
+from result_cache import cached_stage, with_run_options
+from run_metrics import RunMetrics
+from sampling import describe_sample, population_size, print_estimates, proportion_estimate
+from sketches import SKETCH_PARAMS, print_error_bounds
 
 # --- Configuration ---
 DB_PATH = 'crawl-data-177.sqlite'
 TARGET_API = 'HTMLCanvasElement.toDataURL'
 
-# List of potential fingerprinting API symbols identified from exploration
-
-POTENTIAL_FP_APIS = {
-    'window.navigator.userAgent', 'window.navigator.vendor', 'window.navigator.platform',
-    'window.navigator.plugins', 'CanvasRenderingContext2D.font', 'window.navigator.language',
-    'window.navigator.languages', 'window.navigator.cookieEnabled', 'HTMLCanvasElement.height',
-    'window.screen.colorDepth', 'HTMLCanvasElement.width', 'window.navigator.maxTouchPoints',
-    'window.navigator.product', 'HTMLCanvasElement.clientHeight', 'HTMLCanvasElement.clientWidth',
-    'CanvasRenderingContext2D.measureText', 'window.navigator.doNotTrack',
-    'window.navigator.sendBeacon', 'window.navigator.mimeTypes', 'window.navigator.appVersion',
-    'window.navigator.hardwareConcurrency', 'window.navigator.onLine', 'window.navigator.webdriver',
-    'window.navigator.permissions', 'window.navigator.globalPrivacyControl',
-    'HTMLCanvasElement.getContext', 'window.navigator.appName', 'CanvasRenderingContext2D.fillStyle',
-    'window.navigator.serviceWorker', 'window.screen.pixelDepth', 'window.navigator.appCodeName',
-    'CanvasRenderingContext2D.getImageData', 'window.navigator.mediaCapabilities',
-    'HTMLCanvasElement.toDataURL', 'window.navigator.mediaSession', 'CanvasRenderingContext2D.arc',
-    'CanvasRenderingContext2D.fillText', 'window.navigator.javaEnabled',
-    'window.navigator.productSub', 'HTMLCanvasElement.style', 'CanvasRenderingContext2D.fillRect',
-    'window.navigator.userActivation', 'window.navigator.requestMediaKeySystemAccess',
-    'CanvasRenderingContext2D.stroke', 'CanvasRenderingContext2D.fill', 'HTMLCanvasElement.tagName',
-    'window.navigator.__proto__', 'CanvasRenderingContext2D.lineWidth', 'window.navigator.oscpu',
-    'window.navigator.buildID', 'CanvasRenderingContext2D.strokeStyle',
-    'CanvasRenderingContext2D.textBaseline', 'window.navigator.vendorSub',
-    'window.navigator.credentials', 'window.navigator.mediaDevices', 'HTMLCanvasElement.nodeName',
-    'OfflineAudioContext.createOscillator', 'HTMLCanvasElement.nodeType',
-    'OfflineAudioContext.currentTime', 'CanvasRenderingContext2D.rect', 'window.navigator.storage',
-    'window.navigator.geolocation', 'HTMLCanvasElement.children',
-    'CanvasRenderingContext2D.createLinearGradient', 'window.navigator.pdfViewerEnabled',
-    'CanvasRenderingContext2D.shadowBlur', 'window.navigator.hasOwnProperty',
-    'CanvasRenderingContext2D.globalCompositeOperation', 'CanvasRenderingContext2D.shadowColor',
-    'HTMLCanvasElement.setAttribute', 'OfflineAudioContext.destination',
-    'OfflineAudioContext.startRendering', 'OfflineAudioContext.createDynamicsCompressor',
-    'OfflineAudioContext.hasOwnProperty', 'CanvasRenderingContext2D.createRadialGradient',
-    'CanvasRenderingContext2D.isPointInPath', 'OfflineAudioContext.oncomplete',
-    'HTMLCanvasElement.transferControlToOffscreen', 'HTMLCanvasElement.classList',
-    'CanvasRenderingContext2D.putImageData', 'HTMLCanvasElement.childNodes',
-    'CanvasRenderingContext2D.strokeText', 'HTMLCanvasElement.getBoundingClientRect',
-    'HTMLCanvasElement.addEventListener', 'HTMLCanvasElement.childElementCount',
-    'HTMLCanvasElement.textContent', 'CanvasRenderingContext2D.bezierCurveTo',
-    'HTMLCanvasElement.toBlob', 'OfflineAudioContext.state', 'window.navigator.locks',
-    'CanvasRenderingContext2D.restore', 'CanvasRenderingContext2D.save',
-    'CanvasRenderingContext2D.scale', 'HTMLCanvasElement.captureStream',
-    'HTMLCanvasElement.ownerDocument', 'HTMLCanvasElement.parentNode',
-    'window.navigator.getGamepads', 'AnalyserNode.frequencyBinCount',
-    'OfflineAudioContext.createAnalyser', 'AnalyserNode.context', 'AnalyserNode.fftSize',
-    'CanvasRenderingContext2D.arcTo', 'CanvasRenderingContext2D.rotate',
-    'HTMLCanvasElement.attributes', 'HTMLCanvasElement.matches', 'HTMLCanvasElement.namespaceURI',
-    'HTMLCanvasElement.querySelectorAll', 'window.navigator.toString',
-    'AnalyserNode.getFloatFrequencyData', 'window.navigator.clipboard',
-    'AnalyserNode.channelCount', 'AnalyserNode.channelCountMode',
-    'AnalyserNode.channelInterpretation', 'AnalyserNode.connect',
-    'AnalyserNode.getFloatTimeDomainData', 'AnalyserNode.maxDecibels',
-    'AnalyserNode.minDecibels', 'AnalyserNode.numberOfInputs', 'AnalyserNode.numberOfOutputs',
-    'AnalyserNode.smoothingTimeConstant', 'AudioContext.addEventListener',
-    'AudioContext.createOscillator', 'AudioContext.destination', 'AudioContext.resume',
-    'AudioContext.state', 'CanvasRenderingContext2D.shadowOffsetX',
-    'CanvasRenderingContext2D.shadowOffsetY', 'HTMLCanvasElement.className',
-    'HTMLCanvasElement.getElementsByTagName', 'HTMLCanvasElement.nextSibling',
-    'HTMLCanvasElement.offsetHeight', 'HTMLCanvasElement.offsetWidth',
-    'HTMLCanvasElement.previousSibling', 'OfflineAudioContext.addEventListener',
-    'OfflineAudioContext.createBiquadFilter', 'OfflineAudioContext.createBuffer',
-    'OfflineAudioContext.createBufferSource', 'OfflineAudioContext.listener',
-    'OfflineAudioContext.sampleRate', 'window.navigator.__lookupGetter__',
-    'window.navigator.getAutoplayPolicy', 'AnalyserNode.disconnect',
-    'AudioContext.createAnalyser', 'AudioContext.createGain',
-    'AudioContext.createScriptProcessor', 'AudioContext.sampleRate',
-    'CanvasRenderingContext2D.createImageData', 'HTMLCanvasElement.id',
-    'HTMLCanvasElement.parentElement', 'HTMLCanvasElement.removeEventListener',
-    'window.navigator.valueOf', 'window.navigator.wakeLock',
-
-}
-
+# The potential fingerprinting APIs are listed in fingerprint_scan.py
 OTHER_FP_APIS = POTENTIAL_FP_APIS - {TARGET_API}
 
-
-tld_cache = {}
+# Worker processes scanning the javascript table (1 scans in-process)
+JS_SCAN_WORKERS = os.cpu_count() or 1
 
 # --- Helper Functions ---
 
 def get_successful_visit_ids(cursor):
     """Fetches visit_ids for successful 'GetCommand' crawls."""
-    cursor.execute("""
-        SELECT DISTINCT visit_id
-        FROM crawl_history
-        WHERE command = 'GetCommand' AND command_status = 'ok'
-    """)
-    return {row['visit_id'] for row in cursor.fetchall()}
-
-def get_etld1(url_string):
-    """Extracts the eTLD+1 (registered domain) from a URL string, using a cache."""
-    if url_string is None:
-        return None
-    if url_string in tld_cache:
-        return tld_cache[url_string]
-
-    try:
-        # Handle potential // prefix or schemeless URLs for tldextract
-        if url_string.startswith('//'):
-            url_string = 'http:' + url_string
-        # tldextract handles missing scheme better
-        ext = tldextract.extract(url_string)
-        # registered_domain combines suffix and domain (e.g., google.com)
-        result = ext.registered_domain 
-        if not result: # Handle cases like 'localhost' or IPs where it's empty
-             result = ext.domain # Fall back to domain part if registered_domain is empty
-        tld_cache[url_string] = result
-        return result
-    except Exception:
-        # Handle potential parsing errors with unusual URLs
-        tld_cache[url_string] = None
-        return None
-
-def is_third_party(script_url, page_url):
-    """Determines if a script URL is third-party relative to the page URL."""
-    # Treat None/empty script URLs or data URIs as first-party
-    if not script_url or script_url.startswith('data:'):
-        return False
-    
-    if not page_url:
-         return True 
-
-    script_domain = get_etld1(script_url)
-    page_domain = get_etld1(page_url)
-
-    # If either domain could not be parsed, conservatively assume different
-    # unless they are identical strings (e.g. both None)
-    if not script_domain or not page_domain:
-        return script_domain != page_domain 
-
-    return script_domain != page_domain
-
-# --- Main Analysis Logic ---
-
-print(f"Connecting to database: {DB_PATH}")
-conn = None 
-try:
-    conn = sqlite3.connect(DB_PATH)
+    return {row[0] for row in executor_for(cursor.connection).query(run_option('SUCCESSFUL_VISITS_QUERY')).result()}
+
+
+def count_visits_calling(cursor, api):
+    """Counts the successful visits in which `api` was called."""
+    cursor.execute(f"""
+        SELECT COUNT(DISTINCT j.visit_id)
+        FROM javascript j
+        {join_successful_visits('j')}
+        WHERE j.symbol = ?
+    """, (api,))
+    return cursor.fetchone()[0]
+
+
+# --- Analysis ---
+
+def analyze(conn, db_path=DB_PATH, target_api=TARGET_API, incremental=None, workers=JS_SCAN_WORKERS,
+            sketch=None, sample=None, memory_budget=None, metrics=None):
+    """
+    Counts the sites and scripts calling target_api and the co-occurrence of every
+    pair of potential fingerprinting APIs. The javascript table is scanned from
+    db_path by `workers` processes. With `sketch`, the sites and the top scripts are
+    estimated in fixed memory. With `sample`, the successful visits are a sample (see
+    crawl_db.SAMPLE) and the share of sites calling target_api is estimated with a
+    confidence interval. With `memory_budget` (MiB), each worker spills its per-context
+    API masks to disk once they outgrow it and counts co-occurrences one partition
+    at a time. Options left as None take the run options of crawl_db. Returns None
+    when there are no successful visits.
+    """
+    metrics = metrics or RunMetrics('question_f')
+    incremental = run_option('INCREMENTAL', incremental)
+    sketch = run_option('SKETCH', sketch)
+    sample = run_option('SAMPLE', sample)
+    memory_budget = run_option('MEMORY_BUDGET', memory_budget)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
 
     print("Fetching successful visit IDs...")
-    successful_visit_ids = get_successful_visit_ids(cursor)
+    with metrics.stage("fetch successful visits") as stage:
+        successful_visit_ids = get_successful_visit_ids(cursor)
+        stage.add_rows(len(successful_visit_ids))
     print(f"Found {len(successful_visit_ids)} successful visits.")
 
     if not successful_visit_ids:
         print("No successful visits found. Exiting.")
-        exit()
-
-    # --- Data Structures ---
-    sites_using_target = set() 
-    # Stores details for each TARGET_API call for script analysis
-    target_api_calls = [] 
-    # Maps (visit_id, script_url) -> set of potential FP symbols called in that context
-    js_calls_per_script_visit = defaultdict(set) 
-    # Counts co-occurrences of OTHER_FP_APIS with TARGET_API in the same script/visit context
-    cooccurrence_counts = Counter() 
-    
-    print(f"Processing javascript table for target API '{TARGET_API}' and potential co-occurring APIs...")
-    processed_rows = 0
-    cursor.execute("SELECT visit_id, script_url, symbol, top_level_url FROM javascript")
-
-    while True:
-        rows = cursor.fetchmany(100000) # Process in chunks
-        if not rows:
-            break
-
-        for row in rows:
-            processed_rows += 1
-            visit_id = row['visit_id']
-
-            # Process only data from successful visits
-            if visit_id in successful_visit_ids:
-                symbol = row['symbol']
-                script_url = row['script_url']
-                top_level_url = row['top_level_url']
-                
-                # Check if the symbol is our target or another potential FP API
-                is_target = (symbol == TARGET_API)
-                is_other_fp = (symbol in OTHER_FP_APIS)
-
-                if is_target:
-                    if top_level_url: # Only count sites if we have a top_level_url
-                         sites_using_target.add(top_level_url)
-                    # Store details even if top_level_url is missing for script analysis consistency
-                    target_api_calls.append({
-                        'visit_id': visit_id, 
-                        'script_url': script_url, 
-                        'top_level_url': top_level_url
-                    })
-                
-                    if script_url is not None: # Use only contexts with a script_url
-                        js_calls_per_script_visit[(visit_id, script_url)].add(symbol)
-
-                elif is_other_fp:
-                    # Add other potential FP APIs to the context map
-                     if script_url is not None: # Use only contexts with a script_url
-                        js_calls_per_script_visit[(visit_id, script_url)].add(symbol)
-
-        if processed_rows % 500000 == 0:
-            print(f"  Processed {processed_rows} javascript entries...")
+        return None
 
+    # --- Incremental State ---
+    # With a checkpoint, only visits it does not cover are scanned and the
+    # saved aggregates are merged into the results below
+    checkpoint_params = {'TARGET_API': target_api, 'POTENTIAL_FP_APIS': sorted(POTENTIAL_FP_APIS),
+                         'COOCCURRENCE': 'matrix'}
+    if sketch:
+        checkpoint_params['SKETCH'] = SKETCH_PARAMS
+    if incremental:
+        saved, processed_visits, new_visits = plan_incremental(db_path, 'question_f', checkpoint_params,
+                                                               successful_visit_ids)
+    else:
+        saved, processed_visits, new_visits = None, set(), successful_visit_ids
+
+    print(f"Processing javascript table for target API '{target_api}' and potential co-occurring APIs...")
+    # The visits are split into visit_id ranges scanned by worker processes, each on
+    # its own read-only connection; only successful (and not yet processed) visits are read
+    with metrics.stage("scan javascript") as stage:
+        scan = sharded_scan(db_path, new_visits, target_api, POTENTIAL_FP_APIS, workers, sketch, memory_budget)
+        stage.add_rows(scan['processed_rows'])
+    processed_rows = scan['processed_rows']
+    sites_using_target = scan['sites_using_target']
+    # Maps (visit_id, script_url) -> bitmask of the potential FP APIs called in that context
+    context_masks = scan['context_masks']
     print(f"Finished processing {processed_rows} javascript entries.")
 
+    # Scripts calling the target API, with first/third-party contexts
+    script_counts = scan['script_counts']
+    script_party_status = scan['script_party_status']
+    total_target_calls = scan['total_target_calls']
+
+    # Co-occurrence counts of every pair of potential FP APIs over all script/visit contexts
+    with metrics.stage("count co-occurrences", rows=len(context_masks)):
+        cooccurrence = CooccurrenceMatrix.from_masks(list(api_ids(target_api, POTENTIAL_FP_APIS)),
+                                                     context_masks.values())
+        # With a memory budget, the shards already counted their contexts
+        if scan['cooccurrence'] is not None:
+            cooccurrence.merge(CooccurrenceMatrix.from_aggregates(scan['cooccurrence']))
+
+    # Every aggregate is per visit, so results of earlier runs merge by addition/union
+    if saved:
+        sites_using_target |= saved['sites_using_target']
+        script_counts.update(saved['script_counts'])
+        merge_party_status(script_party_status, saved['script_party_status'])
+        cooccurrence.merge(CooccurrenceMatrix.from_aggregates(saved['cooccurrence']))
+        total_target_calls += saved['total_target_calls']
+    if incremental:
+        save_checkpoint(db_path, 'question_f', checkpoint_params, processed_visits | new_visits, {
+            'sites_using_target': sites_using_target,
+            'script_counts': script_counts,
+            'script_party_status': script_party_status if sketch else {
+                script: dict(status) for script, status in script_party_status.items()},
+            'cooccurrence': cooccurrence.aggregates(),
+            'total_target_calls': total_target_calls,
+        })
+
+    sample_estimates = None
+    if sample:
+        population = population_size(conn)
+        sample_estimates = {
+            'description': describe_sample(len(successful_visit_ids), population),
+            'estimates': {
+                f"Share of sites calling {target_api}": proportion_estimate(
+                    count_visits_calling(cursor, target_api), len(successful_visit_ids), population),
+            },
+        }
+
+    return {
+        'target_api': target_api,
+        'sites_using_target': sites_using_target,
+        'total_target_calls': total_target_calls,
+        'script_counts': script_counts,
+        # A plain dict (rather than a defaultdict) so that the results can be cached
+        'script_party_status': script_party_status if sketch else dict(script_party_status),
+        'cooccurrence': cooccurrence,
+        # Estimates with confidence intervals when run on a sample, otherwise None
+        'sample_estimates': sample_estimates,
+    }
+
+
+def print_report(results):
+    """Prints the question F results."""
+    target_api = results['target_api']
+    script_counts = results['script_counts']
+    script_party_status = results['script_party_status']
+    total_target_calls = results['total_target_calls']
+    # Counts co-occurrences of the other potential FP APIs with the target in the same script/visit context
+    cooccurrence_counts = results['cooccurrence'].cooccurring(target_api)
+
     # --- Analysis Part 1: Target API Usage ---
     print("\n--- Target API Analysis ---")
-    num_sites_using_target = len(sites_using_target)
-    print(f"1. Number of distinct sites using '{TARGET_API}': {num_sites_using_target}")
-    
-    # Analyze scripts calling the target API
-    script_counts = Counter()
-    script_party_status = defaultdict(lambda: {'first': 0, 'third': 0}) 
+    num_sites_using_target = len(results['sites_using_target'])
+    print(f"1. Number of distinct sites using '{target_api}': {num_sites_using_target}")
 
     print("\n2. Analyzing scripts calling the target API:")
-    if not target_api_calls:
+    if not total_target_calls:
         print("  No calls to the target API were found in successful visits.")
     else:
-        print(f"  Total calls to '{TARGET_API}': {len(target_api_calls)}")
-        for call in target_api_calls:
-            script = call['script_url']
-           
-            script_key = script if script is not None else "(Inline/Unknown)" 
-            script_counts[script_key] += 1
-            
-            # Determine party status only if top_level_url is available
-            if call['top_level_url']:
-                is_third = is_third_party(script, call['top_level_url'])
-                if is_third:
-                    script_party_status[script_key]['third'] += 1
-                else:
-                    script_party_status[script_key]['first'] += 1
-            else:
-                # Cannot determine party status if top_level_url is missing
-                pass 
-        
+        print(f"  Total calls to '{target_api}': {total_target_calls}")
+
         print("\n  Top 10 scripts calling the target API (by frequency):")
         for script, count in script_counts.most_common(10):
             party_info = script_party_status[script]
             print(f"  - Script: {script}")
             print(f"    Count: {count} (First-party contexts: {party_info['first']}, Third-party contexts: {party_info['third']})")
-            
-        total_first_party_calls = sum(status['first'] for status in script_party_status.values())
-        total_third_party_calls = sum(status['third'] for status in script_party_status.values())
+
+        if isinstance(script_party_status, ScriptPartySketch):
+            total_first_party_calls, total_third_party_calls = script_party_status.totals()
+        else:
+            total_first_party_calls = sum(status['first'] for status in script_party_status.values())
+            total_third_party_calls = sum(status['third'] for status in script_party_status.values())
         print(f"\n  Overall Contexts (where determinable):")
         print(f"  - First-party contexts: {total_first_party_calls}")
         print(f"  - Third-party contexts: {total_third_party_calls}")
@@ -256,25 +196,15 @@ try:
 
     # --- Analysis Part 2: Co-occurrence ---
     print("\n--- API Co-occurrence Analysis ---")
-    print(f"Analyzing co-occurrence of other FP APIs with '{TARGET_API}' within the same script execution context...")
-
-    # Iterate through the contexts where JS calls happened
-    for (visit_id, script_url), symbols_called in js_calls_per_script_visit.items():
-        # Check if the target API was called by this script in this visit
-        if TARGET_API in symbols_called:
-            # If yes, iterate through all symbols called by this script in this visit
-            for other_symbol in symbols_called:
-                # Count if it's a *different* potential FP API
-                if other_symbol != TARGET_API and other_symbol in OTHER_FP_APIS:
-                    cooccurrence_counts[other_symbol] += 1
+    print(f"Analyzing co-occurrence of other FP APIs with '{target_api}' within the same script execution context...")
 
     if not cooccurrence_counts:
-         print(f"No co-occurrences found with '{TARGET_API}'.")
+         print(f"No co-occurrences found with '{target_api}'.")
     else:
         most_common_cooccurring = cooccurrence_counts.most_common(1)
         if most_common_cooccurring:
             api_name, count = most_common_cooccurring[0]
-            print(f"Most frequent co-occurring API with '{TARGET_API}':")
+            print(f"Most frequent co-occurring API with '{target_api}':")
             print(f"  - API: {api_name}")
             print(f"  - Co-occurrence Count: {count} (times seen in the same script context as the target)")
 
@@ -282,13 +212,53 @@ try:
             for api, num in cooccurrence_counts.most_common(5):
                  print(f"  - {api}: {num}")
 
-except sqlite3.Error as e:
-    print(f"Database error: {e}")
-except Exception as e:
-    print(f"An unexpected error occurred: {e}")
-finally:
-    if conn:
-        conn.close()
-        print("\nDatabase connection closed.")
+    if results.get('sample_estimates'):
+        print_estimates(results['sample_estimates']['estimates'], results['sample_estimates']['description'])
+
+    if isinstance(script_party_status, ScriptPartySketch):
+        sites = results['sites_using_target']
+        print_error_bounds({
+            'Distinct sites': (f"{sites.relative_error():.2%} standard error" if not sites.is_exact
+                               else "exact"),
+            'Script counts and contexts': (f"overestimated by at most {script_counts.error_bound():.1f} "
+                                           f"(Space-Saving, {script_counts.capacity} counters)"),
+        })
+
 
-print("\nScript finished.")
\ No newline at end of file
+# --- Main Analysis Logic ---
+
+def main(db_path=DB_PATH, metrics=None):
+    """Runs question F and prints the results; returns None on failure."""
+    if run_option('SNAPSHOT_DIR'):
+        print("Warning: question F reads the crawl DB; the columnar snapshot (CRAWL_SNAPSHOT_DIR) is not used")
+    print(f"Connecting to database: {db_path}")
+    conn = None
+    try:
+        conn = connect_readonly(db_path)
+        # Memoized in the result cache, keyed on the crawl DB and the analysis parameters
+        params = with_run_options({'visits': run_option('SUCCESSFUL_VISITS_QUERY'), 'TARGET_API': TARGET_API,
+                                   'POTENTIAL_FP_APIS': sorted(POTENTIAL_FP_APIS),
+                                   'SKETCH': run_option('SKETCH') and SKETCH_PARAMS},
+                                  'INCREMENTAL', 'MEMORY_BUDGET')
+        results = cached_stage(conn, 'question_f', params, lambda: analyze(conn, db_path, metrics=metrics))
+        if results is None:
+            return None
+
+        # Kept for querying other target APIs without a rescan (see fingerprint_scan.py)
+        results['cooccurrence'].save(COOCCURRENCE_FILE)
+        print_report(results)
+        return results
+
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    finally:
+        if conn:
+            conn.close()
+            print("\nDatabase connection closed.")
+
+
+if __name__ == "__main__":
+    main()
+    print("\nScript finished.")
@@ -0,0 +1,184 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import zlib
+
+from crawl_db import run_option
+from crawl_snapshot import db_fingerprint
+
+# On-disk memoization of query and stage results (see crawl_db.CACHE_DIR).
+# Entries are keyed on a hash of the crawl DB's fingerprint (path, size and
+# modification time, including its WAL file; the content itself is not hashed) with
+# the query text and parameters, or with a stage's name and parameters. A stage's
+# parameters include every run option choosing its code path (see
+# with_run_options()), so a change to the DB's file, to a parameter (e.g.
+# MIN_COOKIE_VALUE_LEN) or to an option misses the cache instead of returning stale
+# or mismatched results. A DB rewritten in place with the same size and mtime would
+# not be noticed. Values are stored as zlib-compressed pickles; the least recently
+# used entries are evicted once the cache grows past CACHE_MAX_BYTES.
+
+# --- Configuration ---
+CACHE_MAX_BYTES = 2 << 30
+ENTRY_SUFFIX = '.pickle.z'
+COMPRESSION_LEVEL = 1
+
+
+# --- Helper Functions ---
+
+def db_path_of(conn):
+    """Returns the path of the main database file of a connection."""
+    for _, name, path in conn.execute("PRAGMA database_list").fetchall():
+        if name == 'main':
+            return path
+    return None
+
+
+def cache_fingerprint(db_path):
+    """Returns db_fingerprint() of the crawl DB (including its WAL file if any)."""
+    return db_fingerprint(db_path)
+
+
+def _path_prefix(db_path):
+    # Entries of one DB share a prefix, so they can be invalidated together
+    return hashlib.sha256(os.path.realpath(db_path).encode()).hexdigest()[:16]
+
+
+def entry_path(cache_dir, db_path, kind, name, params):
+    """Returns the file of the entry keyed by the DB's current fingerprint, kind, name and params."""
+    key = json.dumps({'db': cache_fingerprint(db_path), 'kind': kind, 'name': name, 'params': params},
+                     sort_keys=True, default=str)
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return os.path.join(cache_dir, f"{_path_prefix(db_path)}-{digest}{ENTRY_SUFFIX}")
+
+
+def load_entry(path):
+    """Returns (True, value) for a readable entry, (False, None) otherwise."""
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return False, None
+    except (OSError, zlib.error, pickle.UnpicklingError, EOFError) as e:
+        logging.warning(f"Ignoring unreadable cache entry {path}: {e}")
+        return False, None
+    # Entries are evicted least recently used first
+    os.utime(path)
+    return True, value
+
+
+def store_entry(path, value, max_bytes=CACHE_MAX_BYTES):
+    """Atomically writes an entry, then evicts old entries past max_bytes."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), COMPRESSION_LEVEL))
+    os.replace(tmp_path, path)
+    evict(os.path.dirname(path), max_bytes)
+
+
+def list_entries(cache_dir):
+    """Returns (path, size, last use) of every entry, least recently used first."""
+    if not cache_dir or not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(ENTRY_SUFFIX):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+    return sorted(entries, key=lambda entry: entry[2])
+
+
+def evict(cache_dir, max_bytes=CACHE_MAX_BYTES):
+    """Deletes the least recently used entries until the cache fits in max_bytes; returns the number deleted."""
+    entries = list_entries(cache_dir)
+    total = sum(size for _, size, _ in entries)
+    deleted = 0
+    for path, size, _ in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+    return deleted
+
+
+def invalidate(cache_dir, db_path=None):
+    """Deletes the entries of one crawl DB, or every entry; returns the number deleted."""
+    prefix = _path_prefix(db_path) + '-' if db_path else ''
+    deleted = 0
+    for path, _, _ in list_entries(cache_dir):
+        if os.path.basename(path).startswith(prefix):
+            os.remove(path)
+            deleted += 1
+    return deleted
+
+
+def cached(conn, kind, name, params, compute, cache_dir=None):
+    """
+    Returns compute(), memoized on disk under the connection's DB fingerprint and
+    (kind, name, params). Without a cache directory or a connection (e.g. when
+    loading a snapshot), compute() is simply called.
+    """
+    cache_dir = run_option('CACHE_DIR', cache_dir)
+    db_path = db_path_of(conn) if cache_dir and conn is not None else None
+    if not db_path:
+        return compute()
+    path = entry_path(cache_dir, db_path, kind, name, params)
+    found, value = load_entry(path)
+    if found:
+        logging.info(f"Loaded {kind} '{name}' from the result cache.")
+        return value
+    value = compute()
+    store_entry(path, value)
+    return value
+
+
+def cached_query(conn, query, params=(), cache_dir=None):
+    """Returns the rows (tuples) of a query, memoized on disk (see cached())."""
+    def run_query():
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        return cursor.execute(query, params).fetchall()
+    return cached(conn, 'query', ' '.join(query.split()), list(params), run_query, cache_dir)
+
+
+def cached_stage(conn, stage, params, compute, cache_dir=None):
+    """Returns the result of an analysis stage, memoized on disk (see cached())."""
+    return cached(conn, 'stage', stage, params, compute, cache_dir)
+
+
+def with_run_options(params, *names):
+    """Returns a stage's params extended with the current values of the named run options (see crawl_db)."""
+    return dict(params, **{name: run_option(name) for name in names})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Inspect, prune or clear the on-disk result cache.")
+    parser.add_argument('cache_dir', nargs='?', default=run_option('CACHE_DIR'),
+                        help="Cache directory (default: $CRAWL_CACHE_DIR).")
+    parser.add_argument('--clear', action='store_true', help="Delete the cached results.")
+    parser.add_argument('--db', help="With --clear, only delete the results of this crawl DB.")
+    parser.add_argument('--max-bytes', type=int,
+                        help="Evict least recently used entries until the cache fits in this many bytes.")
+    args = parser.parse_args()
+    if not args.cache_dir:
+        parser.error("no cache directory given and CRAWL_CACHE_DIR is not set")
+
+    if args.clear:
+        print(f"Deleted {invalidate(args.cache_dir, args.db)} cache entries.")
+    if args.max_bytes is not None:
+        print(f"Evicted {evict(args.cache_dir, args.max_bytes)} cache entries.")
+    entries = list_entries(args.cache_dir)
+    print(f"{len(entries)} entries, {sum(size for _, size, _ in entries) / (1 << 20):.1f} MiB in {args.cache_dir}")
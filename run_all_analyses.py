@@ -1,92 +1,372 @@
+import argparse
+import contextlib
+import importlib
+import io
+import logging
+import multiprocessing
 import subprocess
 import time
+import traceback
 import os
 import sys
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 
-def run_script(script_name, description):
-    """Run a Python script and display its output."""
-    print("=" * 80)
-    print(f"Running {description} ({script_name})...")
-    print("=" * 80)
-    
+import crawl_db
+import run_metrics
+
+# Every task is (name, script, description, names of tasks it depends on).
+# The analyses are independent readers of the crawl DB; they only wait for the
+# index bootstrap so that they can use the indexes it creates.
+INDEX_TASK = ("indexes", "crawl_db.py", "Index Bootstrap", ())
+ANALYSIS_TASKS = [
+    ("a", "question_a.py", "Question A: Crawl Status Analysis", ("indexes",)),
+    ("b", "question_b.py", "Question B: Third-Party Analysis", ("indexes",)),
+    ("c", "question_c.py", "Question C: JavaScript Cookie Analysis", ("indexes",)),
+    ("d", "question_d.py", "Question D: HTTP Cookie Analysis", ("indexes",)),
+    ("e", "question_e.py", "Question E: Cookie Sync Analysis", ("indexes",)),
+    ("f", "question_f.py", "Question F: Fingerprinting API Analysis", ("indexes",)),
+]
+DEFAULT_METRICS_FILE = 'run_metrics.jsonl'
+# Questions whose table reads are covered by shared_scan.py
+SHARED_SCAN_TASK = ("bde", "shared_scan.py", "Questions B, D and E: Shared Table Scan", ("indexes",))
+SHARED_SCAN_NAMES = ("b", "d", "e")
+# The analyses only write pre-binned histograms; this task renders the PNGs from
+# them once the analyses it depends on (those of PLOTTED_NAMES that run) are done
+PLOT_TASK = ("plots", "histograms.py", "Plots: Render Histograms")
+PLOTTED_NAMES = ("b", "e")
+# The analyses that load the columnar snapshot (see crawl_snapshot.py); the others,
+# and the shared scan, always read the crawl DB
+SNAPSHOT_NAMES = ("b", "c")
+
+
+def sample_arg(value):
+    """argparse type of --sample: keeps the value once crawl_db.parse_sample accepts it."""
+    try:
+        crawl_db.parse_sample(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+def memory_budget_arg(value):
+    """argparse type of --memory-budget: a number of MiB, possibly fractional (e.g. 0.5)."""
+    try:
+        return crawl_db.parse_memory_budget(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def run_script(script_name):
+    """Run a Python script with its output buffered; returns its exit status, output and timing."""
     # Set environment variable to ignore deprecation warnings
     env = os.environ.copy()
     env["PYTHONWARNINGS"] = "ignore::DeprecationWarning,ignore::FutureWarning"
-    
-    # Run the script with warnings suppressed
-    process = subprocess.Popen(['python', '-W', 'ignore', script_name], 
-                              stdout=subprocess.PIPE, 
-                              stderr=subprocess.PIPE,
-                              text=True,
-                              env=env)
-    
-    # Stream stdout in real-time
-    while True:
-        output = process.stdout.readline()
-        if output == '' and process.poll() is not None:
-            break
-        if output:
-            print(output.strip())
-    
-    # Only show stderr if it contains actual errors (not INFO logs)
-    stderr = process.stderr.read()
-    if stderr and not stderr.strip().startswith(('INFO', '2025')):
+
+    start = time.time()
+    process = subprocess.run([sys.executable, '-W', 'ignore', script_name],
+                             capture_output=True,
+                             text=True,
+                             env=env)
+    return {
+        'returncode': process.returncode,
+        'stdout': process.stdout,
+        'stderr': process.stderr,
+        'seconds': time.time() - start,
+    }
+
+
+def init_worker():
+    """Sets up a worker process of the in-process runner (see run_in_process())."""
+    warnings.simplefilter('ignore')
+
+
+def run_in_process(script_name):
+    """
+    Run a script's main() in a worker process of the runner's pool with its output
+    buffered; returns the same fields as run_script(). Workers are reused, so each
+    analysis module is imported once per worker rather than once per run. A main()
+    returning None counts as a failure.
+    """
+    out, err = io.StringIO(), io.StringIO()
+    # Each worker runs one task at a time, so the task owns the process's streams
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',
+                        stream=err, force=True)
+    # Stage metrics then report this task's peak RSS, not an earlier task's
+    run_metrics.reset_peak_rss()
+    start = time.time()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            module = importlib.import_module(os.path.splitext(script_name)[0])
+            returncode = 0 if module.main() is not None else 1
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+    return {
+        'returncode': returncode,
+        'stdout': out.getvalue(),
+        'stderr': err.getvalue(),
+        'seconds': time.time() - start,
+    }
+
+
+def print_task_output(task, result):
+    """Print the buffered output of a finished (or skipped) task."""
+    name, script, description, _ = task
+    print("=" * 80)
+    print(f"{description} ({script})")
+    print("=" * 80)
+    if result['status'] == 'skipped':
+        print(f"Skipped: {result['reason']}")
+        print("\n")
+        return
+
+    print(result['stdout'].rstrip())
+
+    # Warnings (e.g. a stale snapshot) are shown; INFO progress logs are not
+    warning_lines = [line for line in result['stderr'].splitlines() if ' - WARNING - ' in line]
+    if warning_lines:
+        print("\nWARNINGS:")
+        print("\n".join(warning_lines))
+
+    # Errors are the stderr lines that are not INFO/WARNING logs
+    error_lines = [line for line in result['stderr'].splitlines()
+                   if line.strip() and ' - INFO - ' not in line and ' - WARNING - ' not in line]
+    if error_lines:
         print("\nERROR OUTPUT:")
-        print(stderr)
-    
-    # Make sure the process exited cleanly
-    return_code = process.poll()
-    if return_code != 0:
-        print(f"\nWARNING: Script exited with non-zero status: {return_code}")
-    
+        print("\n".join(error_lines))
+
+    if result['returncode'] != 0:
+        print(f"\nWARNING: Script exited with non-zero status: {result['returncode']}")
+    print(f"\n[{name}] finished in {result['seconds']:.1f}s")
     print("\n")
-    time.sleep(1)  # Brief pause between scripts
 
-def main():
-    """Run all analysis scripts from A to F."""
+
+def run_tasks(tasks, jobs, in_process=True):
+    """
+    Run tasks concurrently, at most `jobs` at a time, starting each one once its
+    dependencies have succeeded. Tasks run on a pool of worker processes calling
+    the scripts' main() functions, or as subprocesses when in_process is False.
+    Output is printed in task order as soon as a task and all tasks before it have
+    finished. Returns {name: result}.
+    """
+    if in_process:
+        # Worker processes run the CPU-bound analyses in parallel, unlike threads
+        # sharing the GIL; spawned workers inherit the run options from the environment
+        # (see crawl_db.set_run_options), like the subprocesses
+        run_task = run_in_process
+        executor = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=init_worker)
+    else:
+        # Threads only wait for the subprocesses
+        run_task = run_script
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    results = {}
+    pending = list(tasks)
+    running = {}
+    next_to_print = 0
+
+    with executor:
+        while pending or running:
+            # Start every task whose dependencies are resolved
+            for task in list(pending):
+                name, script, _, depends_on = task
+                if any(dep not in results for dep in depends_on):
+                    continue
+                pending.remove(task)
+                failed = [dep for dep in depends_on if results[dep]['status'] != 'ok']
+                if failed:
+                    results[name] = {'status': 'skipped', 'seconds': 0.0,
+                                     'reason': f"dependency failed: {', '.join(failed)}"}
+                else:
+                    running[executor.submit(run_task, script)] = task
+
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)[0]
+                    try:
+                        result = future.result()
+                        result['status'] = 'ok' if result['returncode'] == 0 else 'failed'
+                    except Exception as e:
+                        result = {'status': 'failed', 'returncode': None, 'stdout': '',
+                                  'stderr': f"ERROR running task: {e}", 'seconds': 0.0}
+                    results[name] = result
+
+            # Print finished tasks in their original order
+            while next_to_print < len(tasks) and tasks[next_to_print][0] in results:
+                task = tasks[next_to_print]
+                print_task_output(task, results[task[0]])
+                next_to_print += 1
+
+    return results
+
+
+def print_summary(tasks, results, wall_seconds):
+    """Print per-task status and timing."""
+    print("=" * 80)
+    print("Summary")
+    print("=" * 80)
+    for name, script, _, _ in tasks:
+        result = results[name]
+        print(f"  {script:<20} {result['status']:<8} {result['seconds']:>8.1f}s")
+    total = sum(result['seconds'] for result in results.values())
+    print(f"\n  Wall time: {wall_seconds:.1f}s (sum of task times: {total:.1f}s)")
+    print("\n")
+
+
+def print_stage_metrics(metrics_file):
+    """Print the per-stage metrics the analyses recorded during this run."""
+    records = run_metrics.load_metrics(metrics_file)
+    if not records:
+        return
+    print("=" * 80)
+    print(f"Stage Metrics ({metrics_file})")
+    print("=" * 80)
+    print("\n".join(run_metrics.format_summary(records)))
+    print("\n")
+
+
+def select_tasks(only=None, shared_scan=False, bootstrap_indexes=True, plots=True):
+    """Build the task list for the requested analyses."""
+    analyses = list(ANALYSIS_TASKS)
+    if shared_scan:
+        # Questions B, D and E share one pass over http_requests/http_responses
+        analyses = [task for task in analyses if task[0] not in SHARED_SCAN_NAMES]
+        analyses.append(SHARED_SCAN_TASK)
+    if only:
+        wanted = {name.strip().lower() for name in only.split(',') if name.strip()}
+        analyses = [task for task in analyses
+                    if task[0] in wanted or task[1] in wanted or set(task[0]) & wanted]
+
+    plotted = tuple(task[0] for task in analyses if task[0] in PLOTTED_NAMES)
+    if not bootstrap_indexes:
+        analyses = [(name, script, description, ()) for name, script, description, _ in analyses]
+    else:
+        analyses = [INDEX_TASK] + analyses
+    if plots and plotted:
+        analyses.append(PLOT_TASK + (plotted,))
+    return analyses
+
+
+def main(only=None, jobs=None, shared_scan=False, bootstrap_indexes=True, snapshot=None,
+         incremental=False, streaming=False, immutable=False, metrics_file=DEFAULT_METRICS_FILE,
+         in_process=True, plots=True, sketch=False, sample=None, sample_seed=0, sample_strata=None,
+         cache_dir=None, memory_budget=None):
+    """Run the analysis scripts from A to F concurrently."""
     print("Starting Web Privacy Analysis Pipeline")
-    print("This script will run all analysis tasks (A through F)")
+    # Each run starts a fresh metrics file; it is also inherited by subprocesses
+    # (see run_metrics.METRICS_FILE)
+    metrics_file = os.path.abspath(metrics_file)
+    open(metrics_file, 'w').close()
+    os.environ['CRAWL_METRICS_FILE'] = run_metrics.METRICS_FILE = metrics_file
+    # Read by the analyses when they run, and exported to worker processes and subprocesses
+    # Plotting is always taken off the analyses' critical path (see PLOT_TASK)
+    crawl_db.set_run_options(snapshot_dir=snapshot, incremental=incremental, streaming=streaming,
+                             immutable=immutable, defer_plots=True, sketch=sketch, sample=sample,
+                             sample_seed=sample_seed, sample_strata=sample_strata, cache_dir=cache_dir,
+                             memory_budget=memory_budget)
+    if streaming:
+        print("Question B will stream requests with bounded memory")
+    if sketch:
+        print("Questions B, D and F will keep fixed-memory sketches and report approximate results")
+    if sample:
+        strata = f", stratified by {sample_strata}" if sample_strata else ""
+        print(f"Questions B to F will only use a sample of the successful visits ({sample}, seed {sample_seed}{strata})")
+    if incremental:
+        print("Analyses that support it will only process visits not covered by their checkpoints")
+    if immutable:
+        print("Analyses will open the crawl as immutable (it must not be written during the run)")
+    if snapshot:
+        print(f"Questions B and C will load the columnar snapshot in {snapshot}; the others read the crawl DB")
+    if cache_dir:
+        print(f"Query and analysis results will be memoized in {cache_dir}")
+    if memory_budget is not None:
+        print(f"Questions E and F will spill per-visit state to disk beyond {memory_budget} MiB")
+    tasks = select_tasks(only, shared_scan, bootstrap_indexes, plots)
+    jobs = jobs or os.cpu_count() or 1
+    print(f"Running {len(tasks)} task(s) with up to {jobs} in parallel")
     print("\n")
-    
-    # List of scripts to run with descriptions
-    scripts = [
-        ("question_a.py", "Question A: Crawl Status Analysis"),
-        ("question_b.py", "Question B: Third-Party Analysis"),
-        ("question_c.py", "Question C: JavaScript Cookie Analysis"),
-        ("question_d.py", "Question D: HTTP Cookie Analysis"),
-        ("question_e.py", "Question E: Cookie Sync Analysis"),
-        ("question_f.py", "Question F: Fingerprinting API Analysis")
-    ]
-    
+
     # Verify all scripts exist
-    missing_scripts = []
-    for script, _ in scripts:
-        if not os.path.exists(script):
-            missing_scripts.append(script)
-    
+    missing_scripts = [script for _, script, _, _ in tasks if not os.path.exists(script)]
     if missing_scripts:
         print("ERROR: The following scripts are missing:")
         for script in missing_scripts:
             print(f"  - {script}")
         print("\nPlease ensure all script files are in the current directory.")
-        return
-    
-    # Run each script in sequence
-    all_succeeded = True
-    for script, description in scripts:
-        try:
-            run_script(script, description)
-        except Exception as e:
-            print(f"ERROR running {script}: {e}")
-            all_succeeded = False
-    
+        return False
+    if bootstrap_indexes and not os.path.exists(crawl_db.DB_FILE):
+        print(f"ERROR: Database file not found: {crawl_db.DB_FILE}")
+        return False
+
+    start = time.time()
+    results = run_tasks(tasks, jobs, in_process)
+    print_summary(tasks, results, time.time() - start)
+    print_stage_metrics(metrics_file)
+
+    all_succeeded = all(result['status'] == 'ok' for result in results.values())
     if all_succeeded:
         print("All analyses completed successfully!")
-        print("Generated plots:")
-        print("  - third_party_distribution.png (Question B)")
-        print("  - cookie_sync_distribution.png (Question E)")
+        names = {name for name, _, _, _ in tasks}
+        generated = [(plot, question) for plot, question, name in [
+            ("third_party_distribution.png", "Question B", "b"),
+            ("cookie_sync_distribution.png", "Question E", "e"),
+        ] if name in names and PLOT_TASK[0] in names]
+        if generated:
+            print("Generated plots:")
+            for plot, question in generated:
+                print(f"  - {plot} ({question})")
     else:
         print("Some analyses encountered errors. Please check the output above.")
+    return all_succeeded
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the web privacy analyses A through F.")
+    parser.add_argument('--only', help="Comma-separated analyses to run, e.g. 'a,c,f'.")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Maximum number of analyses running at once (default: CPU count).")
+    parser.add_argument('--shared-scan', action='store_true',
+                        help="Read http_requests/http_responses once for questions B, D and E.")
+    parser.add_argument('--skip-index-bootstrap', action='store_true',
+                        help="Do not create missing analysis indexes before running.")
+    parser.add_argument('--snapshot',
+                        help="Columnar snapshot directory written by crawl_snapshot.py (read by B and C only).")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Reuse per-analysis checkpoints and only process new visits (D, E, F).")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Stream http_requests in chunks in question B to bound memory.")
+    parser.add_argument('--sketch', action='store_true',
+                        help="Approximate B, D and F with fixed-memory sketches (HyperLogLog, Space-Saving).")
+    parser.add_argument('--sample', type=sample_arg,
+                        help="Only analyze a sample of the successful visits in B-F: a fraction (0.05) or a count (500).")
+    parser.add_argument('--sample-seed', type=int, default=0, help="Seed of the sample (default: %(default)s).")
+    parser.add_argument('--sample-strata', choices=sorted(crawl_db.SAMPLE_STRATA_KEYS),
+                        help="Draw the sample proportionally from strata of the visits.")
+    parser.add_argument('--cache', metavar='DIR',
+                        help="Memoize query and analysis results in DIR, keyed on the crawl DB and parameters.")
+    parser.add_argument('--memory-budget', type=memory_budget_arg, metavar='MIB',
+                        help="Spill the per-visit state of E and F to partitioned runs on disk beyond MIB MiB.")
+    parser.add_argument('--immutable', action='store_true',
+                        help="Open the crawl as immutable (no locking); only for crawls no longer written to.")
+    parser.add_argument('--subprocess', action='store_true',
+                        help="Start a fresh Python interpreter for every analysis instead of reusing worker processes.")
+    parser.add_argument('--no-plots', action='store_true',
+                        help="Only write the pre-binned histogram files; render them later with histograms.py.")
+    parser.add_argument('--metrics', default=DEFAULT_METRICS_FILE,
+                        help="JSONL file receiving the per-stage metrics of every analysis (default: %(default)s).")
+    args = parser.parse_args()
+    if args.sample and (args.incremental or args.snapshot):
+        parser.error("--sample cannot be combined with --incremental or --snapshot")
+    if args.snapshot and not any(task[0] in SNAPSHOT_NAMES
+                                 for task in select_tasks(args.only, args.shared_scan, False, False)):
+        parser.error("--snapshot only applies to questions B and C (not run by the shared scan)")
+    succeeded = main(only=args.only, jobs=args.jobs, shared_scan=args.shared_scan,
+                     bootstrap_indexes=not args.skip_index_bootstrap, snapshot=args.snapshot,
+                     incremental=args.incremental, streaming=args.streaming, immutable=args.immutable,
+                     metrics_file=args.metrics, in_process=not args.subprocess,
+                     plots=not args.no_plots, sketch=args.sketch, sample=args.sample,
+                     sample_seed=args.sample_seed, sample_strata=args.sample_strata, cache_dir=args.cache,
+                     memory_budget=args.memory_budget)
+    sys.exit(0 if succeeded else 1)
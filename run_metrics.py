@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then not reported
+    resource = None
+
+# --- Configuration ---
+# JSONL file the stage records are appended to; set by run_all_analyses.py. When
+# unset, stages are still timed but nothing is written.
+METRICS_FILE = os.environ.get('CRAWL_METRICS_FILE')
+
+
+# --- Helper Functions ---
+
+def cpu_seconds():
+    """
+    Returns the CPU time of this process and its waited-for children (e.g. scan
+    workers). Like the peak RSS, it covers every thread of the process, which the
+    runner gives to one analysis at a time.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def reset_peak_rss():
+    """
+    Resets the peak RSS reported by peak_rss_mib() to the current RSS, so that a
+    reused worker process reports the peak of its current task rather than of its
+    whole life. Only supported on Linux; returns False elsewhere.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mib():
+    """
+    Returns the peak resident set size of this process since it started or since
+    reset_peak_rss(), in MiB. It covers the whole process, so it is only an analysis'
+    own peak when no other analysis runs in the same process.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is not lowered by reset_peak_rss()
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Stage:
+    """A running stage; the analysis reports the rows it processes via add_rows()."""
+
+    def __init__(self, name, rows=0):
+        self.name = name
+        self.rows = rows
+        # Wall seconds of named parts of the stage, e.g. 'sqlite' and 'python'
+        self.parts = {}
+
+    def add_rows(self, count):
+        self.rows += count
+
+    @contextmanager
+    def part(self, name):
+        """Adds the wall time of the block to the named part; parts may be entered repeatedly."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.parts[name] = self.parts.get(name, 0.0) + time.perf_counter() - start
+
+
+class RunMetrics:
+    """
+    Records wall time, CPU time, rows, rows/s and peak RSS for each named stage of
+    one analysis. Every finished stage is appended as one JSON line to the metrics
+    file right away, so stages are kept even if the analysis exits early.
+    """
+
+    def __init__(self, analysis, path=None):
+        self.analysis = analysis
+        # Looked up on every construction so in-process runs see the runner's file
+        self.path = path or METRICS_FILE
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows=0):
+        stage = Stage(name, rows)
+        started_at = time.time()
+        wall_start = time.perf_counter()
+        cpu_start = cpu_seconds()
+        ok = False
+        try:
+            yield stage
+            ok = True
+        finally:
+            wall = time.perf_counter() - wall_start
+            record = {
+                'analysis': self.analysis,
+                'stage': name,
+                'pid': os.getpid(),
+                'started_at': round(started_at, 3),
+                'ok': ok,
+                'wall_seconds': round(wall, 6),
+                'cpu_seconds': round(cpu_seconds() - cpu_start, 6),
+                'rows': stage.rows,
+                'rows_per_second': round(stage.rows / wall, 1) if wall > 0 else None,
+                'peak_rss_mib': peak_rss_mib(),
+            }
+            if stage.parts:
+                record['parts'] = {part: round(seconds, 6) for part, seconds in stage.parts.items()}
+            self.records.append(record)
+            self._write(record)
+
+    def _write(self, record):
+        if not self.path:
+            return
+        try:
+            # Small appends are not interleaved, so concurrent analyses can share the file
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        except OSError as e:
+            logging.warning(f"Could not write metrics to {self.path}: {e}")
+
+
+def load_metrics(path):
+    """Returns the stage records of a metrics file, skipping malformed lines."""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def format_summary(records):
+    """Returns the stage records as table lines, grouped by analysis in order of first appearance."""
+    lines = [f"  {'analysis':<12} {'stage':<40} {'wall':>8} {'cpu':>8} {'rows':>10} {'rows/s':>12} {'peak RSS':>10}"]
+    analyses = list(dict.fromkeys(record['analysis'] for record in records))
+    for analysis in analyses:
+        for record in records:
+            if record['analysis'] != analysis:
+                continue
+            rows_per_second = f"{record['rows_per_second']:,.0f}" if record['rows'] and record['rows_per_second'] else '-'
+            rss = f"{record['peak_rss_mib']:.1f} MiB" if record.get('peak_rss_mib') is not None else '-'
+            stage = record['stage'] if record.get('ok', True) else record['stage'] + ' (failed)'
+            lines.append(f"  {analysis:<12} {stage:<40} {record['wall_seconds']:>7.2f}s {record['cpu_seconds']:>7.2f}s "
+                         f"{record['rows']:>10} {rows_per_second:>12} {rss:>10}")
+            for part, seconds in record.get('parts', {}).items():
+                lines.append(f"  {'':<12}   {part:<38} {seconds:>7.2f}s")
+    return lines
@@ -0,0 +1,107 @@
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+from crawl_db import ALL_SUCCESSFUL_VISITS_QUERY, run_option
+
+# Estimates for runs on a sample of the successful visits (see crawl_db.SAMPLE).
+# Means and proportions get analytic intervals (normal and Wilson), other
+# statistics percentile bootstrap intervals. All of them treat the sample as a
+# simple random sample of the successful visits and apply the finite population
+# correction; a stratified sample with proportional allocation is self-weighting,
+# so the estimates stay unbiased and the intervals are, if anything, conservative.
+
+# --- Configuration ---
+CONFIDENCE = 0.95
+BOOTSTRAP_RESAMPLES = 2000
+# Values drawn per block of bootstrap resamples, which bounds their memory
+BOOTSTRAP_BLOCK_VALUES = 1 << 21
+
+
+# --- Helper Functions ---
+
+def population_size(conn):
+    """Returns the number of successful visits the sample was drawn from."""
+    return conn.execute(f"SELECT COUNT(*) FROM ({ALL_SUCCESSFUL_VISITS_QUERY})").fetchone()[0]
+
+
+def finite_population_correction(n, population):
+    """Factor shrinking the standard error of a sample of n out of `population` items."""
+    if not population or n <= 0:
+        return 1.0
+    if n >= population:
+        return 0.0
+    return math.sqrt((population - n) / (population - 1))
+
+
+def z_value(confidence=CONFIDENCE):
+    """Returns the two-sided standard normal quantile for a confidence level."""
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def mean_estimate(values, population=None, confidence=CONFIDENCE):
+    """Returns the sample mean of `values` with a normal confidence interval."""
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    mean = float(values.mean()) if n else float('nan')
+    if n < 2:
+        return {'estimate': mean, 'low': mean, 'high': mean, 'n': n, 'method': 'normal'}
+    margin = (z_value(confidence) * values.std(ddof=1) / math.sqrt(n)
+              * finite_population_correction(n, population))
+    return {'estimate': mean, 'low': mean - margin, 'high': mean + margin, 'n': n, 'method': 'normal'}
+
+
+def proportion_estimate(successes, n, population=None, confidence=CONFIDENCE):
+    """Returns the share successes / n with a Wilson score confidence interval."""
+    if not n:
+        return {'estimate': float('nan'), 'low': float('nan'), 'high': float('nan'), 'n': 0, 'method': 'wilson'}
+    share = successes / n
+    # The finite population correction enters as a smaller effective z
+    z = z_value(confidence) * finite_population_correction(n, population)
+    denominator = 1 + z * z / n
+    center = (share + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(share * (1 - share) / n + z * z / (4 * n * n)) / denominator
+    return {'estimate': share, 'low': max(0.0, center - margin), 'high': min(1.0, center + margin), 'n': n,
+            'method': 'wilson'}
+
+
+def bootstrap_estimate(values, statistic, population=None, confidence=CONFIDENCE,
+                       resamples=BOOTSTRAP_RESAMPLES, seed=None):
+    """
+    Returns statistic(values) with a percentile bootstrap confidence interval.
+    `statistic` maps a 2-D array of resamples (one per row) to one value per row.
+    The resamples are drawn with `seed` (default: crawl_db.SAMPLE_SEED).
+    """
+    seed = run_option('SAMPLE_SEED', seed)
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    estimate = float(statistic(values[np.newaxis, :])[0]) if n else float('nan')
+    if n < 2:
+        return {'estimate': estimate, 'low': estimate, 'high': estimate, 'n': n, 'method': 'bootstrap'}
+    rng = np.random.default_rng(seed)
+    block = max(1, BOOTSTRAP_BLOCK_VALUES // n)
+    replicates = np.concatenate([statistic(values[rng.integers(0, n, size=(min(block, resamples - start), n))])
+                                 for start in range(0, resamples, block)])
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(replicates, [alpha, 1 - alpha])
+    # Shrink the interval around the estimate like the analytic ones
+    correction = finite_population_correction(n, population)
+    return {'estimate': estimate, 'low': estimate - (estimate - low) * correction,
+            'high': estimate + (high - estimate) * correction, 'n': n, 'method': 'bootstrap'}
+
+
+def describe_sample(n, population):
+    """Returns a one-line description of the sample the results are based on."""
+    strata = run_option('SAMPLE_STRATA')
+    strata = f", stratified by {strata}" if strata else ""
+    return (f"{n} of {population} successful visits "
+            f"(sample {run_option('SAMPLE')}, seed {run_option('SAMPLE_SEED')}{strata})")
+
+
+def print_estimates(estimates, description, confidence=CONFIDENCE):
+    """Prints sample estimates with their confidence intervals."""
+    print(f"\nSample estimates, {confidence:.0%} confidence intervals ({description}):")
+    for name, estimate in estimates.items():
+        print(f"  - {name}: {estimate['estimate']:.4g} [{estimate['low']:.4g}, {estimate['high']:.4g}] "
+              f"({estimate['method']})")
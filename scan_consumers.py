@@ -0,0 +1,528 @@
+from collections import Counter, defaultdict
+
+from cookie_utils import (
+    MIN_COOKIE_VALUE_LEN,
+    extract_cookie_name,
+    iter_set_cookie_pairs,
+    set_cookie_values_from_headers,
+)
+from fingerprint_scan import CooccurrenceMatrix, api_ids, empty_partial, scan_rows
+from sketches import (
+    HLL_PRECISION,
+    PAIR_FILTER_CAPACITY,
+    PAIR_FILTER_ERROR_RATE,
+    TOP_K_CAPACITY,
+    BloomFilter,
+    HyperLogLog,
+    SpaceSaving,
+    hash64,
+    hll_relative_error,
+    pair_hash,
+)
+from spill import ENTRY_OVERHEAD_BYTES, PartitionedSpill, over_budget
+from sync_matcher import CookieValueMatcher, url_tokens
+from table_scanner import DECODE_ERROR, bytes_column
+
+# Headers are read as bytes so that responses without Set-Cookie headers (most
+# of them) are skipped by a byte-level check instead of being JSON-decoded
+HEADERS_BYTES = bytes_column('headers')
+
+# Consumers for TableScanner. Each one holds the aggregates of a single analysis
+# so that several analyses can share one pass over a table. aggregates() and
+# merge() expose those aggregates in a mergeable form, e.g. for checkpoints.
+
+
+class SetCookieNameCounter:
+    """Counts cookie names set via HTTP Set-Cookie headers (question D)."""
+
+    table = 'http_responses'
+    columns = (HEADERS_BYTES,)
+
+    def __init__(self, cookie_name_counts=None):
+        # A Counter, or a SpaceSaving summary of the top names in sketch mode
+        self.cookie_name_counts = Counter() if cookie_name_counts is None else cookie_name_counts
+        self.processed_responses = 0
+        self.json_errors = 0
+        self.no_header_count = 0
+        self.set_cookie_headers_found = 0
+
+    def consume(self, batch):
+        # Responses skipped by the prefilter count as processed, so json_errors
+        # only covers responses that may set cookies
+        for headers in batch.set_cookie_headers(HEADERS_BYTES):
+            self.processed_responses += 1
+            if headers is None:
+                self.no_header_count += 1
+                continue
+            if headers is DECODE_ERROR:
+                self.json_errors += 1
+                continue
+            for header_value in iter_set_cookie_pairs(headers):
+                self.set_cookie_headers_found += 1
+                cookie_name = extract_cookie_name(header_value)
+                if cookie_name:
+                    self.cookie_name_counts[cookie_name] += 1
+
+    def aggregates(self):
+        return {
+            'cookie_name_counts': self.cookie_name_counts,
+            'processed_responses': self.processed_responses,
+            'json_errors': self.json_errors,
+            'no_header_count': self.no_header_count,
+            'set_cookie_headers_found': self.set_cookie_headers_found,
+        }
+
+    def merge(self, aggregates):
+        self.cookie_name_counts.update(aggregates['cookie_name_counts'])
+        self.processed_responses += aggregates['processed_responses']
+        self.json_errors += aggregates['json_errors']
+        self.no_header_count += aggregates['no_header_count']
+        self.set_cookie_headers_found += aggregates['set_cookie_headers_found']
+
+
+class SyncValueHarvester:
+    """
+    Collects the Set-Cookie values of each visit as cookie-sync candidates (question E).
+
+    With a memory_budget (MiB), the values are spilled to hash-partitioned runs on
+    disk (see spill.py) whenever their estimated size exceeds it; the
+    SyncRequestCounter then matches requests one partition at a time.
+    """
+
+    table = 'http_responses'
+    columns = (HEADERS_BYTES,)
+
+    def __init__(self, min_len=MIN_COOKIE_VALUE_LEN, memory_budget=None):
+        self.min_len = min_len
+        self.cookies_by_visit = defaultdict(set)
+        self.processed_responses = 0
+        self.memory_budget = memory_budget
+        self.estimated_bytes = 0
+        # Set once the values have been spilled, with the visits they belong to
+        self.spill = None
+        self.spilled_visits = set()
+        # Visits whose values were dropped by release()
+        self.released_visits = 0
+
+    def consume(self, batch):
+        visit_ids = batch.column('visit_id')
+        raw_headers = batch.column(HEADERS_BYTES)
+        decoded_headers = batch.set_cookie_headers(HEADERS_BYTES)
+        for visit_id, headers_json, headers in zip(visit_ids, raw_headers, decoded_headers):
+            if headers_json:
+                cookie_values = set_cookie_values_from_headers(headers, self.min_len)
+                if cookie_values:
+                    values = self.cookies_by_visit[visit_id]
+                    size = len(values)
+                    values.update(cookie_values)
+                    if len(values) != size:
+                        self.estimated_bytes += ((len(values) - size) * ENTRY_OVERHEAD_BYTES
+                                                 + sum(map(len, cookie_values)))
+            self.processed_responses += 1
+        if over_budget(self.estimated_bytes, self.memory_budget):
+            self.spill_values()
+
+    def spill_values(self):
+        """Moves the values held in memory to the on-disk runs."""
+        if self.spill is None:
+            self.spill = PartitionedSpill('question_e')
+        self.spill.write(list(self.cookies_by_visit.items()))
+        self.spilled_visits.update(self.cookies_by_visit)
+        self.cookies_by_visit.clear()
+        self.estimated_bytes = 0
+
+    def finish(self):
+        # Once spilling, every value goes to disk so partitions can be processed alone
+        if self.spill is not None and self.cookies_by_visit:
+            self.spill_values()
+
+    def load_partition(self, partition):
+        """Returns the spilled values of one partition, by visit."""
+        cookies_by_visit = defaultdict(set)
+        for visit_id, values in self.spill.read(partition):
+            cookies_by_visit[visit_id].update(values)
+        return cookies_by_visit
+
+    def release(self, visit_ids):
+        """Drops the values of finished visits whose requests have all been counted (see live_tail.py)."""
+        for visit_id in visit_ids:
+            values = self.cookies_by_visit.pop(visit_id, None)
+            if values is not None:
+                self.released_visits += 1
+                self.estimated_bytes -= len(values) * ENTRY_OVERHEAD_BYTES + sum(map(len, values))
+
+    def visits_with_values(self):
+        return (self.released_visits + len(self.spilled_visits)
+                + len(self.cookies_by_visit.keys() - self.spilled_visits))
+
+
+class SyncRequestCounter:
+    """
+    Counts, per visit, request URLs containing a cookie value set in that visit (question E).
+    Must be registered after the SyncValueHarvester it reads candidates from.
+
+    Each visit's raw and URL-encoded values are compiled once into a multi-pattern
+    matcher, so every URL is scanned in a single pass regardless of how many
+    values the visit set. When the harvester spilled its values, the request URLs
+    are spilled to the same partitions, and finish() matches them one partition at
+    a time.
+    """
+
+    table = 'http_requests'
+    columns = ('url',)
+
+    def __init__(self, harvester, check_encoded=True):
+        self.harvester = harvester
+        self.check_encoded = check_encoded
+        self.sync_counts = Counter()
+        self.processed_requests = 0
+        # Visits with cookies folded in from a checkpoint via merge()
+        self.merged_visits_with_cookies = 0
+        self._matchers = {}
+        self.request_spill = None
+
+    def matcher_for(self, visit_id, cookies_by_visit=None):
+        """Returns the (lazily built) cookie value matcher of a visit."""
+        matcher = self._matchers.get(visit_id)
+        if matcher is None:
+            cookies_by_visit = self.harvester.cookies_by_visit if cookies_by_visit is None else cookies_by_visit
+            matcher = CookieValueMatcher(cookies_by_visit[visit_id], self.check_encoded)
+            self._matchers[visit_id] = matcher
+        return matcher
+
+    def consume(self, batch):
+        if self.harvester.spill is not None:
+            self._spill_requests(batch)
+            return
+        self._count(zip(batch.column('visit_id'), batch.column('url')), self.harvester.cookies_by_visit)
+
+    def _count(self, requests, cookies_by_visit):
+        for visit_id, request_url in requests:
+            # Only process requests from visits that had cookies set
+            if visit_id not in cookies_by_visit or not request_url:
+                continue
+            matched_values = self.matcher_for(visit_id, cookies_by_visit).matches(request_url)
+            if matched_values:
+                self.sync_counts[visit_id] += len(matched_values)
+            self.processed_requests += 1
+
+    def _spill_requests(self, batch):
+        if self.request_spill is None:
+            self.request_spill = PartitionedSpill('question_e_requests', self.harvester.spill.partitions)
+        spilled_visits = self.harvester.spilled_visits
+        self.request_spill.write([(visit_id, url) for visit_id, url in zip(batch.column('visit_id'), batch.column('url'))
+                                  if visit_id in spilled_visits and url])
+
+    def finish(self):
+        self._matchers.clear()
+        if self.request_spill is None:
+            return
+        # Each partition's values are loaded and matched against its requests alone
+        for partition in range(self.request_spill.partitions):
+            self._count(self.request_spill.read(partition), self.harvester.load_partition(partition))
+            self._matchers.clear()
+        self.request_spill.close()
+        self.request_spill = None
+        self.harvester.spill.close()
+
+    def aggregates(self):
+        # Syncs are counted per visit, so the harvested cookie values are not
+        # needed once a visit's requests have been scanned
+        return {
+            'sync_counts': self.sync_counts,
+            'processed_requests': self.processed_requests,
+            'visits_with_cookies': self.visits_with_cookies(),
+        }
+
+    def merge(self, aggregates):
+        self.sync_counts.update(aggregates['sync_counts'])
+        self.processed_requests += aggregates['processed_requests']
+        self.merged_visits_with_cookies += aggregates['visits_with_cookies']
+
+    def visits_with_cookies(self):
+        return self.merged_visits_with_cookies + self.harvester.visits_with_values()
+
+    def release(self, visit_ids):
+        """Drops the sync counts of retired visits and returns them, by visit (see live_tail.py)."""
+        return {visit_id: self.sync_counts.pop(visit_id, 0) for visit_id in visit_ids}
+
+
+class CookieValueIndexer:
+    """
+    Builds an inverted index from each Set-Cookie value to the (visit_id, eTLD+1 of
+    the setting response) pairs it was set in, for the identifier-sharing graph.
+    """
+
+    table = 'http_responses'
+    columns = ('url', HEADERS_BYTES)
+
+    def __init__(self, get_etld1, min_len=MIN_COOKIE_VALUE_LEN):
+        self.get_etld1 = get_etld1
+        self.min_len = min_len
+        # cookie value -> set of (visit_id, setter domain)
+        self.index = defaultdict(set)
+        self.processed_responses = 0
+
+    def consume(self, batch):
+        visit_ids = batch.column('visit_id')
+        urls = batch.column('url')
+        raw_headers = batch.column(HEADERS_BYTES)
+        decoded_headers = batch.set_cookie_headers(HEADERS_BYTES)
+        for visit_id, url, headers_json, headers in zip(visit_ids, urls, raw_headers, decoded_headers):
+            self.processed_responses += 1
+            if not headers_json:
+                continue
+            cookie_values = set_cookie_values_from_headers(headers, self.min_len)
+            if not cookie_values:
+                continue
+            setter = self.get_etld1(url)
+            if not setter:
+                continue
+            for value in cookie_values:
+                self.index[value].add((visit_id, setter))
+
+
+class SyncGraphBuilder:
+    """
+    Counts setter -> receiver domain edges: requests to a domain whose URL carries,
+    as a path segment or parameter value, a cookie value set by another domain.
+    Must be registered after the CookieValueIndexer it looks values up in.
+    """
+
+    table = 'http_requests'
+    columns = ('url',)
+
+    def __init__(self, indexer, get_etld1, check_encoded=True):
+        self.indexer = indexer
+        self.get_etld1 = get_etld1
+        self.check_encoded = check_encoded
+        # (setter, receiver) -> number of requests, and those made in another
+        # visit (site) than the one the value was set in
+        self.edge_requests = Counter()
+        self.cross_site_requests = Counter()
+        # (setter, receiver) -> distinct identifiers and visits
+        self.edge_values = defaultdict(set)
+        self.edge_visits = defaultdict(set)
+        self.processed_requests = 0
+        self.matched_requests = 0
+
+    def consume(self, batch):
+        index = self.indexer.index
+        min_len = self.indexer.min_len
+        for visit_id, url in zip(batch.column('visit_id'), batch.column('url')):
+            if not url:
+                continue
+            self.processed_requests += 1
+            setters_by_edge = {}
+            for token in url_tokens(url, self.check_encoded):
+                if len(token) < min_len or token not in index:
+                    continue
+                for set_visit_id, setter in index[token]:
+                    setters_by_edge.setdefault(setter, []).append((token, set_visit_id))
+            if not setters_by_edge:
+                continue
+            receiver = self.get_etld1(url)
+            matched = False
+            for setter, matches in setters_by_edge.items():
+                if not receiver or setter == receiver:
+                    continue
+                matched = True
+                edge = (setter, receiver)
+                self.edge_requests[edge] += 1
+                if any(set_visit_id != visit_id for _, set_visit_id in matches):
+                    self.cross_site_requests[edge] += 1
+                self.edge_values[edge].update(token for token, _ in matches)
+                self.edge_visits[edge].add(visit_id)
+            self.matched_requests += matched
+
+    def edges(self):
+        """Returns the edges, most requests first, as (setter, receiver, requests,
+        cross_site_requests, identifiers, sites) tuples."""
+        return [(setter, receiver, count, self.cross_site_requests[(setter, receiver)],
+                 len(self.edge_values[(setter, receiver)]), len(self.edge_visits[(setter, receiver)]))
+                for (setter, receiver), count in self.edge_requests.most_common()]
+
+
+class CookieScriptCounter:
+    """
+    Counts the document.cookie writes of each script, with those made in a
+    first-party context and the number of sites (visits) it wrote on (question C).
+    Writes from visits without a site_visits row are skipped, as question C's join does.
+    """
+
+    table = 'javascript'
+    columns = ('script_url', 'symbol', 'operation')
+
+    def __init__(self, site_domains, get_etld1):
+        # site_domains maps visit_id -> eTLD+1 of the visited site
+        self.site_domains = site_domains
+        self.get_etld1 = get_etld1
+        self.operations = Counter()
+        self.first_party_operations = Counter()
+        self.sites = Counter()
+        # visit_id -> scripts that wrote during the visit
+        self._visit_scripts = defaultdict(set)
+        # All writes, including those of scripts without a URL
+        self.total_operations = 0
+
+    def consume(self, batch):
+        for visit_id, script_url, symbol, operation in zip(batch.column('visit_id'), batch.column('script_url'),
+                                                           batch.column('symbol'), batch.column('operation')):
+            if symbol != 'window.document.cookie' or operation != 'set' or visit_id not in self.site_domains:
+                continue
+            self.total_operations += 1
+            if script_url is None:
+                continue
+            self.operations[script_url] += 1
+            script_domain = self.get_etld1(script_url)
+            if script_domain is not None and script_domain == self.site_domains[visit_id]:
+                self.first_party_operations[script_url] += 1
+            scripts = self._visit_scripts[visit_id]
+            if script_url not in scripts:
+                scripts.add(script_url)
+                self.sites[script_url] += 1
+
+    def release(self, visit_ids):
+        """Drops the scripts seen in retired visits, whose sites are already counted (see live_tail.py)."""
+        for visit_id in visit_ids:
+            self._visit_scripts.pop(visit_id, None)
+
+    def top_script(self):
+        """Returns (script_url, operations, first-party operations) of the top script, ties by URL, or None."""
+        if not self.operations:
+            return None
+        script_url, count = min(self.operations.items(), key=lambda item: (-item[1], item[0]))
+        return script_url, count, self.first_party_operations[script_url]
+
+
+class FingerprintCallCounter:
+    """
+    Folds javascript rows into the question F aggregates of fingerprint_scan
+    (target API calls, sites, per-script party counts and API context masks).
+    """
+
+    table = 'javascript'
+    columns = ('script_url', 'symbol', 'top_level_url')
+
+    def __init__(self, target_api, fp_apis):
+        self.target_api = target_api
+        self.bits = api_ids(target_api, fp_apis)
+        self.partial = empty_partial()
+        # Co-occurrence counts of the contexts of released visits
+        self.released_cooccurrence = CooccurrenceMatrix(list(self.bits))
+
+    def consume(self, batch):
+        rows = list(zip(batch.column('visit_id'), batch.column('script_url'), batch.column('symbol'),
+                        batch.column('top_level_url')))
+        scan_rows(rows, self.target_api, self.bits, self.partial)
+
+    def release(self, visit_ids):
+        """Folds the context masks of retired visits into co-occurrence counts (see live_tail.py)."""
+        visit_ids = set(visit_ids)
+        context_masks = self.partial['context_masks']
+        released = [context for context in context_masks if context[0] in visit_ids]
+        if released:
+            self.released_cooccurrence.merge(CooccurrenceMatrix.from_masks(
+                self.released_cooccurrence.apis, [context_masks.pop(context) for context in released]))
+
+    def cooccurrence(self):
+        """Returns the co-occurrence matrix of every context, released or not."""
+        matrix = CooccurrenceMatrix.from_masks(self.released_cooccurrence.apis, self.partial['context_masks'].values())
+        matrix.merge(self.released_cooccurrence)
+        return matrix
+
+
+class ThirdPartyCounter:
+    """
+    Collects the distinct third-party eTLD+1s requested during each visit (question B).
+    Memory is bounded by the number of distinct (visit, third party) pairs, not by rows.
+    """
+
+    table = 'http_requests'
+    columns = ('url',)
+
+    def __init__(self, site_domains, get_etld1):
+        # site_domains maps visit_id -> eTLD+1 of the visited site
+        self.site_domains = site_domains
+        self.get_etld1 = get_etld1
+        self.third_parties_by_visit = defaultdict(set)
+        # Number of sites each third party was present on, updated as pairs are first seen
+        self.site_counts = Counter()
+        self.third_party_requests = 0
+
+    def consume(self, batch):
+        for visit_id, url in zip(batch.column('visit_id'), batch.column('url')):
+            site_domain = self.site_domains.get(visit_id)
+            if not site_domain:
+                continue
+            request_domain = self.get_etld1(url)
+            if request_domain and request_domain != site_domain:
+                self.third_party_requests += 1
+                domains = self.third_parties_by_visit[visit_id]
+                if request_domain not in domains:
+                    domains.add(request_domain)
+                    self.site_counts[request_domain] += 1
+
+    def third_party_site_counts(self):
+        """Returns a Counter of the number of sites each third party was present on."""
+        return self.site_counts
+
+    def release(self, visit_ids):
+        """Drops the third parties of retired visits and returns their numbers, by visit (see live_tail.py)."""
+        return {visit_id: len(self.third_parties_by_visit.pop(visit_id, ())) for visit_id in visit_ids}
+
+
+class ThirdPartySketch:
+    """
+    Approximate ThirdPartyCounter for sketch mode (question B). Each visit keeps a
+    HyperLogLog of its third parties, the number of sites per third party is kept
+    by a Space-Saving summary of the top third parties, and a Bloom filter over
+    (visit, third party) pairs tells when a pair is first seen.
+    """
+
+    table = 'http_requests'
+    columns = ('url',)
+
+    def __init__(self, site_domains, get_etld1, precision=HLL_PRECISION, top_k=TOP_K_CAPACITY,
+                 pair_capacity=PAIR_FILTER_CAPACITY, pair_error_rate=PAIR_FILTER_ERROR_RATE):
+        self.site_domains = site_domains
+        self.get_etld1 = get_etld1
+        self.precision = precision
+        # visit_id -> HyperLogLog; len() gives the (estimated) number of third parties
+        self.third_parties_by_visit = {}
+        self.site_counts = SpaceSaving(top_k)
+        self.pairs = BloomFilter(pair_capacity, pair_error_rate)
+        self.third_party_requests = 0
+
+    def consume(self, batch):
+        for visit_id, url in zip(batch.column('visit_id'), batch.column('url')):
+            site_domain = self.site_domains.get(visit_id)
+            if not site_domain:
+                continue
+            request_domain = self.get_etld1(url)
+            if request_domain and request_domain != site_domain:
+                self.third_party_requests += 1
+                domain_hash = hash64(request_domain)
+                domains = self.third_parties_by_visit.get(visit_id)
+                if domains is None:
+                    domains = self.third_parties_by_visit[visit_id] = HyperLogLog(self.precision)
+                domains.add_hash(domain_hash)
+                if self.pairs.add_hash(pair_hash(visit_id, domain_hash)):
+                    self.site_counts.add(request_domain)
+
+    def third_party_site_counts(self):
+        """Returns a SpaceSaving summary of the number of sites each top third party was present on."""
+        return self.site_counts
+
+    def error_bounds(self):
+        """Describes the error bounds of the approximate results."""
+        estimated = sum(1 for domains in self.third_parties_by_visit.values() if not domains.is_exact)
+        return {
+            'Third parties per site': (f"exact up to {(1 << self.precision) // 8}; {estimated} site(s) above "
+                                       f"that estimated with {hll_relative_error(self.precision):.2%} standard error"),
+            'Sites per third party': (f"overestimated by at most {self.site_counts.error_bound():.1f} "
+                                      f"(Space-Saving, {self.site_counts.capacity} counters)"),
+            'Missed (visit, third party) pairs': (f"at most {self.pairs.false_positive_rate():.2%} "
+                                                  f"({self.pairs.items_added} pairs in a filter sized for "
+                                                  f"{self.pairs.capacity})"),
+        }
@@ -0,0 +1,119 @@
+import sqlite3
+import logging
+
+from cookie_utils import MIN_COOKIE_VALUE_LEN
+from crawl_db import connect_readonly, run_option
+from etld_resolver import get_etld1
+from run_metrics import RunMetrics
+from scan_consumers import (
+    SetCookieNameCounter,
+    SyncRequestCounter,
+    SyncValueHarvester,
+    ThirdPartyCounter,
+)
+from table_scanner import TableScanner
+
+# --- Configuration ---
+DB_FILE = 'crawl-data-177.sqlite'
+CHECK_URL_ENCODED_VALUES = True
+
+
+def run_shared_scan(conn, check_encoded=CHECK_URL_ENCODED_VALUES, metrics=None):
+    """
+    Computes the question B, D and E aggregates with a single pass over
+    http_responses and a single pass over http_requests.
+    """
+    metrics = metrics or RunMetrics('shared_scan')
+    cursor = conn.cursor()
+    with metrics.stage("fetch successful visits") as stage:
+        cursor.execute(run_option('SUCCESSFUL_VISITS_QUERY'))
+        successful_visit_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT visit_id, site_url FROM site_visits")
+        site_urls = dict(cursor.fetchall())
+        stage.add_rows(len(successful_visit_ids))
+    logging.info(f"Found {len(successful_visit_ids)} successful visits.")
+
+    site_domains = {visit_id: get_etld1(site_urls.get(visit_id)) for visit_id in successful_visit_ids}
+
+    scanner = TableScanner(conn, successful_only=True, metrics=metrics)
+    # http_responses consumers come first: the sync counter needs the harvested values
+    cookie_names = scanner.register(SetCookieNameCounter())
+    harvester = scanner.register(SyncValueHarvester(min_len=MIN_COOKIE_VALUE_LEN))
+    sync_counter = scanner.register(SyncRequestCounter(harvester, check_encoded=check_encoded))
+    third_parties = scanner.register(ThirdPartyCounter(site_domains, get_etld1))
+    scanner.run()
+
+    return {
+        'successful_visit_ids': successful_visit_ids,
+        'site_urls': site_urls,
+        'cookie_names': cookie_names,
+        'sync_counter': sync_counter,
+        'third_parties': third_parties,
+    }
+
+
+def print_report(results):
+    """Prints the question B, D and E headline results."""
+    successful_visit_ids = results['successful_visit_ids']
+    site_urls = results['site_urls']
+
+    print("\n--- Question B: Third-Party Analysis ---")
+    third_parties = results['third_parties']
+    if successful_visit_ids:
+        counts = {visit_id: len(third_parties.third_parties_by_visit.get(visit_id, ()))
+                  for visit_id in successful_visit_ids}
+        max_visit_id = max(successful_visit_ids, key=counts.get)
+        print(f"Site with the highest number of third parties:")
+        print(f"  Site URL: {site_urls.get(max_visit_id)}")
+        print(f"  Number of Third Parties: {counts[max_visit_id]}")
+    site_counts = third_parties.third_party_site_counts()
+    if site_counts:
+        domain, count = site_counts.most_common(1)[0]
+        print(f"Most common third party (present on the largest number of sites):")
+        print(f"  Third Party Domain: {domain}")
+        print(f"  Number of Sites Present On: {count}")
+
+    print("\n--- Question D: HTTP Cookie Analysis ---")
+    cookie_name_counts = results['cookie_names'].cookie_name_counts
+    if cookie_name_counts:
+        cookie_name, count = cookie_name_counts.most_common(1)[0]
+        print(f"Most common cookie name set via HTTP Set-Cookie header:")
+        print(f"  Cookie Name: {cookie_name}")
+        print(f"  Times Set: {count}")
+    else:
+        print("No Set-Cookie headers were found in the responses for successful visits.")
+
+    print("\n--- Question E: Cookie Sync Analysis ---")
+    sync_counts = results['sync_counter'].sync_counts
+    if successful_visit_ids:
+        all_visit_sync_counts = {visit_id: sync_counts.get(visit_id, 0) for visit_id in successful_visit_ids}
+        visit_id, max_syncs = max(all_visit_sync_counts.items(), key=lambda item: item[1])
+        print(f"Maximum number of cookie syncs observed for a single visit: {max_syncs}")
+        print(f"Visit ID with max syncs: {visit_id}")
+        print(f"Site URL for max syncs: {site_urls.get(visit_id, 'Unknown')}")
+
+    print("\nNote: B, D and E were computed from one shared pass per table; no plots were generated.")
+
+
+# --- Main Analysis ---
+
+def main(db_path=DB_FILE, metrics=None):
+    """Runs the shared scan and prints the results; returns None on a database error."""
+    conn = None
+    try:
+        logging.info(f"Connecting to database: {db_path}")
+        conn = connect_readonly(db_path)
+        results = run_shared_scan(conn, metrics=metrics)
+        print_report(results)
+        return results
+    except sqlite3.Error as e:
+        logging.error(f"Database error: {e}")
+    finally:
+        if conn:
+            conn.close()
+            logging.info("Database connection closed.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
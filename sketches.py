@@ -0,0 +1,324 @@
+import heapq
+import math
+from array import array
+from hashlib import blake2b
+
+import numpy as np
+
+# Fixed-memory approximations of the exact aggregates kept by questions B, D and F,
+# used in sketch mode (see crawl_db.SKETCH). Every sketch reports the error bound
+# of its estimates:
+# - HyperLogLog counts distinct items, exactly up to a small number of items and
+#   with a relative standard error of 1.04 / sqrt(2 ** precision) beyond;
+# - SpaceSaving keeps the `capacity` most frequent items; a count overestimates
+#   the true count by at most its recorded error, and never by more than N / capacity;
+# - BloomFilter tells whether an item was seen before, with false positives
+#   (new items taken as seen) at a rate of at most error_rate up to `capacity` items.
+
+# --- Configuration ---
+# HyperLogLog registers are 2 ** precision bytes: 1 KiB and a 3.25% standard error
+HLL_PRECISION = 10
+# Precision of the single, crawl-wide HyperLogLogs: 16 KiB and a 0.81% standard error
+GLOBAL_HLL_PRECISION = 14
+# Counters kept by each Space-Saving summary
+TOP_K_CAPACITY = 1000
+# (visit, item) pairs the Bloom filter is sized for, and its false positive rate
+PAIR_FILTER_CAPACITY = 10_000_000
+PAIR_FILTER_ERROR_RATE = 0.01
+# Bytes of a Bloom filter whose set bits are counted at once (see BloomFilter.set_bits)
+POPCOUNT_BLOCK_BYTES = 1 << 20
+
+# Sketch sizes, part of the checkpoint parameters of analyses run in sketch mode
+SKETCH_PARAMS = {
+    'HLL_PRECISION': HLL_PRECISION,
+    'GLOBAL_HLL_PRECISION': GLOBAL_HLL_PRECISION,
+    'TOP_K_CAPACITY': TOP_K_CAPACITY,
+    'PAIR_FILTER_CAPACITY': PAIR_FILTER_CAPACITY,
+    'PAIR_FILTER_ERROR_RATE': PAIR_FILTER_ERROR_RATE,
+}
+
+MASK64 = (1 << 64) - 1
+# Number of set bits of every byte value
+BYTE_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+# --- Helper Functions ---
+
+def hash64(value):
+    """Returns a 64-bit hash of a value's string form that is stable across processes."""
+    return int.from_bytes(blake2b(str(value).encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+
+def mix64(h):
+    """Scrambles a 64-bit integer (the splitmix64 finalizer)."""
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & MASK64
+    return h ^ (h >> 31)
+
+
+def pair_hash(visit_id, item_hash):
+    """Combines a visit_id with an item's hash64() into the hash of the (visit, item) pair."""
+    return mix64(item_hash ^ ((visit_id * 0x9E3779B97F4A7C15) & MASK64))
+
+
+def hll_relative_error(precision):
+    """Relative standard error of a HyperLogLog estimate with 2 ** precision registers."""
+    return 1.04 / math.sqrt(1 << precision)
+
+
+def print_error_bounds(bounds):
+    """Prints the error bounds reported by the sketches of an analysis."""
+    print("\nApproximate results (sketch mode); error bounds:")
+    for description, bound in bounds.items():
+        print(f"  - {description}: {bound}")
+
+
+class HyperLogLog:
+    """
+    Estimates the number of distinct items added. Small sets are kept exactly as
+    their 64-bit hashes; past 2 ** precision / 8 items (the size of the registers)
+    they are folded into 2 ** precision registers. Supports len() and |= (merge),
+    so it can stand in for a set that is only counted.
+    """
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.sparse = array('Q')
+        self.registers = None
+
+    @property
+    def sparse_limit(self):
+        return (1 << self.precision) // 8
+
+    def add(self, value):
+        """Adds a value; returns True if the sketch changed."""
+        return self.add_hash(hash64(value))
+
+    def add_hash(self, h):
+        """Adds a value by its hash64(); returns True if the sketch changed."""
+        if self.registers is None:
+            if h in self.sparse:
+                return False
+            self.sparse.append(h)
+            if len(self.sparse) > self.sparse_limit:
+                self._densify(bytearray(1 << self.precision))
+            return True
+        # The top `precision` bits pick the register, which keeps the longest run
+        # of leading zeros (plus one) seen in the remaining bits
+        index = h >> (64 - self.precision)
+        rank = (64 - self.precision) - (h & ((1 << (64 - self.precision)) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    @property
+    def is_exact(self):
+        return self.registers is None
+
+    def count(self):
+        """Returns the (estimated) number of distinct items added."""
+        if self.registers is None:
+            return len(self.sparse)
+        m = len(self.registers)
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.exp2(-registers.astype(np.float64)).sum()
+        empty = int(np.count_nonzero(registers == 0))
+        if estimate <= 2.5 * m and empty:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = m * math.log(m / empty)
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+    def relative_error(self):
+        """Relative standard error of count(); 0 while the items are kept exactly."""
+        return 0.0 if self.registers is None else hll_relative_error(self.precision)
+
+    def merge(self, other):
+        """Adds the items of another HyperLogLog of the same precision."""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precisions")
+        if other.registers is None:
+            for h in other.sparse:
+                self.add_hash(h)
+            return
+        if self.registers is None:
+            self._densify(other.registers)
+            return
+        np.maximum(np.frombuffer(self.registers, dtype=np.uint8), np.frombuffer(other.registers, dtype=np.uint8),
+                   out=np.frombuffer(self.registers, dtype=np.uint8))
+
+    def _densify(self, registers):
+        """Switches to registers (a copy of `registers`) holding the items kept so far."""
+        hashes = self.sparse
+        self.registers = bytearray(registers)
+        self.sparse = array('Q')
+        for h in hashes:
+            self.add_hash(h)
+
+    def __ior__(self, other):
+        self.merge(other)
+        return self
+
+
+class SpaceSaving:
+    """
+    Keeps approximate counts of the `capacity` most frequent items (Metwally et
+    al.'s Space-Saving). When full, a new item replaces the least counted one and
+    inherits its count as error, so every count is an upper bound and count - error
+    a lower bound. Supports the Counter operations the analyses use
+    (c[item] += n, update(), most_common(), len()).
+    """
+
+    def __init__(self, capacity=TOP_K_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Total weight added, including that of items no longer kept
+        self.total = 0
+        # Min-heap of (count, item); entries go stale as counts grow and are
+        # refreshed lazily when they reach the top
+        self._heap = []
+
+    def add(self, item, count=1):
+        """Adds `count` occurrences of an item."""
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        error = 0
+        if len(self.counts) >= self.capacity:
+            evicted, error = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+        self.counts[item] = error + count
+        self.errors[item] = error
+        self._push(item)
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (self.counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, item) for item, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _peek_min(self):
+        heap = self._heap
+        while True:
+            count, item = heap[0]
+            current = self.counts.get(item)
+            if current == count:
+                return item, count
+            heapq.heappop(heap)
+            if current is not None:
+                heapq.heappush(heap, (current, item))
+
+    def _pop_min(self):
+        item, count = self._peek_min()
+        heapq.heappop(self._heap)
+        return item, count
+
+    def min_count(self):
+        """Upper bound on the true count of any item not kept (0 until the summary is full)."""
+        if len(self.counts) < self.capacity:
+            return 0
+        return self._peek_min()[1]
+
+    def error(self, item):
+        """Maximum overestimate of an item's count."""
+        return self.errors.get(item, self.min_count())
+
+    def error_bound(self):
+        """Maximum overestimate of any count, N / capacity."""
+        return self.total / self.capacity
+
+    def __getitem__(self, item):
+        return self.counts.get(item, 0)
+
+    def __setitem__(self, item, count):
+        self.add(item, count - self.counts.get(item, 0))
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, item):
+        return item in self.counts
+
+    def items(self):
+        return self.counts.items()
+
+    def most_common(self, n=None):
+        """Returns the n items with the highest counts, like Counter.most_common()."""
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return ranked if n is None else ranked[:n]
+
+    def update(self, counts):
+        """Adds a mapping of counts, or merges another SpaceSaving summary."""
+        if isinstance(counts, SpaceSaving):
+            self.merge(counts)
+            return
+        for item, count in counts.items():
+            self.add(item, count)
+
+    def merge(self, other):
+        """
+        Merges a summary over other data: an item missing from one summary gets
+        that summary's min_count() as count and error, which keeps every count an
+        upper bound; the `capacity` highest counts are kept.
+        """
+        own_min, other_min = self.min_count(), other.min_count()
+        merged = {}
+        for item in list(self.counts) + [item for item in other.counts if item not in self.counts]:
+            merged[item] = (self.counts.get(item, own_min) + other.counts.get(item, other_min),
+                            self.errors.get(item, own_min) + other.errors.get(item, other_min))
+        kept = sorted(merged.items(), key=lambda entry: entry[1][0], reverse=True)[:self.capacity]
+        self.counts = {item: count for item, (count, _) in kept}
+        self.errors = {item: error for item, (_, error) in kept}
+        self.total += other.total
+        self._heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+
+class BloomFilter:
+    """
+    Remembers which items (given by a 64-bit hash, e.g. pair_hash()) were seen,
+    in a fixed number of bits sized for `capacity` items at `error_rate` false
+    positives.
+    """
+
+    def __init__(self, capacity=PAIR_FILTER_CAPACITY, error_rate=PAIR_FILTER_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.items_added = 0
+
+    def add_hash(self, h):
+        """Adds an item by its hash; returns True if it was not seen before."""
+        # Double hashing: the k bit positions are h1 + i * h2
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        bits = self.bits
+        new = False
+        for i in range(self.num_hashes):
+            position = (h1 + i * h2) % self.num_bits
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                new = True
+        if new:
+            self.items_added += 1
+        return new
+
+    def false_positive_rate(self):
+        """Current probability that a new item is taken as already seen."""
+        return (self.set_bits() / self.num_bits) ** self.num_hashes
+
+    def set_bits(self):
+        """Number of bits set, counted a block of bytes at a time through a popcount table."""
+        data = np.frombuffer(self.bits, dtype=np.uint8)
+        # Only one block of counts is materialized, not one byte per bit
+        return sum(int(BYTE_POPCOUNT[data[start:start + POPCOUNT_BLOCK_BYTES]].sum(dtype=np.int64))
+                   for start in range(0, len(data), POPCOUNT_BLOCK_BYTES))
@@ -0,0 +1,77 @@
+import os
+import pickle
+import shutil
+import tempfile
+import weakref
+
+from sketches import MASK64, mix64
+
+# Hash-partitioned on-disk runs for per-visit state that outgrows the memory
+# budget (see crawl_db.MEMORY_BUDGET). Records are tuples whose first item is a
+# visit_id; each one is appended to the run file of its visit's partition, so all
+# state of a visit ends up in the same partition. An analysis then processes one
+# partition at a time, holding only that partition's state in memory, against the
+# records of the same partition from the other side (e.g. request URLs).
+
+# --- Configuration ---
+SPILL_PARTITIONS = 16
+# Directory the runs are written to (default: the system's temporary directory)
+SPILL_DIR = os.environ.get('CRAWL_SPILL_DIR')
+# Approximate in-memory size of one state entry besides its strings (set or dict
+# slot, tuple, int and str headers), used to compare the state with the budget
+ENTRY_OVERHEAD_BYTES = 120
+
+
+# --- Helper Functions ---
+
+def over_budget(estimated_bytes, memory_budget):
+    """Returns True if estimated_bytes exceeds a budget given in MiB (None: no budget)."""
+    return memory_budget is not None and estimated_bytes > memory_budget * (1 << 20)
+
+
+class PartitionedSpill:
+    """
+    Appends records to `partitions` run files, partitioned by a hash of their
+    visit_id, in a private temporary directory deleted by close() (or when the
+    object is garbage collected).
+    """
+
+    def __init__(self, name, partitions=SPILL_PARTITIONS, directory=None):
+        self.partitions = partitions
+        self.directory = tempfile.mkdtemp(prefix=f"{name}-spill-", dir=directory or SPILL_DIR)
+        self.records_written = 0
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+    def partition_of(self, visit_id):
+        return mix64(visit_id & MASK64) % self.partitions
+
+    def _path(self, partition):
+        return os.path.join(self.directory, f"{partition}.run")
+
+    def write(self, records):
+        """Appends (visit_id, ...) records, one pickled block per partition."""
+        blocks = [[] for _ in range(self.partitions)]
+        for record in records:
+            blocks[self.partition_of(record[0])].append(record)
+        for partition, block in enumerate(blocks):
+            if block:
+                with open(self._path(partition), 'ab') as f:
+                    pickle.dump(block, f, protocol=pickle.HIGHEST_PROTOCOL)
+                self.records_written += len(block)
+
+    def read(self, partition):
+        """Yields the records of one partition in the order they were written."""
+        path = self._path(partition)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    block = pickle.load(f)
+                except EOFError:
+                    return
+                yield from block
+
+    def close(self):
+        """Deletes the run files."""
+        self._finalizer()
@@ -0,0 +1,128 @@
+import argparse
+import csv
+import gzip
+import logging
+import sys
+
+from cookie_utils import MIN_COOKIE_VALUE_LEN
+from crawl_db import connect_readonly, run_option
+from etld_resolver import get_etld1
+from result_cache import cached_stage
+from run_metrics import RunMetrics
+from scan_consumers import CookieValueIndexer, SyncGraphBuilder
+from table_scanner import TableScanner
+
+# Cross-site identifier sharing: which domains receive the cookie values set by
+# other domains. One pass over http_responses indexes every Set-Cookie value by
+# the (visit, eTLD+1) pairs that set it; one pass over http_requests then looks up
+# the path segments and parameter values of each request URL in that index and
+# counts a setter -> receiver edge for every value set by another domain. Unlike
+# question E, which searches each URL for any substring equal to a value of the
+# same visit, values are matched across all visits, so an identifier set on one
+# site and sent to a third party on another counts as shared.
+
+# --- Configuration ---
+DB_PATH = 'crawl-data-177.sqlite'
+EDGE_LIST_FILE = 'sync_graph.csv'
+TOP_N = 20
+
+# Set to True to also look up the URL-decoded form of escaped URL components
+CHECK_URL_ENCODED_VALUES = True
+
+EDGE_LIST_COLUMNS = ('setter', 'receiver', 'requests', 'cross_site_requests', 'identifiers', 'sites')
+
+
+# --- Helper Functions ---
+
+def save_edge_list(edges, path=EDGE_LIST_FILE):
+    """Writes the edges as CSV, gzip-compressed if the path ends in .gz; returns the path."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EDGE_LIST_COLUMNS)
+        writer.writerows(edges)
+    return path
+
+
+# --- Analysis ---
+
+def analyze(conn, min_len=MIN_COOKIE_VALUE_LEN, check_encoded=CHECK_URL_ENCODED_VALUES, metrics=None):
+    """
+    Builds the identifier-sharing graph of the successful visits. Returns the edges,
+    most requests first, as (setter, receiver, requests, cross_site_requests,
+    identifiers, sites) tuples with the counts of the two passes.
+    """
+    metrics = metrics or RunMetrics('sync_graph')
+    indexer = CookieValueIndexer(get_etld1, min_len=min_len)
+    builder = SyncGraphBuilder(indexer, get_etld1, check_encoded=check_encoded)
+    scanner = TableScanner(conn, successful_only=True, metrics=metrics)
+    scanner.register(indexer)
+    scanner.register(builder)
+
+    logging.info(f"Indexing cookie values (min length {min_len})...")
+    scanner.scan_table('http_responses')
+    logging.info(f"Indexed {len(indexer.index)} cookie values from {indexer.processed_responses} responses.")
+
+    logging.info("Looking up cookie values in request URLs...")
+    scanner.scan_table('http_requests')
+    edges = builder.edges()
+    logging.info(f"{builder.matched_requests} of {builder.processed_requests} requests share an identifier "
+                 f"({len(edges)} edges).")
+    return {
+        'edges': edges,
+        'indexed_values': len(indexer.index),
+        'processed_requests': builder.processed_requests,
+        'matched_requests': builder.matched_requests,
+    }
+
+
+def print_report(results, top_n=TOP_N):
+    """Prints the edges with the most requests and the domains receiving the most identifiers."""
+    edges = results['edges']
+    print("\n--- Identifier Sharing Graph ---")
+    print(f"Cookie values indexed: {results['indexed_values']}")
+    print(f"Requests sharing an identifier: {results['matched_requests']} of {results['processed_requests']}")
+    print(f"Edges (setter -> receiver): {len(edges)}")
+    print(f"\nTop {top_n} edges by requests:")
+    for setter, receiver, requests, cross_site, identifiers, sites in edges[:top_n]:
+        print(f"  - {setter} -> {receiver}: {requests} requests ({cross_site} cross-site), "
+              f"{identifiers} identifiers, {sites} sites")
+
+    setters_by_receiver = {}
+    for setter, receiver, *_ in edges:
+        setters_by_receiver.setdefault(receiver, set()).add(setter)
+    ranked = sorted(setters_by_receiver.items(), key=lambda item: (-len(item[1]), item[0]))
+    print(f"\nTop {top_n} receivers by number of setters:")
+    for receiver, setters in ranked[:top_n]:
+        print(f"  - {receiver}: {len(setters)}")
+
+
+# --- Main Analysis Logic ---
+
+def main(db_path=DB_PATH, output=EDGE_LIST_FILE, metrics=None):
+    """Builds the graph, prints the report and writes the edge list; returns None on failure."""
+    metrics = metrics or RunMetrics('sync_graph')
+    print(f"Connecting to database: {db_path}")
+    conn = connect_readonly(db_path)
+    try:
+        # The scan is restricted to the successful visits, a sample of them with --sample
+        params = {'visits': run_option('SUCCESSFUL_VISITS_QUERY'), 'MIN_COOKIE_VALUE_LEN': MIN_COOKIE_VALUE_LEN,
+                  'CHECK_URL_ENCODED_VALUES': CHECK_URL_ENCODED_VALUES}
+        results = cached_stage(conn, 'sync_graph', params, lambda: analyze(conn, metrics=metrics))
+    finally:
+        conn.close()
+    print_report(results)
+    with metrics.stage("save edge list", rows=len(results['edges'])):
+        save_edge_list(results['edges'], output)
+    print(f"\nEdge list saved as {output}")
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build the cross-site identifier-sharing (cookie sync) graph.")
+    parser.add_argument('db', nargs='?', default=DB_PATH, help=f"Crawl database (default: {DB_PATH}).")
+    parser.add_argument('--output', default=EDGE_LIST_FILE,
+                        help=f"Edge list CSV, gzip-compressed if it ends in .gz (default: {EDGE_LIST_FILE}).")
+    args = parser.parse_args()
+    sys.exit(0 if main(args.db, args.output) is not None else 1)
@@ -0,0 +1,120 @@
+import re
+from collections import deque
+from urllib.parse import quote, unquote
+
+# Characters separating the path segments and query parameters of a URL
+URL_TOKEN_DELIMITERS = re.compile(r'[/?&;#]')
+
+
+def url_tokens(url, check_encoded=True):
+    """
+    Returns the candidate identifiers of a URL for exact lookups: every path segment
+    and query parameter, the value of each name=value parameter and, with
+    check_encoded, the URL-decoded form of those containing escapes.
+    """
+    tokens = set()
+    for part in URL_TOKEN_DELIMITERS.split(url):
+        if not part:
+            continue
+        tokens.add(part)
+        _, separator, value = part.partition('=')
+        if separator and value:
+            tokens.add(value)
+    if check_encoded:
+        tokens.update([unquote(token) for token in tokens if '%' in token])
+    return tokens
+
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton for finding many substrings in a text with one linear pass.
+
+    Each pattern is added with a key; `find_keys(text)` returns the set of keys of
+    every pattern that occurs somewhere in the text.
+    """
+
+    def __init__(self):
+        # Node 0 is the root. goto[n] maps a character to the next node,
+        # outputs[n] holds the keys of all patterns ending at node n.
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [set()]
+        self.built = False
+
+    def add(self, pattern, key):
+        """Adds a pattern reported as `key` when found. Empty patterns are ignored."""
+        if not pattern:
+            return
+        if self.built:
+            raise RuntimeError("Cannot add patterns after the automaton has been built")
+        node = 0
+        for char in pattern:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append(set())
+                self.goto[node][char] = next_node
+            node = next_node
+        self.outputs[node].add(key)
+
+    def build(self):
+        """Computes failure links breadth-first and merges outputs along them."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child] |= self.outputs[self.fail[child]]
+        # Freeze outputs so the scan loop only touches non-empty tuples
+        self.outputs = [tuple(keys) for keys in self.outputs]
+        self.built = True
+        return self
+
+    def find_keys(self, text):
+        """Returns the set of keys of all patterns occurring in `text`."""
+        if not self.built:
+            self.build()
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if outputs[node]:
+                found.update(outputs[node])
+        return found
+
+
+class CookieValueMatcher:
+    """
+    Matches a visit's cookie values, raw or URL-encoded, against request URLs.
+
+    A value counts once per URL whether its raw form, its `quote()`-encoded form
+    or both appear, which is the same rule question_e.py has always applied.
+    """
+
+    def __init__(self, values, check_encoded=True):
+        self.automaton = AhoCorasick()
+        for value in values:
+            self.automaton.add(value, value)
+            if check_encoded:
+                try:
+                    encoded_value = quote(value)
+                except UnicodeEncodeError:
+                    # Values that cannot be encoded (e.g. lone surrogates) are only matched raw
+                    continue
+                if encoded_value != value:
+                    self.automaton.add(encoded_value, value)
+        self.automaton.build()
+
+    def matches(self, url):
+        """Returns the set of cookie values found in the URL."""
+        return self.automaton.find_keys(url)
@@ -0,0 +1,182 @@
+import json
+import logging
+
+from cookie_utils import may_contain_set_cookie
+from crawl_db import join_successful_visits, visit_subset_clause, visit_subset_param
+from run_metrics import Stage
+
+# --- Configuration ---
+DEFAULT_BATCH_SIZE = 10000
+
+# Marker returned by Batch.decoded() for values that are not valid JSON
+DECODE_ERROR = object()
+
+# Suffix of a requested column name that makes SQLite return the column as bytes
+# (see bytes_column()), e.g. for byte-level prefilters
+BYTES_SUFFIX = ':bytes'
+
+
+# --- Helper Functions ---
+
+def decode_json(value):
+    """Decodes a JSON column value, returning None for NULL and DECODE_ERROR on failure."""
+    if value is None:
+        return None
+    try:
+        return json.loads(value)
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return DECODE_ERROR
+
+
+def bytes_column(name):
+    """Returns the name under which consumers request a column's raw bytes."""
+    return name + BYTES_SUFFIX
+
+
+def select_expression(alias, name):
+    """Returns the SQL expression selecting a requested column."""
+    if name.endswith(BYTES_SUFFIX):
+        return f"CAST({alias}.{name[:-len(BYTES_SUFFIX)]} AS BLOB)"
+    return f"{alias}.{name}"
+
+
+def decode_set_cookie_headers(value):
+    """
+    Decodes a headers JSON value given as bytes like decode_json(), except that
+    values which cannot contain a Set-Cookie header are not decoded: they are
+    returned as an empty header list, which yields no cookies in either format.
+    """
+    if value is None:
+        return None
+    if not may_contain_set_cookie(value):
+        return []
+    return decode_json(value)
+
+
+def consumer_columns(consumers):
+    """Returns the union of the columns requested by a table's consumers, visit_id first."""
+    columns = ['visit_id']
+    for consumer in consumers:
+        for name in consumer.columns:
+            if name not in columns:
+                columns.append(name)
+    return columns
+
+
+class Batch:
+    """A batch of rows from one table, shared by every consumer of that table."""
+
+    def __init__(self, table, columns, rows):
+        self.table = table
+        self.columns = columns
+        self.rows = rows
+        self.index = {name: position for position, name in enumerate(columns)}
+        self._decoded = {}
+
+    def column(self, name):
+        """Returns the raw values of one column."""
+        position = self.index[name]
+        return [row[position] for row in self.rows]
+
+    def decoded(self, name):
+        """Returns the JSON-decoded values of one column, decoding it at most once per batch."""
+        if name not in self._decoded:
+            self._decoded[name] = [decode_json(value) for value in self.column(name)]
+        return self._decoded[name]
+
+    def set_cookie_headers(self, name):
+        """
+        Returns decode_set_cookie_headers() of each value of a bytes headers column
+        (see bytes_column()), decoding it at most once per batch.
+        """
+        key = ('set-cookie', name)
+        if key not in self._decoded:
+            self._decoded[key] = [decode_set_cookie_headers(value) for value in self.column(name)]
+        return self._decoded[key]
+
+
+class TableScanner:
+    """
+    Reads each OpenWPM table once and hands every batch to all registered consumers.
+
+    A consumer is any object with a `table` name, the `columns` it needs and a
+    `consume(batch)` method; an optional `finish()` is called after its table has
+    been fully read. Tables are scanned in the order their first consumer was
+    registered, so consumers that depend on another table's results (e.g. cookie
+    values harvested from http_responses before scanning http_requests) only need
+    to be registered after the consumers they depend on.
+    """
+
+    def __init__(self, conn, visit_ids=None, successful_only=False, only_visits=None,
+                 batch_size=DEFAULT_BATCH_SIZE, metrics=None):
+        self.conn = conn
+        # Rows can be restricted in SQL, to successful visits or to an explicit
+        # set of visits (only_visits), or in Python to the visit_ids set
+        self.successful_only = successful_only
+        self.only_visits = only_visits
+        self.visit_ids = visit_ids
+        self.batch_size = batch_size
+        self.consumers = {}
+        self.rows_scanned = {}
+        # Optional RunMetrics; each table scan is then recorded as a 'scan <table>' stage
+        self.metrics = metrics
+
+    def register(self, consumer):
+        """Registers a consumer for its table and returns it for convenience."""
+        self.consumers.setdefault(consumer.table, []).append(consumer)
+        return consumer
+
+    def scan_table(self, table):
+        """Scans one table, feeding each batch to all of its consumers."""
+        if self.metrics is None:
+            self._scan_table(table, Stage(f"scan {table}"))
+            return
+        with self.metrics.stage(f"scan {table}") as stage:
+            self._scan_table(table, stage)
+
+    def _scan_table(self, table, stage):
+        consumers = self.consumers[table]
+        columns = consumer_columns(consumers)
+        logging.info(f"Scanning {table} ({', '.join(columns)}) for {len(consumers)} consumer(s)...")
+
+        query = f"SELECT {', '.join(select_expression('t', name) for name in columns)} FROM {table} t"
+        params = ()
+        if self.only_visits is not None:
+            query += f" WHERE {visit_subset_clause('t')}"
+            params = (visit_subset_param(self.only_visits),)
+        elif self.successful_only:
+            query += f" {join_successful_visits('t')}"
+        cursor = self.conn.cursor()
+        # Time in SQLite (query and fetch) and in the consumers is recorded separately
+        with stage.part('sqlite'):
+            cursor.execute(query, params)
+        scanned = 0
+        while True:
+            with stage.part('sqlite'):
+                rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            scanned += len(rows)
+            stage.add_rows(len(rows))
+            with stage.part('python'):
+                if self.visit_ids is not None:
+                    rows = [row for row in rows if row[0] in self.visit_ids]
+                    if not rows:
+                        continue
+                batch = Batch(table, columns, rows)
+                for consumer in consumers:
+                    consumer.consume(batch)
+        cursor.close()
+
+        with stage.part('python'):
+            for consumer in consumers:
+                if hasattr(consumer, 'finish'):
+                    consumer.finish()
+        self.rows_scanned[table] = scanned
+        logging.info(f"Finished scanning {scanned} rows from {table}.")
+
+    def run(self):
+        """Scans every table that has at least one consumer, exactly once each."""
+        for table in list(self.consumers):
+            self.scan_table(table)
+        return self.rows_scanned
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The analyses are top-level modules of the repository root
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import generate_synthetic_crawl  # noqa: E402
+
+# --- Configuration ---
+SYNTHETIC_VISITS = 60
+SYNTHETIC_SEED = 7
+
+
+@pytest.fixture(scope='session')
+def synthetic_crawl(tmp_path_factory):
+    """Path of a small synthetic crawl DB shared by the tests that only read it."""
+    path = str(tmp_path_factory.mktemp('crawl') / 'crawl-data-synthetic.sqlite')
+    generate_synthetic_crawl.generate(path, SYNTHETIC_VISITS, seed=SYNTHETIC_SEED)
+    return path
@@ -0,0 +1,13 @@
+from checkpoints import plan_incremental, save_checkpoint
+
+
+def test_plan_incremental_only_returns_new_visits(tmp_path):
+    db_path = str(tmp_path / 'crawl.sqlite')
+    params = {'MIN_COOKIE_VALUE_LEN': 6}
+    assert plan_incremental(db_path, 'test', params, [1, 2, 3]) == (None, set(), {1, 2, 3})
+
+    save_checkpoint(db_path, 'test', params, {1, 2}, {'total': 5})
+    assert plan_incremental(db_path, 'test', params, [1, 2, 3, 4]) == ({'total': 5}, {1, 2}, {3, 4})
+    # Other parameters, or visits missing from the crawl, invalidate the checkpoint
+    assert plan_incremental(db_path, 'test', {'MIN_COOKIE_VALUE_LEN': 8}, [1, 2, 3]) == (None, set(), {1, 2, 3})
+    assert plan_incremental(db_path, 'test', params, [2, 3]) == (None, set(), {2, 3})
@@ -0,0 +1,37 @@
+import random
+
+import numpy as np
+import pytest
+
+from fingerprint_scan import CooccurrenceMatrix
+
+APIS = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h', 'i']
+
+
+def random_masks(rng, count):
+    return [rng.getrandbits(len(APIS)) for _ in range(count)]
+
+
+def test_cooccurrence_matrices_over_disjoint_contexts_merge_by_addition():
+    masks = random_masks(random.Random(5), 2500)
+    merged = CooccurrenceMatrix.from_masks(APIS, masks[:1000])
+    merged.merge(CooccurrenceMatrix.from_masks(APIS, masks[1000:]))
+    expected = CooccurrenceMatrix.from_masks(APIS, masks)
+    assert np.array_equal(merged.counts, expected.counts)
+    for bit, api in enumerate(APIS):
+        assert merged.counts[bit, bit] == sum(1 for mask in masks if mask >> bit & 1)
+    assert merged.cooccurring('a')['b'] == sum(1 for mask in masks if mask & 0b11 == 0b11)
+
+
+def test_cooccurrence_matrices_over_other_apis_do_not_merge():
+    with pytest.raises(ValueError):
+        CooccurrenceMatrix(APIS).merge(CooccurrenceMatrix(APIS[::-1]))
+
+
+def test_cooccurrence_matrix_survives_save_and_load(tmp_path):
+    matrix = CooccurrenceMatrix.from_masks(APIS, random_masks(random.Random(6), 100))
+    path = str(tmp_path / 'cooccurrence.npz')
+    matrix.save(path)
+    loaded = CooccurrenceMatrix.load(path)
+    assert loaded.apis == APIS
+    assert np.array_equal(loaded.counts, matrix.counts)
@@ -0,0 +1,38 @@
+import sqlite3
+from contextlib import closing
+
+from generate_synthetic_crawl import generate
+
+# Columns compared between crawls (crawl_history's dtg is the time of writing)
+COLUMNS = {
+    'site_visits': 'visit_id, site_url',
+    'crawl_history': 'visit_id, command, command_status',
+    'http_requests': 'visit_id, url',
+    'http_responses': 'visit_id, url, headers',
+    'javascript': 'visit_id, script_url, symbol, operation',
+}
+
+
+def rows(path, table):
+    with closing(sqlite3.connect(path)) as conn:
+        return conn.execute(f"SELECT {COLUMNS[table]} FROM {table} ORDER BY rowid").fetchall()
+
+
+def test_same_seed_writes_the_same_crawl(tmp_path):
+    first, second = str(tmp_path / 'first.sqlite'), str(tmp_path / 'second.sqlite')
+    assert generate(first, 25, seed=11) == generate(second, 25, seed=11)
+    for table in COLUMNS:
+        assert rows(first, table) == rows(second, table)
+    other = str(tmp_path / 'other.sqlite')
+    generate(other, 25, seed=12)
+    assert rows(other, 'http_requests') != rows(first, 'http_requests')
+
+
+def test_crawl_has_failed_and_successful_visits(synthetic_crawl):
+    statuses = {visit_id: status for visit_id, command, status in rows(synthetic_crawl, 'crawl_history')
+                if command == 'GetCommand'}
+    assert sorted(statuses) == [visit_id for visit_id, _ in rows(synthetic_crawl, 'site_visits')]
+    assert set(statuses.values()) == {'ok', 'error'}
+    # Only successful visits made requests
+    successful = {visit_id for visit_id, status in statuses.items() if status == 'ok'}
+    assert {visit_id for visit_id, _ in rows(synthetic_crawl, 'http_requests')} <= successful
@@ -0,0 +1,23 @@
+import pytest
+
+import crawl_db
+
+
+def test_environment_options_are_parsed_when_first_used(monkeypatch):
+    monkeypatch.setenv('CRAWL_MEMORY_BUDGET', 'abc')
+    monkeypatch.setattr(crawl_db, 'MEMORY_BUDGET', crawl_db.FROM_ENVIRONMENT)
+    with pytest.raises(ValueError, match='Invalid CRAWL_MEMORY_BUDGET'):
+        crawl_db.run_option('MEMORY_BUDGET')
+
+    monkeypatch.setenv('CRAWL_MEMORY_BUDGET', '0.5')
+    assert crawl_db.run_option('MEMORY_BUDGET') == 0.5
+    monkeypatch.setenv('CRAWL_MEMORY_BUDGET', '2')
+    assert crawl_db.run_option('MEMORY_BUDGET') == 0.5  # parsed once
+
+
+def test_parse_memory_budget():
+    assert crawl_db.parse_memory_budget('0.25') == 0.25
+    assert crawl_db.parse_memory_budget('64') == 64
+    for budget in ['-1', 'nan', 'inf', 'abc']:
+        with pytest.raises(ValueError):
+            crawl_db.parse_memory_budget(budget)
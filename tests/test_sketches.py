@@ -0,0 +1,119 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from sketches import BloomFilter, HyperLogLog, SpaceSaving, hash64
+
+
+def test_hyperloglog_is_exact_while_sparse():
+    sketch = HyperLogLog(precision=10)
+    for value in range(sketch.sparse_limit):
+        sketch.add(f"item-{value}")
+        sketch.add(f"item-{value}")
+    assert sketch.is_exact
+    assert len(sketch) == sketch.sparse_limit
+    assert sketch.relative_error() == 0.0
+
+
+@pytest.mark.parametrize('distinct', [1000, 20000, 200000])
+def test_hyperloglog_estimate_is_within_its_error_bound(distinct):
+    sketch = HyperLogLog(precision=12)
+    for value in range(distinct):
+        sketch.add(f"item-{value}")
+    assert not sketch.is_exact
+    # Four standard errors: a failure is practically impossible for a correct sketch
+    assert abs(len(sketch) - distinct) <= 4 * sketch.relative_error() * distinct
+
+
+def test_hyperloglog_merge_counts_the_union():
+    left, right, union = HyperLogLog(precision=10), HyperLogLog(precision=10), HyperLogLog(precision=10)
+    for value in range(5000):
+        left.add(value)
+        union.add(value)
+    for value in range(3000, 9000):
+        right.add(value)
+        union.add(value)
+    left |= right
+    assert len(left) == len(union)
+    small = HyperLogLog(precision=10)
+    small.add('only')
+    small.merge(HyperLogLog(precision=10))
+    assert len(small) == 1
+    with pytest.raises(ValueError):
+        small.merge(HyperLogLog(precision=11))
+
+
+def zipf_stream(rng, items, length):
+    weights = [1 / rank for rank in range(1, items + 1)]
+    return rng.choices([f"item-{rank}" for rank in range(items)], weights, k=length)
+
+
+def test_space_saving_counts_bound_the_true_counts():
+    stream = zipf_stream(random.Random(2), 500, 20000)
+    exact = Counter(stream)
+    summary = SpaceSaving(capacity=50)
+    for item in stream:
+        summary.add(item)
+    assert len(summary) == 50
+    assert summary.total == len(stream)
+    for item, count in summary.items():
+        assert count - summary.error(item) <= exact[item] <= count
+        assert summary.error(item) <= summary.error_bound()
+    # Items that were evicted occur at most min_count() times
+    for item, count in exact.items():
+        if item not in summary:
+            assert count <= summary.min_count()
+    # The heavy hitters (more than N / capacity occurrences) are always kept
+    assert all(item in summary for item, count in exact.items() if count > summary.error_bound())
+
+
+def test_space_saving_merge_keeps_upper_bounds():
+    rng = random.Random(3)
+    first, second = zipf_stream(rng, 300, 8000), zipf_stream(rng, 300, 8000)
+    exact = Counter(first) + Counter(second)
+    merged, other = SpaceSaving(capacity=40), SpaceSaving(capacity=40)
+    merged.update(Counter(first))
+    other.update(Counter(second))
+    merged.update(other)
+    assert merged.total == len(first) + len(second)
+    assert len(merged) == 40
+    for item, count in merged.items():
+        assert count - merged.error(item) <= exact[item] <= count
+    top = [item for item, _ in exact.most_common(5)]
+    assert top == [item for item, _ in merged.most_common(5)]
+
+
+def test_space_saving_behaves_like_a_counter_below_capacity():
+    summary = SpaceSaving(capacity=10)
+    summary['a'] += 3
+    summary.update({'b': 2, 'a': 1})
+    assert summary['a'] == 4 and summary['b'] == 2 and summary['c'] == 0
+    assert summary.most_common(1) == [('a', 4)]
+    assert summary.error('a') == 0
+
+
+def test_bloom_filter_has_no_false_negatives_and_bounded_false_positives():
+    rng = random.Random(4)
+    bloom = BloomFilter(capacity=20000, error_rate=0.01)
+    added = [rng.getrandbits(64) for _ in range(20000)]
+    assert all(bloom.add_hash(h) for h in added[:100])
+    for h in added:
+        bloom.add_hash(h)
+    assert not any(bloom.add_hash(h) for h in added)
+    # Probing adds the probes too; 1000 of them barely change how full the filter is
+    probes = [rng.getrandbits(64) for _ in range(1000)]
+    false_positives = sum(not bloom.add_hash(h) for h in probes)
+    assert false_positives / len(probes) < 3 * bloom.error_rate
+    assert bloom.false_positive_rate() < 2 * bloom.error_rate
+
+
+def test_bloom_filter_counts_set_bits_without_unpacking():
+    bloom = BloomFilter(capacity=5000, error_rate=0.05)
+    assert bloom.set_bits() == 0 and bloom.false_positive_rate() == 0.0
+    for value in range(3000):
+        bloom.add_hash(hash64(value))
+    expected = int(np.unpackbits(np.frombuffer(bloom.bits, dtype=np.uint8)).sum())
+    assert bloom.set_bits() == expected
+    assert bloom.false_positive_rate() == (expected / bloom.num_bits) ** bloom.num_hashes
@@ -0,0 +1,38 @@
+import os
+from collections import defaultdict
+
+from spill import PartitionedSpill, over_budget
+
+
+def test_records_come_back_in_their_visits_partition_in_write_order(tmp_path):
+    spill = PartitionedSpill('test', partitions=4, directory=str(tmp_path))
+    records = [(visit_id % 37, f"value-{index}") for index, visit_id in enumerate(range(500))]
+    spill.write(records[:200])
+    spill.write(records[200:])
+    assert spill.records_written == len(records)
+
+    expected = defaultdict(list)
+    for record in records:
+        expected[spill.partition_of(record[0])].append(record)
+    read_back = []
+    for partition in range(spill.partitions):
+        partition_records = list(spill.read(partition))
+        assert partition_records == expected[partition]
+        read_back.extend(partition_records)
+    assert sorted(read_back) == sorted(records)
+
+
+def test_close_deletes_the_runs(tmp_path):
+    spill = PartitionedSpill('test', partitions=2, directory=str(tmp_path))
+    spill.write([(1, 'a'), (2, 'b')])
+    assert os.listdir(spill.directory)
+    spill.close()
+    assert not os.path.exists(spill.directory)
+    assert list(spill.read(0)) == []
+
+
+def test_over_budget():
+    assert not over_budget(10 << 20, None)
+    assert over_budget(1, 0)
+    assert not over_budget(1 << 20, 1)
+    assert over_budget((1 << 20) + 1, 1)
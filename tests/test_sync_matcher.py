@@ -0,0 +1,55 @@
+import random
+from urllib.parse import quote
+
+import pytest
+
+from sync_matcher import AhoCorasick, CookieValueMatcher
+
+
+def test_finds_overlapping_and_nested_patterns():
+    automaton = AhoCorasick()
+    for pattern in ('he', 'she', 'his', 'hers', 'xyz'):
+        automaton.add(pattern, pattern)
+    assert automaton.find_keys('ushers') == {'he', 'she', 'hers'}
+    assert automaton.find_keys('this') == {'his'}
+    assert automaton.find_keys('') == set()
+
+
+def test_ignores_empty_patterns_and_rejects_late_additions():
+    automaton = AhoCorasick()
+    automaton.add('', 'empty')
+    automaton.add('abc', 'abc')
+    assert automaton.find_keys('xxabcxx') == {'abc'}
+    with pytest.raises(RuntimeError):
+        automaton.add('def', 'def')
+
+
+def test_matches_like_a_substring_search():
+    rng = random.Random(1)
+    patterns = [''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(30)]
+    automaton = AhoCorasick()
+    for pattern in patterns:
+        automaton.add(pattern, pattern)
+    for _ in range(200):
+        text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 30)))
+        assert automaton.find_keys(text) == {pattern for pattern in patterns if pattern in text}
+
+
+def test_cookie_values_match_raw_or_url_encoded():
+    value = 'id=a b/c'
+    matcher = CookieValueMatcher([value, 'abcdef123'])
+    assert matcher.matches(f'https://sync.example/?uid={quote(value)}') == {value}
+    assert matcher.matches('https://sync.example/p/abcdef123/x?id=a b/c') == {value, 'abcdef123'}
+    assert matcher.matches('https://sync.example/?uid=other') == set()
+
+
+def test_encoded_values_are_only_matched_when_checked():
+    value = 'a b c d'
+    matcher = CookieValueMatcher([value], check_encoded=False)
+    assert matcher.matches(f'https://sync.example/?uid={quote(value)}') == set()
+
+
+def test_values_that_cannot_be_url_encoded_are_matched_raw():
+    value = 'abc\ud800def'
+    matcher = CookieValueMatcher([value, 'abcdef123'])
+    assert matcher.matches(f'https://sync.example/?uid={value}&id=abcdef123') == {value, 'abcdef123'}
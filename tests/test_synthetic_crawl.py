@@ -0,0 +1,111 @@
+import shutil
+import sqlite3
+from contextlib import closing
+from functools import partial
+
+import numpy as np
+import pytest
+
+import crawl_db
+import fingerprint_scan
+import question_b
+import question_d
+import question_e
+import question_f
+from table_scanner import TableScanner
+
+
+def analyze_e(db_path, **options):
+    with closing(crawl_db.connect_readonly(db_path)) as conn:
+        return question_e.analyze(conn, db_path, **options)
+
+
+def analyze_f(db_path, **options):
+    with closing(crawl_db.connect_readonly(db_path)) as conn:
+        return question_f.analyze(conn, db_path, **options)
+
+
+def analyze_d(db_path, **options):
+    with closing(crawl_db.connect_readonly(db_path)) as conn:
+        return question_d.analyze(conn, db_path, **options)
+
+
+def assert_same_f_results(results, expected):
+    assert results.keys() == expected.keys()
+    for key in expected:
+        if key == 'cooccurrence':
+            assert results[key].apis == expected[key].apis
+            assert np.array_equal(results[key].counts, expected[key].counts)
+        else:
+            assert results[key] == expected[key], key
+
+
+def test_spilled_e_and_f_match_the_in_memory_results(synthetic_crawl):
+    # A budget of 0 MiB spills all per-visit state
+    assert analyze_e(synthetic_crawl, incremental=False, memory_budget=0) == \
+        analyze_e(synthetic_crawl, incremental=False, memory_budget=None)
+    assert_same_f_results(analyze_f(synthetic_crawl, incremental=False, memory_budget=0),
+                          analyze_f(synthetic_crawl, incremental=False, memory_budget=None))
+
+
+def test_e_and_f_spilled_part_way_match_the_in_memory_results(synthetic_crawl, monkeypatch):
+    # Small batches and budgets spill part of the state while the last batches stay
+    # in memory, so contexts and visits straddle a spill
+    monkeypatch.setattr(question_e, 'TableScanner', partial(TableScanner, batch_size=300))
+    monkeypatch.setattr(fingerprint_scan, 'FETCH_SIZE', 500)
+    assert analyze_e(synthetic_crawl, incremental=False, memory_budget=0.02) == \
+        analyze_e(synthetic_crawl, incremental=False, memory_budget=None)
+    # A single worker scans in this process, where FETCH_SIZE is patched
+    assert_same_f_results(analyze_f(synthetic_crawl, incremental=False, workers=1, memory_budget=0.005),
+                          analyze_f(synthetic_crawl, incremental=False, workers=1, memory_budget=None))
+
+
+def test_sketches_stay_within_their_error_bounds(synthetic_crawl):
+    with closing(crawl_db.connect_readonly(synthetic_crawl)) as conn:
+        exact = question_b.analyze(conn, streaming=False, sketch=False)
+        sketched = question_b.analyze(conn, streaming=False, sketch=True)
+    assert sketched['error_bounds']
+    # Sites with few third parties are counted exactly
+    assert sketched['third_parties_per_site'].equals(exact['third_parties_per_site'])
+    top = sketched['third_party_site_counts']
+    for domain, count in top.items():
+        assert count - top.error(domain) <= exact['third_party_site_counts'][domain] <= count
+
+    exact_names = analyze_d(synthetic_crawl, incremental=False, sketch=False).cookie_name_counts
+    sketched_names = analyze_d(synthetic_crawl, incremental=False, sketch=True).cookie_name_counts
+    for name, count in sketched_names.items():
+        assert count - sketched_names.error(name) <= exact_names[name] <= count
+
+
+@pytest.fixture
+def growing_crawl(synthetic_crawl, tmp_path):
+    """
+    Returns (path, grow): the crawl at `path` first lacks the last third of its
+    successful visits; grow() puts the complete crawl in its place.
+    """
+    path = str(tmp_path / 'crawl-data-growing.sqlite')
+    shutil.copy(synthetic_crawl, path)
+    with closing(sqlite3.connect(path)) as conn:
+        visit_ids = [visit_id for (visit_id,) in conn.execute(
+            "SELECT visit_id FROM crawl_history WHERE command = 'GetCommand' AND command_status = 'ok' ORDER BY visit_id")]
+        later = visit_ids[2 * len(visit_ids) // 3:]
+        conn.executemany("DELETE FROM crawl_history WHERE visit_id = ?", [(visit_id,) for visit_id in later])
+        conn.commit()
+    return path, lambda: shutil.copy(synthetic_crawl, path)
+
+
+def test_incremental_runs_merge_checkpoints_into_the_full_results(synthetic_crawl, growing_crawl):
+    path, grow = growing_crawl
+    analyze_d(path, incremental=True)
+    partial_e = analyze_e(path, incremental=True)
+    analyze_f(path, incremental=True)
+    grow()
+
+    # The second runs only scan the new visits and merge them into the checkpoints
+    merged_e = analyze_e(path, incremental=True)
+    assert len(merged_e['sync_counts']) > len(partial_e['sync_counts'])
+    assert merged_e == analyze_e(synthetic_crawl, incremental=False)
+    assert_same_f_results(analyze_f(path, incremental=True), analyze_f(synthetic_crawl, incremental=False))
+    merged_d = analyze_d(path, incremental=True)
+    full_d = analyze_d(synthetic_crawl, incremental=False)
+    assert merged_d.cookie_name_counts == full_d.cookie_name_counts